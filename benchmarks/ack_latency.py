@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+# Bot/LLM libraries
+from source.utilities.workers import WorkerPool
+
+# Needed libraries
+from benchmarks.harness import FakeInteraction, generate_history, make_cog, make_config, percentiles
+from benchmarks.stub_ollama import StubOllama
+import argparse
+import tempfile
+import asyncio
+import json
+import time
+
+
+class InlineWorkers(WorkerPool):
+    """
+    Runs every step right on the event loop, the way prompts were handled before the worker pool
+    """
+    async def run(self, func, *args):
+        return func(*args)
+
+    async def run_blocking(self, func, *args):
+        return func(*args)
+
+
+async def run(kind: str, users: int, turns: int, path: str) -> dict:
+    """
+    Every user prompts at once while their histories load, reports how long acknowledging each interaction took
+    """
+    stub = StubOllama(parallel=4, prefill_seconds=0.01, response_tokens=20, tokens_per_second=2000)
+    await stub.start()
+
+    config = make_config(path, stub, workers={"kind": "process" if kind == "process" else "thread"})
+    cog = make_cog(config)
+    if kind == "inline":
+        cog.ollama_client.workers.close()
+        cog.ollama_client.workers = InlineWorkers(config)
+    await cog.cog_load()
+
+    # Interactions keep arriving while the first prompts are loading histories
+    interactions, tasks = [], []
+    start = time.perf_counter()
+    for user_id in range(1, users + 1):
+        interactions.append(FakeInteraction(user_id))
+        tasks.append(asyncio.create_task(cog.prompt.callback(cog, interactions[-1], "hello")))
+        await asyncio.sleep(0.005)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    await cog.cog_unload()
+    await stub.stop()
+
+    return {
+        "workers": kind,
+        "users": users,
+        "turns": turns,
+        "seconds": round(elapsed, 3),
+        "ack_ms": percentiles([interaction.ack_seconds for interaction in interactions]),
+    }
+
+
+def main() -> None:
+    """
+    p99 interaction acknowledgment latency under concurrent prompts, inline against the worker pools
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=500)
+    args = parser.parse_args()
+
+    results = []
+    for kind in ("inline", "thread", "process"):
+        # Fresh histories every run, the previous run cached their token counts
+        with tempfile.TemporaryDirectory() as path:
+            generate_history(path, args.users, args.turns)
+            results.append(asyncio.run(run(kind, args.users, args.turns, path)))
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# Bot/LLM libraries
+from source.utilities.ollama_client import OllamaClient
+from source.utilities.messages import Message
+
+# Needed libraries
+from types import SimpleNamespace
+import asyncio
+import logging
+import time
+import json
+
+GUILD_ID = 1
+USER_ID = 1
+TURNS = (10, 100, 1000)
+REPEATS = 5
+
+
+def legacy_build_prompt(client: OllamaClient, context: list, message: str) -> list:
+    """
+    The previous build_prompt loop, re-joining and re-tokenizing the whole prompt every iteration
+    """
+    while True:
+        messages = [{'role': 'system', 'content': ' '.join(client.config['llm']['pre_prompt'])}]
+        messages.extend(context)
+        messages.append({'role': 'user', 'content': message})
+
+        prompt = "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
+        prompt_tokens = client.context_handler.count_tokens(prompt)
+        if prompt_tokens <= client.context_handler.context_length:
+            return messages
+
+        del context[:2]
+
+
+def make_history(turns: int) -> list:
+    """
+    Builds a synthetic history of user/assistant turns
+    """
+    history = []
+    for turn in range(turns):
+        history.append({'role': 'user', 'content': f"Question number {turn}, what is a binary search and how does it work?"})
+        history.append({'role': 'assistant', 'content': f"Answer number {turn}: a binary search repeatedly halves a sorted range until it finds the value."})
+    return history
+
+
+def time_it(func) -> float:
+    """
+    Returns the best wall time of a few runs in milliseconds
+    """
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main() -> None:
+    """
+    Compares the legacy and incremental prompt builders at 10, 100 and 1,000 turns
+
+    Each size is measured twice, once with a context length that fits the whole history and
+    once with a context length that forces half of the history to be trimmed.
+    """
+    with open("config/settings.json", "r") as f:
+        config = json.loads(f.read())
+
+    bot = SimpleNamespace(logger=logging.getLogger("benchmark"))
+    client = OllamaClient(bot=bot, config=config)
+    context_handler = client.context_handler
+    loop = asyncio.new_event_loop()
+    results = []
+
+    for turns in TURNS:
+        history = make_history(turns)
+        full_tokens = context_handler.count_tokens("\n".join(f"{msg['role']}: {msg['content']}" for msg in history))
+
+        for label, context_length in (("fits", full_tokens * 2), ("trims half", full_tokens // 2)):
+            context_handler.context_length = context_length
+
+            legacy = time_it(lambda: legacy_build_prompt(client, [dict(msg) for msg in history], "hello"))
+
+            # Token counts are cached on the stored messages, so only the first prompt pays for them
+            cached = [Message.from_dict(msg) for msg in history]
+            for msg in cached:
+                context_handler.message_tokens(msg)
+
+            def incremental():
+                context_handler.evict_user(GUILD_ID, USER_ID)
+                context_handler.add_guild(GUILD_ID)
+                context_handler._make_resident(GUILD_ID, USER_ID, list(cached))
+                loop.run_until_complete(client.build_prompt(GUILD_ID, USER_ID, "hello"))
+
+            results.append({
+                "turns": turns,
+                "case": label,
+                "legacy_ms": round(legacy, 3),
+                "incremental_ms": round(time_it(incremental), 3),
+            })
+
+    loop.close()
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# Needed libraries
+from benchmarks.harness import make_cog, make_config, percentiles, prompt
+from benchmarks.stub_ollama import StubOllama
+import multiprocessing
+import argparse
+import tempfile
+import asyncio
+import json
+import time
+
+# What each run turns on over the baseline of no deadline and no hedging
+MODES = {
+    "baseline": {},
+    "deadlines": {"deadlines": {"max_seconds": 3.0}},
+    "deadlines_hedging": {
+        "deadlines": {"max_seconds": 3.0},
+        "hedging": {"enabled": True, "min_samples": 20, "min_seconds": 0.2},
+    },
+}
+
+
+async def serve(mode: str, prompts: int, rate: float, stall_every: int, stall_seconds: float) -> dict:
+    """
+    Prompts arriving at `rate` per second through the cog, against two stub nodes where every `stall_every`th
+    chat gets stuck for `stall_seconds`
+    """
+    from source.utilities.metrics import metrics
+
+    stubs = [
+        StubOllama(prefill_seconds=0.02, tokens_per_second=400, response_tokens=40, parallel=8,
+                   stall_every=stall_every, stall_seconds=stall_seconds)
+        for _ in range(2)
+    ]
+    for stub in stubs:
+        await stub.start()
+
+    with tempfile.TemporaryDirectory() as path:
+        config = make_config(
+            path, stubs[0],
+            llm={"hosts": [stub.url for stub in stubs], "warm_up": False},
+            scheduler={"max_inflight": 16},
+            **MODES[mode],
+        )
+        cog = make_cog(config)
+        await cog.cog_load()
+
+        async def arrive(user_id: int):
+            await asyncio.sleep((user_id - 1) / rate)
+            return await prompt(cog, user_id, message=f"question {user_id}")
+
+        start = time.perf_counter()
+        interactions = await asyncio.gather(*(arrive(user_id) for user_id in range(1, prompts + 1)))
+        elapsed = time.perf_counter() - start
+
+        await cog.cog_unload()
+
+    # Let the stubs notice the last dropped connections before reading their counters
+    await asyncio.sleep(0.2)
+    for stub in stubs:
+        await stub.stop()
+
+    counters = metrics.snapshot()["counters"]
+    return {
+        "mode": mode,
+        "prompts": prompts,
+        "seconds": round(elapsed, 3),
+        "latency_ms": percentiles([interaction.latency_seconds for interaction in interactions]),
+        "deadline_exceeded": int(counters.get("llm_deadline_exceeded", 0)),
+        "hedged_requests": int(counters.get("ollama_hedged_requests", 0)),
+        "hedge_wins": int(counters.get("ollama_hedge_wins", 0)),
+        "chats_cancelled": sum(stub.cancelled for stub in stubs),
+        "slot_seconds": round(sum(stub.busy_seconds for stub in stubs), 2),
+    }
+
+
+def run_mode(*args) -> dict:
+    """
+    Entry point of a worker process, so each mode starts with empty metrics
+    """
+    return asyncio.run(serve(*args))
+
+
+def main() -> None:
+    """
+    Tail latency and GPU time spent on stuck generations, without deadlines, with deadlines, and with hedging on top
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompts", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=10.0, help="Prompts arriving per second")
+    parser.add_argument("--stall-every", type=int, default=25, help="Every n-th chat of a node gets stuck")
+    parser.add_argument("--stall-seconds", type=float, default=10.0)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            results.append(pool.apply(run_mode, (mode, args.prompts, args.rate, args.stall_every, args.stall_seconds)))
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
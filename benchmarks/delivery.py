@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+# Bot/LLM libraries
+from source.utilities.delivery import FENCE, Delivery
+
+# Needed libraries
+from types import SimpleNamespace
+from typing import List
+import argparse
+import asyncio
+import random
+import json
+import time
+
+
+class RateLimitedWebhook:
+    def __init__(self, round_trip: float, bucket_requests: int, bucket_seconds: float, upload_bytes_per_second: float):
+        """
+        An interaction's followup webhook with Discord's rate limiting
+
+        Every request costs a round trip (plus the upload of an attached file). Once `bucket_requests` requests went
+        out in the last `bucket_seconds`, the next one is answered with a 429, and the sender waits the
+        `retry_after` it was given and tries again, the way discord.py does.
+        """
+        self.round_trip = round_trip
+        self.bucket_requests = bucket_requests
+        self.bucket_seconds = bucket_seconds
+        self.upload_bytes_per_second = upload_bytes_per_second
+
+        self.requests = 0
+        self.rate_limited = 0
+        self.messages: List[str] = []
+        self._window: List[float] = []
+
+        self.followup = SimpleNamespace(send=self.send)
+
+    async def send(self, content: str = "", file=None, **kwargs) -> None:
+        while True:
+            self.requests += 1
+            size = len(file.fp.getvalue()) if file is not None else 0
+            await asyncio.sleep(self.round_trip + size / self.upload_bytes_per_second)
+
+            now = time.monotonic()
+            self._window = [sent for sent in self._window if now - sent < self.bucket_seconds]
+            if len(self._window) < self.bucket_requests:
+                self._window.append(now)
+                self.messages.append(content)
+                return
+
+            self.rate_limited += 1
+            await asyncio.sleep(self._window[0] + self.bucket_seconds - now)
+
+
+def markdown_answer(characters: int, seed: int = 0, fence_line: int = 0) -> str:
+    """
+    A deterministic answer of at least `characters` characters, prose paragraphs with code blocks in between
+
+    With `fence_line`, every code block's opening line carries that many more characters after its language.
+    """
+    rng = random.Random(seed)
+    parts: List[str] = []
+    while sum(len(part) + 2 for part in parts) < characters:
+        if len(parts) % 3 == 2:
+            lines = [f"def step_{index}(values):\n    return [value * {index} for value in values]" for index in range(rng.randint(5, 60))]
+            parts.append("```python" + " # long fence line" * (fence_line // 18) + "\n" + "\n".join(lines) + "\n```")
+        else:
+            parts.append(" ".join(f"word{index}" for index in range(rng.randint(20, 200))) + ".")
+    return "\n\n".join(parts)
+
+
+async def sliced(webhook: RateLimitedWebhook, text: str) -> None:
+    """
+    The old delivery, every 2000 characters sent one after the other
+    """
+    for index in range(0, len(text), 2000):
+        await webhook.followup.send(text[index:index + 2000])
+
+
+def broken_code_blocks(messages: List[str]) -> int:
+    """
+    Messages that open or close a code block they don't contain both ends of
+    """
+    return sum(
+        sum(1 for line in message.split("\n") if line.strip().startswith(FENCE)) % 2
+        for message in messages
+    )
+
+
+async def measure(mode: str, characters: int, args: argparse.Namespace, fence_line: int = 0) -> dict:
+    """
+    Time from a finished answer to its last message being accepted by Discord
+    """
+    webhook = RateLimitedWebhook(args.round_trip, args.bucket_requests, args.bucket_seconds, args.upload_bytes_per_second)
+    text = markdown_answer(characters, fence_line=fence_line)
+
+    start = time.perf_counter()
+    if mode == "sliced":
+        await sliced(webhook, text)
+    else:
+        delivery = Delivery(config={"delivery": {
+            "attach_above": args.attach_above if mode == "attach" else None,
+            "bucket_requests": args.bucket_requests,
+            "bucket_seconds": args.bucket_seconds,
+        }})
+        await delivery.deliver(webhook, text)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "mode": mode,
+        "characters": len(text),
+        "fence_line": fence_line,
+        "seconds": round(elapsed, 3),
+        "messages": len(webhook.messages),
+        "requests": webhook.requests,
+        "rate_limited": webhook.rate_limited,
+        "broken_code_blocks": broken_code_blocks(webhook.messages),
+        "messages_over_limit": sum(len(message) > 2000 for message in webhook.messages),
+    }
+
+
+async def run(args: argparse.Namespace) -> list:
+    results = [
+        await measure(mode, characters, args)
+        for characters in args.sizes
+        for mode in ("sliced", "split", "attach")
+    ]
+
+    # Code blocks opened by a line that's longer than a message on its own
+    return results + [await measure("split", characters, args, fence_line=3000) for characters in args.sizes]
+
+
+def main() -> None:
+    """
+    Delivery time of 2k, 10k and 50k character answers: sliced every 2000 characters, split on markdown boundaries
+    and paced, and attached as a file past `--attach-above`
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2_000, 10_000, 50_000])
+    parser.add_argument("--round-trip", type=float, default=0.08, help="Seconds per request to Discord")
+    parser.add_argument("--bucket-requests", type=int, default=5)
+    parser.add_argument("--bucket-seconds", type=float, default=2.0)
+    parser.add_argument("--upload-bytes-per-second", type=float, default=1_000_000)
+    parser.add_argument("--attach-above", type=int, default=8000)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=4))
+
+
+if __name__ == "__main__":
+    main()
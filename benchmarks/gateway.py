@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+# Bot/LLM libraries
+from source.client.gateway import PROFILES, GatewayReport, gateway_options, rss_mb
+import discord
+
+# Needed libraries
+from datetime import datetime, timezone
+import multiprocessing
+import argparse
+import asyncio
+import json
+import time
+
+GUILD_ID = 1 << 22
+CHANNEL_ID = GUILD_ID + 1
+
+# Share of each event type in the synthetic traffic, and the intent Discord needs before sending it
+EVENT_MIX = (
+    ("PRESENCE_UPDATE", 0.80, "presences"),
+    ("MESSAGE_CREATE", 0.15, "guild_messages"),
+    ("TYPING_START", 0.04, "guild_typing"),
+    ("INTERACTION_CREATE", 0.01, None),
+)
+
+
+def user(user_id: int) -> dict:
+    """
+    A synthetic user payload
+    """
+    return {"id": str(user_id), "username": f"user{user_id}", "discriminator": "0", "avatar": None, "global_name": None}
+
+
+def guild_payload(members: int, presences: bool) -> dict:
+    """
+    A GUILD_CREATE of a guild with `members` members, as Discord sends it to (or chunks it for) the given intents
+    """
+    joined = datetime.now(timezone.utc).isoformat()
+    return {
+        "id": str(GUILD_ID),
+        "name": "Synthetic Guild",
+        "member_count": members,
+        "large": True,
+        "owner_id": "2",
+        "features": [],
+        "emojis": [],
+        "stickers": [],
+        "roles": [{
+            "id": str(GUILD_ID), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+            "hoist": False, "managed": False, "mentionable": False,
+        }],
+        "channels": [{"id": str(CHANNEL_ID), "type": 0, "name": "general", "position": 0, "permission_overwrites": []}],
+        "members": [
+            {"user": user(user_id), "roles": [], "joined_at": joined, "deaf": False, "mute": False, "flags": 0}
+            for user_id in range(2, members + 2)
+        ],
+        "presences": [
+            {"user": {"id": str(user_id)}, "status": "online", "activities": [], "client_status": {"desktop": "online"}}
+            for user_id in range(2, members + 2)
+        ] if presences else [],
+    }
+
+
+def event_payload(event: str, index: int, members: int) -> dict:
+    """
+    A synthetic gateway event from one of the guild's members
+    """
+    user_id = index % max(members, 1) + 2
+    if event == "PRESENCE_UPDATE":
+        status = ("online", "idle", "dnd")[index % 3]
+        return {"user": {"id": str(user_id)}, "guild_id": str(GUILD_ID), "status": status, "activities": [], "client_status": {"desktop": status}}
+    return {
+        "id": str(CHANNEL_ID + index + 1), "channel_id": str(CHANNEL_ID), "guild_id": str(GUILD_ID), "author": user(user_id),
+        "content": f"Message number {index} in a busy channel", "timestamp": datetime.now(timezone.utc).isoformat(),
+        "edited_timestamp": None, "tts": False, "mention_everyone": False, "mentions": [], "mention_roles": [],
+        "attachments": [], "embeds": [], "pinned": False, "type": 0,
+    }
+
+
+async def simulate(profile: str, members: int, events: int) -> dict:
+    """
+    Feeds a large guild and `events` events through a client with the profile's intents and caches,
+    dropping what Discord wouldn't send for those intents
+    """
+    options = gateway_options({"discord": {"gateway_profile": profile}})
+    intents: discord.Intents = options["intents"]
+    client = discord.Client(**options)
+    state = client._connection
+    report = GatewayReport(config={})
+    baseline = rss_mb()
+
+    # Guilds always arrive, their member list only with the members intent (the rest of it through chunking)
+    start = time.perf_counter()
+    report.record("GUILD_CREATE")
+    state._add_guild_from_data(guild_payload(members if intents.members else 0, intents.presences))
+
+    for index in range(events):
+        position = (index * 0.6180339887) % 1
+        for event, share, intent in EVENT_MIX:
+            if position < share:
+                break
+            position -= share
+
+        if intent is not None and not getattr(intents, intent):
+            continue
+
+        report.record(event)
+        if event == "PRESENCE_UPDATE":
+            state.parse_presence_update(event_payload(event, index, members))
+        elif event == "MESSAGE_CREATE":
+            state.parse_message_create(event_payload(event, index, members))
+    elapsed = time.perf_counter() - start
+
+    result = report.report(client)
+    await client.close()
+    return {
+        "profile": profile,
+        "events_received": result["events"],
+        "events_dropped_by_intents": events + 1 - result["events"],
+        "members_cached": result["members"],
+        "users_cached": result["users"],
+        "messages_cached": result["messages"],
+        "processing_seconds": round(elapsed, 3),
+        "rss_growth_mb": round(result["rss_mb"] - baseline, 1),
+    }
+
+
+def run_profile(profile: str, members: int, events: int) -> dict:
+    """
+    Entry point of a worker process
+    """
+    return asyncio.run(simulate(profile, members, events))
+
+
+def main() -> None:
+    """
+    Memory and gateway events of every profile on a large synthetic guild, each profile in a fresh process
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=100_000)
+    parser.add_argument("--events", type=int, default=100_000)
+    args = parser.parse_args()
+
+    results = []
+    for profile in PROFILES:
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            results.append(pool.apply(run_profile, (profile, args.members, args.events)))
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+# Needed libraries
+from benchmarks.stub_ollama import StubOllama
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+import statistics
+import resource
+import logging
+import json
+import time
+import os
+
+GUILD_ID = 1
+
+
+class FakeInteraction:
+    def __init__(self, user_id: int, guild_id: int = GUILD_ID):
+        """
+        Just enough of a discord.Interaction for the prompt command
+
+        Records when it was acknowledged and every followup message (time and size, attachments included), nothing reaches Discord.
+        """
+        self.created = time.perf_counter()
+        self.created_at = datetime.now(timezone.utc)
+        self.acked: Optional[float] = None
+        self.sent: List[tuple] = []
+
+        self.guild = SimpleNamespace(id=guild_id)
+        self.user = SimpleNamespace(id=user_id, name=f"user{user_id}")
+        self.response = SimpleNamespace(defer=self._defer, is_done=lambda: self.acked is not None)
+        self.followup = SimpleNamespace(send=self._send)
+
+    @property
+    def ack_seconds(self) -> float:
+        return self.acked - self.created
+
+    @property
+    def latency_seconds(self) -> float:
+        """
+        Time until the last followup message went out
+        """
+        return (self.sent[-1][0] if self.sent else time.perf_counter()) - self.created
+
+    async def _defer(self, **kwargs) -> None:
+        self.acked = time.perf_counter()
+
+    async def _send(self, content: str = "", file=None, **kwargs) -> SimpleNamespace:
+        # An attached answer counts with its file
+        size = len(content.encode()) + (len(file.fp.getvalue()) if file is not None else 0)
+        self.sent.append((time.perf_counter(), size))
+        return SimpleNamespace(edit=self._edit, delete=self._delete)
+
+    async def _edit(self, content: str = "", **kwargs) -> None:
+        self.sent.append((time.perf_counter(), len(content.encode())))
+
+    async def _delete(self, **kwargs) -> None:
+        pass
+
+
+def make_config(database_path: str, stub: StubOllama, **sections) -> dict:
+    """
+    A settings.json pointing at a stub server and a scratch database, `sections` override whole sections
+    """
+    config = {
+        "discord": {"token": "", "on_ready_channel": None},
+        "llm": {"pre_prompt": ["You are a helpful assistant."], "model": "stub", "hosts": [stub.url]},
+        "scheduler": {"max_inflight": stub.parallel, "max_queue": 100_000},
+        "database": {"path": database_path, "sqlite_path": f"{database_path}/concierge.sqlite3"},
+    }
+    for name, section in sections.items():
+        config[name] = {**config.get(name, {}), **section}
+    return config
+
+
+def make_cog(config: dict):
+    """
+    A PromptCommand cog on a bot that only has what the cog uses, imported here so cold starts can time the import
+    """
+    from source.cogs.prompt import PromptCommand
+
+    logging.getLogger("discord_bot").setLevel(logging.WARNING)
+    bot = SimpleNamespace(config=config, logger=logging.getLogger("discord_bot"), on_app_command_error=None)
+    return PromptCommand(bot)
+
+
+async def prompt(cog, user_id: int, guild_id: int = GUILD_ID, message: str = "hello") -> FakeInteraction:
+    """
+    Run a single /prompt through the cog
+    """
+    interaction = FakeInteraction(user_id, guild_id)
+    await cog.prompt.callback(cog, interaction, message)
+    return interaction
+
+
+def generate_history(path: str, users: int, turns: int, guilds: int = 1) -> None:
+    """
+    Writes a JSON database of `users` users with `turns` turns each, spread over `guilds` guilds
+    """
+    context = []
+    for turn in range(turns):
+        context.append({'role': 'user', 'content': f"Question number {turn}, what is a binary search and how does it work?"})
+        context.append({'role': 'assistant', 'content': f"Answer number {turn}: a binary search repeatedly halves a sorted range until it finds the value."})
+    data = json.dumps({"seq": 0, "context": context})
+
+    for user_id in range(1, users + 1):
+        guild_path = f"{path}/{guild_of(user_id, guilds)}"
+        os.makedirs(guild_path, exist_ok=True)
+        with open(f"{guild_path}/{user_id}.json", "w") as file:
+            file.write(data)
+
+
+def guild_of(user_id: int, guilds: int) -> int:
+    """
+    The guild `generate_history` puts a user in
+    """
+    return (user_id - 1) % guilds + GUILD_ID
+
+
+def percentiles(values: List[float], scale: float = 1000) -> Dict[str, float]:
+    """
+    p50/p95/p99/max of a list of seconds, in milliseconds by default
+    """
+    if not values:
+        return {}
+
+    values = sorted(values)
+
+    def at(percent: float) -> float:
+        return round(values[min(len(values) - 1, int(len(values) * percent))] * scale, 2)
+
+    return {"p50": round(statistics.median(values) * scale, 2), "p95": at(0.95), "p99": at(0.99), "max": round(values[-1] * scale, 2)}
+
+
+def max_rss_mb() -> float:
+    """
+    Peak resident memory of this process
+    """
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def directory_bytes(path: str) -> int:
+    """
+    Total size of the files under a directory
+    """
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# Bot/LLM libraries
+from source.utilities.context_manager import ContextManager
+from source.utilities.maintenance import Maintenance
+from source.utilities.memory_index import MemoryIndex
+from source.utilities.workers import WorkerPool
+from source.utilities.messages import Message
+
+# Needed libraries
+from benchmarks.harness import directory_bytes, generate_history, guild_of, percentiles
+import argparse
+import tempfile
+import asyncio
+import json
+import time
+import os
+
+DAY = 86400
+
+
+def inline_sweep(handler: ContextManager, ttl_days: float) -> None:
+    """
+    The same sweep done right on the event loop: list, expire, persist and compact without ever yielding
+    """
+    cutoff = time.time() - ttl_days * DAY
+    for key, (modified, _) in handler.database.usage().items():
+        if handler.last_active(*key, stored=modified) < cutoff:
+            handler.delete_user(*key)
+    handler.database.flush()
+    handler.database.compact_all(lambda size: None, handler.shards.owns)
+
+
+async def measure(mode: str, args: argparse.Namespace) -> dict:
+    """
+    Event loop lag while a sweep expires half of `--users` users and compacts every journal
+    """
+    with tempfile.TemporaryDirectory() as path:
+        generate_history(path, args.users, args.turns, guilds=args.guilds)
+
+        # Every other user went quiet long ago
+        for user_id in range(1, args.users + 1, 2):
+            stale = time.time() - 2 * args.ttl_days * DAY
+            os.utime(f"{path}/{guild_of(user_id, args.guilds)}/{user_id}.json", (stale, stale))
+
+        config = {
+            "llm": {"model": "stub"},
+            "database": {"path": path, "flush_interval": 3600},
+            "maintenance": {"ttl_days": args.ttl_days, "io_bytes_per_second": args.io_bytes_per_second},
+        }
+        handler = ContextManager(config=config)
+        workers = WorkerPool(config)
+        maintenance = Maintenance(config, handler, MemoryIndex(config, None, workers))
+
+        # The active users just chatted, so they all have a journal to compact
+        for user_id in range(2, args.users + 1, 2):
+            handler.database.append_context(guild_of(user_id, args.guilds), user_id, [Message("user", "hi"), Message("assistant", "hello")])
+        handler.database.flush()
+        before = directory_bytes(path)
+
+        # A heartbeat that should wake up every 10ms
+        lags, sweeping = [], True
+
+        async def heartbeat() -> None:
+            while sweeping:
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(max(0.0, time.perf_counter() - start - 0.01))
+
+        ticker = asyncio.create_task(heartbeat())
+        await asyncio.sleep(0.05)
+
+        start = time.perf_counter()
+        if mode == "inline":
+            inline_sweep(handler, args.ttl_days)
+        else:
+            await maintenance.run()
+        elapsed = time.perf_counter() - start
+
+        sweeping = False
+        await ticker
+
+        users = sum(len(users) for users in handler.database.list_users().values())
+        maintenance.stop()
+        workers.close()
+        handler.close()
+
+        return {
+            "mode": mode,
+            "users": args.users,
+            "seconds": round(elapsed, 3),
+            "users_left": users,
+            "bytes_before": before,
+            "bytes_after": directory_bytes(path),
+            "loop_lag_ms": percentiles(lags),
+        }
+
+
+async def run(args: argparse.Namespace) -> list:
+    return [await measure(mode, args) for mode in ("inline", "maintenance")]
+
+
+def main() -> None:
+    """
+    Event loop lag during a retention sweep done inline on the loop and with the maintenance job
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--ttl-days", type=float, default=30)
+    parser.add_argument("--io-bytes-per-second", type=float, default=50_000_000)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+# Bot/LLM libraries
+from source.utilities.ollama_client import OllamaClient
+
+# Needed libraries
+from benchmarks.harness import GUILD_ID, make_config
+from benchmarks.stub_ollama import StubOllama
+from types import SimpleNamespace
+import tempfile
+import asyncio
+import logging
+import json
+import time
+
+USER_ID = 1
+TURNS = (10, 100, 1000)
+
+
+async def run(turns: int, memory: bool) -> dict:
+    """
+    Builds a prompt for a user with `turns` turns of history, with or without long-term memory
+    """
+    stub = StubOllama()
+    await stub.start()
+
+    with tempfile.TemporaryDirectory() as path:
+        config = make_config(path, stub, memory={"enabled": memory})
+        client = OllamaClient(bot=SimpleNamespace(logger=logging.getLogger("benchmark")), config=config)
+        client.start()
+
+        # Fill the history, and the index when memory is on
+        for turn in range(turns):
+            question = f"Question number {turn}, what is a binary search and how does it work?"
+            answer = f"Answer number {turn}: a binary search repeatedly halves a sorted range until it finds the value."
+            client.context_handler.add_context(GUILD_ID, USER_ID, [{'role': 'user', 'content': question}, {'role': 'assistant', 'content': answer}])
+            client.memory.remember(GUILD_ID, USER_ID, question, answer)
+        await client.memory.close()
+
+        start = time.perf_counter()
+        messages = await client.build_prompt(GUILD_ID, USER_ID, "What did you tell me about binary searches?")
+        elapsed = time.perf_counter() - start
+
+        await client.close()
+
+    await stub.stop()
+    return {
+        "turns": turns,
+        "memory": memory,
+        "prompt_messages": len(messages),
+        "prompt_tokens": sum(client.context_handler.message_tokens(message) + 1 for message in messages),
+        "build_ms": round(elapsed * 1000, 2),
+    }
+
+
+def main() -> None:
+    """
+    Prompt size against history length, chronological history against long-term memory
+    """
+    logging.getLogger("discord_bot").setLevel(logging.WARNING)
+    results = [asyncio.run(run(turns, memory)) for turns in TURNS for memory in (False, True)]
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
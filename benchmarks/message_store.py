@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# Bot/LLM libraries
+from source.utilities.messages import History, Message
+
+# Needed libraries
+from benchmarks.harness import max_rss_mb
+import multiprocessing
+import argparse
+import json
+import time
+import gc
+
+MESSAGES_PER_USER = 10
+
+
+def user_data(user_id: int) -> str:
+    """
+    A user's stored history, as the database hands it over
+    """
+    context = []
+    for turn in range(MESSAGES_PER_USER // 2):
+        context.append({'role': 'user', 'content': f"Question {turn} of user {user_id}, when is the next club meeting?", 'tokens': 14})
+        context.append({'role': 'assistant', 'content': f"Answer {turn} for user {user_id}: the club meets every Thursday at 4pm.", 'tokens': 20})
+    return json.dumps(context)
+
+
+def measure(store: str, users: int) -> dict:
+    """
+    Keeps `users` histories resident the way ContextManager used to (dicts in lists) or does now (records in deques)
+    """
+    # Every user's JSON is decoded on its own like a real load, so no strings are shared between users
+    data = [user_data(user_id) for user_id in range(users)]
+    gc.collect()
+    baseline = max_rss_mb()
+
+    start = time.perf_counter()
+    if store == "dicts":
+        contexts = {user_id: json.loads(data[user_id]) for user_id in range(users)}
+    else:
+        contexts = {user_id: History(Message.from_dict(message) for message in json.loads(data[user_id])) for user_id in range(users)}
+    loaded = time.perf_counter() - start
+    del data
+    gc.collect()
+    resident = max_rss_mb()
+
+    # Trim a turn off the front of every history, the way build_prompt makes room
+    start = time.perf_counter()
+    for context in contexts.values():
+        if store == "dicts":
+            del context[:2]
+        else:
+            context.trim(2)
+    trimmed = time.perf_counter() - start
+
+    # The same on a single very long history, where a list shifts every remaining message each time
+    long_history = [Message('user', "hello") for _ in range(users * MESSAGES_PER_USER)]
+    long_history = long_history if store == "dicts" else History(long_history)
+    start = time.perf_counter()
+    for _ in range(1000):
+        if store == "dicts":
+            del long_history[:2]
+        else:
+            long_history.trim(2)
+    trimmed_long = time.perf_counter() - start
+
+    return {
+        "store": store,
+        "users": users,
+        "messages": users * MESSAGES_PER_USER,
+        "load_seconds": round(loaded, 3),
+        "trim_ms": round(trimmed * 1000, 2),
+        "trim_long_history_ms": round(trimmed_long * 1000, 2),
+        "resident_mb": round(resident - baseline, 1),
+    }
+
+
+def main() -> None:
+    """
+    Memory of resident histories at 10k and 100k users, legacy dicts against slotted records, each run in a fresh process
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    results = []
+    for users in args.users:
+        for store in ("dicts", "records"):
+            with multiprocessing.get_context("spawn").Pool(1) as pool:
+                results.append(pool.apply(measure, (store, users)))
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
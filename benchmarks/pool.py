@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+# LLM libraries
+from source.utilities.ollama_pool import OllamaPool
+
+# Needed libraries
+from benchmarks.stub_ollama import StubOllama
+import argparse
+import asyncio
+import time
+import json
+
+
+async def run(nodes: int, requests: int, down: int) -> dict:
+    """
+    Sends `requests` concurrent chats through a pool of `nodes` stub servers, `down` of which drop every request
+    """
+    stubs = [StubOllama(parallel=1) for _ in range(nodes)]
+    for stub in stubs:
+        await stub.start()
+    for stub in stubs[:down]:
+        stub.down = True
+
+    pool = OllamaPool({"llm": {"hosts": [stub.url for stub in stubs]}})
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(pool.chat(model="stub", messages=[{"role": "user", "content": f"question {index}"}]) for index in range(requests)),
+        return_exceptions=True
+    )
+    elapsed = time.perf_counter() - start
+
+    await pool.close()
+    for stub in stubs:
+        await stub.stop()
+
+    return {
+        "nodes": nodes,
+        "down": down,
+        "requests": requests,
+        "failed": sum(isinstance(result, Exception) for result in results),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(requests / elapsed, 2),
+        "served_per_node": [stub.requests for stub in stubs],
+    }
+
+
+def main() -> None:
+    """
+    Shows throughput scaling with the amount of Ollama nodes, and failover when a node is down
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=32)
+    args = parser.parse_args()
+
+    scenarios = [(1, 0), (2, 0), (4, 0), (4, 1)]
+    print(json.dumps([asyncio.run(run(nodes, args.requests, down)) for nodes, down in scenarios], indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+# Bot/LLM libraries
+from source.utilities.ollama_client import OllamaClient
+
+# Needed libraries
+from benchmarks.harness import GUILD_ID, make_config
+from benchmarks.stub_ollama import StubOllama
+from types import SimpleNamespace
+import argparse
+import tempfile
+import asyncio
+import logging
+import json
+import time
+
+USER_ID = 1
+
+
+async def run(block_turns: int, turns: int, context_length: int, prefill_per_token: float) -> dict:
+    """
+    A single user chatting `turns` turns past the context length, trimming `block_turns` turns at a time
+    """
+    stub = StubOllama(prefill_seconds=0.0, prefill_per_token=prefill_per_token, response_tokens=20, tokens_per_second=10_000)
+    await stub.start()
+
+    with tempfile.TemporaryDirectory() as path:
+        config = make_config(path, stub, llm={"trim_block_turns": block_turns, "warm_up": False})
+        client = OllamaClient(bot=SimpleNamespace(logger=logging.getLogger("benchmark")), config=config)
+        client.context_handler.context_length = context_length
+        client.start()
+
+        start = time.perf_counter()
+        for turn in range(turns):
+            await client.prompt(GUILD_ID, USER_ID, f"Question number {turn}, what is a binary search and how does it work?")
+        elapsed = time.perf_counter() - start
+
+        await client.close()
+
+    await stub.stop()
+    return {
+        "trim_block_turns": block_turns,
+        "turns": turns,
+        "seconds": round(elapsed, 3),
+        "prompt_tokens": stub.prompt_tokens,
+        "prefilled_tokens": stub.prefilled_tokens,
+        "reused_ratio": round(1 - stub.prefilled_tokens / stub.prompt_tokens, 3),
+    }
+
+
+def main() -> None:
+    """
+    Prompt tokens Ollama has to prefill once histories get trimmed, turn by turn against aligned blocks
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--context-length", type=int, default=1000, help="Prompt tokens before trimming starts")
+    parser.add_argument("--prefill-per-token", type=float, default=0.0002, help="Stub seconds per uncached prompt word")
+    parser.add_argument("--blocks", type=int, nargs="+", default=[1, 8, 16])
+    args = parser.parse_args()
+
+    logging.getLogger("discord_bot").setLevel(logging.WARNING)
+    results = [asyncio.run(run(block, args.turns, args.context_length, args.prefill_per_token)) for block in args.blocks]
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# Needed libraries
+from benchmarks.harness import make_cog, make_config, percentiles, prompt
+from benchmarks.stub_ollama import StubOllama
+import multiprocessing
+import argparse
+import tempfile
+import asyncio
+import json
+import time
+
+SIMPLE_PROMPTS = ("hi", "thanks!", "what's the capital of France?", "good morning", "tell me a joke")
+COMPLEX_PROMPTS = (
+    "explain why this fails:\nTraceback (most recent call last):\n  File \"bot.py\", line 12, in <module>\nKeyError: 'token'",
+    "```python\ndef search(values, target):\n    return values.index(target)\n```\nrefactor this into a binary search",
+    "compare quicksort and mergesort step by step",
+)
+
+
+def workload(prompts: int, complex_share: float) -> list:
+    """
+    A deterministic mix of small talk and prompts that need the large model
+    """
+    mix = []
+    for index in range(prompts):
+        position = (index * 0.6180339887) % 1
+        pool = COMPLEX_PROMPTS if position < complex_share else SIMPLE_PROMPTS
+        mix.append(pool[index % len(pool)])
+    return mix
+
+
+async def serve(routing: bool, prompts: int, complex_share: float, large_speed: float, small_speed: float) -> dict:
+    """
+    Every prompt of the workload at once through the cog, each from its own user, against one stub GPU
+    serving a large and a small model
+    """
+    from source.utilities.metrics import metrics
+
+    stub = StubOllama(
+        prefill_seconds=0.02, tokens_per_second=large_speed, response_tokens=100, parallel=4,
+        model_tokens_per_second={"small": small_speed},
+    )
+    await stub.start()
+
+    with tempfile.TemporaryDirectory() as path:
+        config = make_config(
+            path, stub,
+            llm={"model": "large", "warm_up": False},
+            routing={
+                "enabled": routing,
+                "routes": [{"model": "small", "max_prompt_tokens": 1024, "num_predict": 60, "simple_only": True}, {}],
+                "shed_queue_depth": None,
+            },
+        )
+        cog = make_cog(config)
+        await cog.cog_load()
+
+        start = time.perf_counter()
+        interactions = await asyncio.gather(*(
+            prompt(cog, user_id, message=message) for user_id, message in enumerate(workload(prompts, complex_share), start=1)
+        ))
+        elapsed = time.perf_counter() - start
+
+        await cog.cog_unload()
+    await stub.stop()
+
+    counters = metrics.snapshot()["counters"]
+    timings = metrics.snapshot()["timings"]
+    return {
+        "routing": routing,
+        "prompts": len(interactions),
+        "seconds": round(elapsed, 3),
+        "prompts_per_second": round(len(interactions) / elapsed, 2),
+        "latency_ms": percentiles([interaction.latency_seconds for interaction in interactions]),
+        "chats_per_model": stub.chats,
+        "answers_per_model": {
+            name: int(value) for name, value in counters.items() if name.startswith("route_answers")
+        },
+        "mean_model_seconds": {
+            name: round(timing["sum"] / timing["count"], 3) for name, timing in timings.items() if name.startswith("route_seconds")
+        },
+    }
+
+
+async def escalations_uncached() -> bool:
+    """
+    Whether an answer the large model gave after the small one had nothing to say stays out of the small model's
+    cache entries, while the small model's own answers are cached
+    """
+    stub = StubOllama(prefill_seconds=0.0, tokens_per_second=10_000, response_tokens=20, parallel=4, silent_models=["small"])
+    await stub.start()
+
+    with tempfile.TemporaryDirectory() as path:
+        config = make_config(
+            path, stub,
+            llm={"model": "large", "warm_up": False},
+            routing={"enabled": True, "routes": [{"model": "small", "simple_only": True}, {}]},
+            cache={"enabled": True},
+        )
+        cog = make_cog(config)
+        await cog.cog_load()
+
+        # Both escalate to the large model, then the small one answers once and the last prompt is a cache hit
+        for user_id in (1, 2):
+            await prompt(cog, user_id, message="hi")
+        stub.silent_models = []
+        for user_id in (3, 4):
+            await prompt(cog, user_id, message="hi")
+
+        await cog.cog_unload()
+    await stub.stop()
+    return stub.chats == {"small": 3, "large": 2}
+
+
+def run_mode(*args) -> dict:
+    """
+    Entry point of a worker process, so each mode starts with empty metrics
+    """
+    return asyncio.run(serve(*args))
+
+
+def main() -> None:
+    """
+    Throughput and latency of a mixed workload with every prompt on the large model, then routed by size and complexity
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompts", type=int, default=200)
+    parser.add_argument("--complex-share", type=float, default=0.3, help="Share of prompts that need the large model")
+    parser.add_argument("--large-tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--small-tokens-per-second", type=float, default=1600.0)
+    args = parser.parse_args()
+
+    results = []
+    for routing in (False, True):
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            results.append(pool.apply(run_mode, (
+                routing, args.prompts, args.complex_share, args.large_tokens_per_second, args.small_tokens_per_second
+            )))
+
+    results[-1]["escalated_answers_uncached"] = asyncio.run(escalations_uncached())
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
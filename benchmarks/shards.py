@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# Bot/LLM libraries
+from source.utilities.sharding import partition, shard_of
+
+# Needed libraries
+from benchmarks.harness import make_cog, make_config, prompt
+from benchmarks.stub_ollama import StubOllama
+from typing import List
+import multiprocessing
+import argparse
+import tempfile
+import asyncio
+import json
+import time
+
+SHARD_COUNT = 8
+
+
+def guild_ids(guilds: int) -> List[int]:
+    """
+    Guild IDs spread evenly over the shards, the shard is taken from the timestamp bits of a snowflake
+    """
+    return [guild << 22 for guild in range(1, guilds + 1)]
+
+
+async def serve_shards(path: str, backend: str, shard_ids: List[int], guilds: int, users: int, turns: int,
+                       prefill_seconds: float, parallel: int) -> dict:
+    """
+    A single process running `shard_ids`, every user of its guilds chats `turns` turns at the same time
+
+    Each process prompts an Ollama node of its own that takes `prefill_seconds` per prompt and generates `parallel`
+    answers at once, like shards spread over machines that each have a GPU.
+    """
+    stub = StubOllama(prefill_seconds=prefill_seconds, tokens_per_second=10_000, response_tokens=20, parallel=parallel)
+    await stub.start()
+
+    config = make_config(path, stub, discord={"shard_count": SHARD_COUNT, "shard_ids": shard_ids}, database={"backend": backend})
+    cog = make_cog(config)
+    await cog.cog_load()
+
+    owned = [guild_id for guild_id in guild_ids(guilds) if shard_of(guild_id, SHARD_COUNT) in shard_ids]
+    foreign = [guild_id for guild_id in guild_ids(guilds) if guild_id not in owned]
+
+    async def chat(guild_id: int, user_id: int) -> None:
+        for turn in range(turns):
+            await prompt(cog, user_id, guild_id, f"turn {turn}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(chat(guild_id, user_id) for guild_id in owned for user_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - start
+
+    # Another process' guilds have to be off limits
+    refused = True
+    if foreign:
+        try:
+            cog.ollama_client.context_handler.add_context(foreign[0], 1, [{'role': 'user', 'content': "not mine"}])
+            refused = False
+        except ValueError:
+            pass
+
+    await cog.cog_unload()
+    await stub.stop()
+    return {"prompts": len(owned) * users * turns, "seconds": elapsed, "refused_foreign_guild": refused}
+
+
+def run_process(*args) -> dict:
+    """
+    Entry point of a worker process
+    """
+    return asyncio.run(serve_shards(*args))
+
+
+def verify(path: str, backend: str, guilds: int, users: int, turns: int) -> bool:
+    """
+    Whether every user's history holds each of their turns exactly once and in order, read back by a process owning every shard
+    """
+    from source.utilities.context_manager import ContextManager
+
+    context_handler = ContextManager(config={"database": {"path": path, "sqlite_path": f"{path}/concierge.sqlite3", "backend": backend}})
+    expected = [f"turn {turn}" for turn in range(turns)]
+    try:
+        return all(
+            [message.content for message in context_handler.get_context(guild_id, user_id) if message.role == 'user'] == expected
+            and len(context_handler.get_context(guild_id, user_id)) == turns * 2
+            for guild_id in guild_ids(guilds)
+            for user_id in range(1, users + 1)
+        )
+    finally:
+        context_handler.close()
+
+
+def main() -> None:
+    """
+    Throughput of 1, 2 and 4 processes splitting the shards against the same local storage, and whether histories stay consistent
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=16)
+    parser.add_argument("--users", type=int, default=4, help="Users per guild")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per user")
+    parser.add_argument("--prefill-seconds", type=float, default=0.1, help="Seconds the LLM takes per prompt")
+    parser.add_argument("--parallel", type=int, default=2, help="Prompts each process' Ollama node answers at once")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    results = []
+    for processes in args.processes:
+        with tempfile.TemporaryDirectory() as path:
+            jobs = [
+                (path, args.backend, shard_ids, args.guilds, args.users, args.turns, args.prefill_seconds, args.parallel)
+                for shard_ids in partition(SHARD_COUNT, processes)
+            ]
+            with multiprocessing.get_context("spawn").Pool(processes) as pool:
+                outcomes = pool.starmap(run_process, jobs)
+
+            # The processes run side by side, the slowest one decides the throughput
+            prompts = sum(outcome["prompts"] for outcome in outcomes)
+            seconds = max(outcome["seconds"] for outcome in outcomes)
+            results.append({
+                "processes": processes,
+                "backend": args.backend,
+                "prompts": prompts,
+                "seconds": round(seconds, 3),
+                "prompts_per_second": round(prompts / seconds, 2),
+                "foreign_guilds_refused": all(outcome["refused_foreign_guild"] for outcome in outcomes),
+                "histories_consistent": verify(path, args.backend, args.guilds, args.users, args.turns),
+            })
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
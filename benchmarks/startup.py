@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# Database libraries
+from source.utilities.database import Database
+
+# Needed libraries
+import subprocess
+import resource
+import tempfile
+import argparse
+import time
+import json
+import sys
+import os
+
+GUILDS = 100
+MESSAGES_PER_USER = 10
+
+
+def generate(path: str, users: int) -> None:
+    """
+    Writes a synthetic database of `users` users spread over GUILDS guilds
+    """
+    context = []
+    for turn in range(MESSAGES_PER_USER // 2):
+        context.append({'role': 'user', 'content': f"Question number {turn}, when is the next club meeting?", 'tokens': 14})
+        context.append({'role': 'assistant', 'content': f"Answer number {turn}: the club meets every Thursday at 4pm in the library.", 'tokens': 20})
+    data = json.dumps({"seq": MESSAGES_PER_USER // 2, "context": context})
+
+    for user_id in range(users):
+        guild_path = f"{path}/{user_id % GUILDS + 1}"
+        os.makedirs(guild_path, exist_ok=True)
+        with open(f"{guild_path}/{user_id + 1}.json", "w") as file:
+            file.write(data)
+
+
+def measure(path: str, mode: str) -> dict:
+    """
+    Starts a database the way ContextManager used to (eager) or does now (lazy)
+    """
+    start = time.perf_counter()
+    database = Database(context_manager=None, config={"database": {"path": path}})
+    users = database.list_users()
+
+    # The old load_db read every user into memory before the bot could serve anything
+    if mode == "eager":
+        contexts = {
+            guild_id: {user_id: database.load_user(guild_id, user_id) for user_id in user_ids}
+            for guild_id, user_ids in users.items()
+        }
+
+    elapsed = time.perf_counter() - start
+    database.close()
+    return {
+        "mode": mode,
+        "users": sum(len(user_ids) for user_ids in users.values()),
+        "startup_seconds": round(elapsed, 3),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main() -> None:
+    """
+    Reports startup time and RSS of eager and lazy loading over a synthetic database
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--path", default=None, help="Existing synthetic database, generated in a temp dir if omitted")
+    parser.add_argument("--mode", choices=("eager", "lazy"), default=None)
+    args = parser.parse_args()
+
+    # Child process, measures a single mode so RSS isn't shared between them
+    if args.mode:
+        print(json.dumps(measure(args.path, args.mode)))
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = args.path or temp_dir
+        if args.path is None:
+            generate(path, args.users)
+
+        results = []
+        for mode in ("eager", "lazy"):
+            output = subprocess.check_output([sys.executable, "-m", "benchmarks.startup", "--path", path, "--mode", mode])
+            results.append(json.loads(output))
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# Database libraries
+from source.utilities.sqlite_database import SQLiteDatabase
+from source.utilities.database import Database
+
+# Needed libraries
+import threading
+import tempfile
+import argparse
+import time
+import json
+import os
+
+BACKENDS = {
+    "json": Database,
+    "sqlite": SQLiteDatabase,
+}
+
+
+def disk_usage(path: str) -> dict:
+    """
+    Returns the amount of files and bytes under a folder
+    """
+    files, size = 0, 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return {"files": files, "bytes": size}
+
+
+def run(backend: str, users: int, turns: int) -> dict:
+    """
+    Times load/append/trim/clear of a single backend in a fresh database
+    """
+    with tempfile.TemporaryDirectory() as path:
+        config = {"database": {"path": path, "sqlite_path": f"{path}/concierge.sqlite3", "flush_interval": 3600}}
+        database = BACKENDS[backend](context_manager=None, config=config)
+        keys = [(user_id % 10 + 1, user_id + 1) for user_id in range(users)]
+        timings = {}
+
+        # Every turn is queued as its own append, like /prompt does, then flushed
+        start = time.perf_counter()
+        for turn in range(turns):
+            for guild_id, user_id in keys:
+                database.append_context(guild_id, user_id, [
+                    {'role': 'user', 'content': f"Question number {turn}, how do I join the club?", 'tokens': 13},
+                    {'role': 'assistant', 'content': f"Answer number {turn}: show up to any Thursday meeting.", 'tokens': 15},
+                ])
+            database.flush()
+        timings["append_seconds"] = time.perf_counter() - start
+        size = disk_usage(path)
+
+        start = time.perf_counter()
+        for guild_id, user_id in keys:
+            database.load_user(guild_id, user_id)
+        timings["load_seconds"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for guild_id, user_id in keys:
+            database.trim_context(guild_id, user_id, 2)
+        database.flush()
+        timings["trim_seconds"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for guild_id, user_id in keys:
+            database.clear_context(guild_id, user_id)
+        database.flush()
+        timings["clear_seconds"] = time.perf_counter() - start
+
+        database.close()
+
+    return {
+        "backend": backend,
+        "users": users,
+        "turns": turns,
+        **{name: round(value, 3) for name, value in timings.items()},
+        **size,
+    }
+
+
+def verify_restarts(backend: str) -> bool:
+    """
+    Changes queued for a user that wasn't loaded since startup have to survive the next restart
+    """
+    with tempfile.TemporaryDirectory() as path:
+        config = {"database": {"path": path, "sqlite_path": f"{path}/concierge.sqlite3", "flush_interval": 3600}}
+        turns = [
+            {'role': role, 'content': f"{role} message {turn}"} for turn in range(3) for role in ("user", "assistant")
+        ]
+
+        # Every step is its own process lifetime, and none of them loads the user before queueing
+        steps = [
+            lambda database: database.append_context(1, 1, turns),
+            lambda database: database.clear_context(1, 1),
+            lambda database: database.append_context(1, 1, turns),
+            lambda database: database.trim_context(1, 1, 2),
+        ]
+        expected = [[], turns[2:]]
+
+        outcomes = []
+        for index, step in enumerate(steps):
+            database = BACKENDS[backend](context_manager=None, config=config)
+            step(database)
+            database.close()
+
+            if index % 2:
+                database = BACKENDS[backend](context_manager=None, config=config)
+                outcomes.append([message.to_dict() for message in database.load_user(1, 1)])
+                database.close()
+
+        # Token counts aren't part of what's compared
+        return [[{'role': message['role'], 'content': message['content']} for message in context] for context in outcomes] == expected
+
+
+def verify_concurrent_compaction(backend: str, rounds: int = 200) -> bool:
+    """
+    Loads racing a compaction have to return the whole history, never a snapshot missing its journal
+    """
+    with tempfile.TemporaryDirectory() as path:
+        config = {"database": {"path": path, "sqlite_path": f"{path}/concierge.sqlite3", "flush_interval": 3600}}
+        database = BACKENDS[backend](context_manager=None, config=config)
+
+        complete = True
+        for turn in range(rounds):
+            # A journal for the compaction to fold, then loads for as long as it runs
+            database.append_context(1, 1, [{'role': 'user', 'content': f"turn {turn}"}, {'role': 'assistant', 'content': "answer"}])
+            database.flush()
+
+            compaction = threading.Thread(target=database.compact_all, args=(lambda size: None, lambda guild_id: True))
+            compaction.start()
+            while compaction.is_alive():
+                complete &= len(database.load_user(1, 1)) == (turn + 1) * 2
+            compaction.join()
+
+        database.close()
+        return complete
+
+
+def main() -> None:
+    """
+    Compares the JSON and SQLite storage backends
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    print(json.dumps([
+        {
+            **run(backend, args.users, args.turns),
+            "unloaded_changes_survive_restart": verify_restarts(backend),
+            "loads_survive_compaction": verify_concurrent_compaction(backend),
+        }
+        for backend in BACKENDS
+    ], indent=4))
+
+
+if __name__ == "__main__":
+    main()
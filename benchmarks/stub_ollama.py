@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+# Needed libraries
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+
+
+class StubOllama:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, prefill_seconds: float = 0.05,
+                 tokens_per_second: float = 200.0, response_tokens: int = 50, parallel: int = 1,
+                 prefill_per_token: float = 0.0, model_tokens_per_second: Optional[Dict[str, float]] = None,
+                 stall_every: int = 0, stall_seconds: float = 0.0, silent_models: Optional[List[str]] = None):
+        """
+        A local HTTP server that speaks enough of Ollama's API for offline benchmarks
+
+        - `POST /api/chat`: answers after `prefill_seconds` plus `prefill_per_token` per prompt word it has no
+          cache for, then `response_tokens` (or the request's `num_predict`) generated at `tokens_per_second`,
+          streamed as NDJSON when the request asks for it
+        - `POST /api/embed`: returns a small deterministic embedding per input
+        - `GET /api/tags` and `GET /api/ps`: health probes
+
+        `model_tokens_per_second` overrides the generation speed of some models, like a small model next to a
+        large one. Every `stall_every`th chat stalls for `stall_seconds` before its first token, like a stuck
+        generation that keeps its slot busy. Models in `silent_models` answer with nothing at all.
+
+        At most `parallel` chats generate at once like a single GPU, the rest wait their turn. Each of those
+        slots keeps the last prompt it served like Ollama's KV cache, a prompt only pays for (and reports in
+        `prompt_eval_count`) the words after its longest common prefix with one of them. Like Ollama, a chat
+        whose client disconnected stops generating and frees its slot.
+        """
+        self.host = host
+        self.port = port
+        self.prefill_seconds = prefill_seconds
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.parallel = parallel
+        self.prefill_per_token = prefill_per_token
+        self.model_tokens_per_second = model_tokens_per_second or {}
+        self.stall_every = stall_every
+        self.stall_seconds = stall_seconds
+        self.silent_models = silent_models or []
+
+        # Requests served (and chats per model), and whether the server pretends to be down
+        self.requests = 0
+        self.chats: Dict[str, int] = {}
+
+        # Seconds chats held a slot, and the chats abandoned by their client before they finished
+        self.busy_seconds = 0.0
+        self.cancelled = 0
+        self.down = False
+
+        # Prompt words sent and the ones that had to be prefilled, and the prompts cached by the slots
+        self.prompt_tokens = 0
+        self.prefilled_tokens = 0
+        self._cached: List[List[str]] = []
+
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        """
+        Start listening, picks a free port when none was given
+        """
+        self._slots = asyncio.Semaphore(self.parallel)
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """
+        Stop listening
+        """
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serve keep-alive requests on a connection until the client closes it
+        """
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+
+                # A node that's down drops the connection
+                if self.down:
+                    break
+
+                method, path, body = request
+                self.requests += 1
+                await self._route(reader, writer, method, path, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # The client went away mid request (a cancelled warm-up) and the loop is shutting down
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, dict]]:
+        """
+        Read a single HTTP/1.1 request, returns None once the client is gone
+        """
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+
+        method, path, _ = request_line.decode().split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", 0))
+        body = json.loads(await reader.readexactly(length)) if length else {}
+        return method, path, body
+
+    async def _route(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, method: str, path: str, body: dict) -> None:
+        """
+        Answer a request
+        """
+        if path in ("/api/tags", "/api/ps"):
+            await self._send_json(writer, {"models": []})
+        elif path == "/api/embed":
+            inputs = body.get("input", [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            await self._send_json(writer, {"model": body.get("model"), "embeddings": [self._embed(text) for text in inputs]})
+        elif path == "/api/chat":
+            await self._chat(reader, writer, body)
+        else:
+            await self._send(writer, 404, b'{"error": "not found"}')
+
+    async def _chat(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, body: dict) -> None:
+        """
+        Generate a fake answer, token by token when streaming, until the client goes away
+        """
+        words = [word for message in body.get("messages", []) for word in [f"{message.get('role')}:", *message.get("content", "").split()]]
+        response_tokens = body.get("options", {}).get("num_predict") or self.response_tokens
+        response_tokens = 0 if body.get("model") in self.silent_models else response_tokens
+        tokens_per_second = self.model_tokens_per_second.get(body.get("model"), self.tokens_per_second)
+        token_delay = 1 / tokens_per_second
+        self.chats[body.get("model")] = self.chats.get(body.get("model"), 0) + 1
+        stall = self.stall_seconds if self.stall_every and sum(self.chats.values()) % self.stall_every == 0 else 0.0
+        stream = body.get("stream", True)
+
+        async with self._slots:
+            clock = asyncio.get_running_loop().time
+            started = clock()
+            try:
+                prompt_tokens = self._prefill(words)
+                if not await self._generating(reader, stall + self.prefill_seconds + prompt_tokens * self.prefill_per_token):
+                    return
+
+                if stream:
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n")
+                    for token in range(response_tokens):
+                        if not await self._generating(reader, token_delay):
+                            return
+                        self._write_chunk(writer, self._chat_part(body, f"word{token} ", prompt_tokens, response_tokens, done=False))
+                        await writer.drain()
+                    self._write_chunk(writer, self._chat_part(body, "", prompt_tokens, response_tokens, done=True))
+                    writer.write(b"0\r\n\r\n")
+                    await writer.drain()
+                else:
+                    if not await self._generating(reader, token_delay * response_tokens):
+                        return
+                    content = "".join(f"word{token} " for token in range(response_tokens))
+                    await self._send_json(writer, self._chat_part(body, content, prompt_tokens, response_tokens, done=True))
+            finally:
+                self.busy_seconds += clock() - started
+
+    async def _generating(self, reader: asyncio.StreamReader, seconds: float) -> bool:
+        """
+        Spend `seconds` generating, returns False (and counts the chat as cancelled) as soon as the client disconnects
+        """
+        while seconds > 0:
+            if reader.at_eof():
+                break
+            step = min(seconds, 0.05)
+            await asyncio.sleep(step)
+            seconds -= step
+
+        if reader.at_eof():
+            self.cancelled += 1
+            return False
+        return True
+
+    def _prefill(self, words: List[str]) -> int:
+        """
+        Cache a prompt in the slot sharing the longest prefix with it, returns how many words weren't cached
+        """
+        def shared(cached: List[str]) -> int:
+            length = 0
+            for cached_word, word in zip(cached, words):
+                if cached_word != word:
+                    break
+                length += 1
+            return length
+
+        best = max(range(len(self._cached)), key=lambda slot: shared(self._cached[slot]), default=None)
+        reused = shared(self._cached[best]) if best is not None else 0
+        if best is not None and (reused or len(self._cached) >= self.parallel):
+            self._cached.pop(best)
+        self._cached.append(words)
+        del self._cached[:-self.parallel]
+
+        # Ollama always evaluates at least the last token of a prompt
+        prompt_tokens = max(1, len(words) - reused) if words else 0
+        self.prompt_tokens += len(words)
+        self.prefilled_tokens += prompt_tokens
+        return prompt_tokens
+
+    def _chat_part(self, body: dict, content: str, prompt_tokens: int, response_tokens: int, done: bool) -> dict:
+        """
+        A chat response (or streamed part), the final one carries Ollama's timing stats in nanoseconds
+        """
+        part = {
+            "model": body.get("model"),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": done,
+        }
+        if done:
+            part.update({
+                "done_reason": "stop",
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int((self.prefill_seconds + prompt_tokens * self.prefill_per_token) * 1e9),
+                "eval_count": response_tokens,
+                "eval_duration": int(response_tokens / self.model_tokens_per_second.get(body.get("model"), self.tokens_per_second) * 1e9),
+            })
+        return part
+
+    @staticmethod
+    def _embed(text: str) -> list:
+        """
+        A deterministic 8 dimensional bag of characters embedding
+        """
+        vector = [0.0] * 8
+        for character in text.lower():
+            vector[ord(character) % 8] += 1.0
+        return vector
+
+    async def _send_json(self, writer: asyncio.StreamWriter, data: dict) -> None:
+        await self._send(writer, 200, json.dumps(data).encode())
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, status: int, payload: bytes) -> None:
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Not Found'}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n".encode()
+            + payload
+        )
+        await writer.drain()
+
+    @staticmethod
+    def _write_chunk(writer: asyncio.StreamWriter, data: dict) -> None:
+        payload = json.dumps(data).encode() + b"\n"
+        writer.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+
+
+async def serve(args: argparse.Namespace) -> None:
+    """
+    Run a stub server until interrupted
+    """
+    stub = StubOllama(
+        host=args.host,
+        port=args.port,
+        prefill_seconds=args.prefill,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        parallel=args.parallel,
+        prefill_per_token=args.prefill_per_token,
+        stall_every=args.stall_every,
+        stall_seconds=args.stall_seconds,
+    )
+    await stub.start()
+    print(f"Stub Ollama listening on {stub.url}")
+    await asyncio.Event().wait()
+
+
+def main() -> None:
+    """
+    Runs a stub Ollama server, point settings.json['llm']['hosts'] at it
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--prefill", type=float, default=0.05, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--response-tokens", type=int, default=50)
+    parser.add_argument("--parallel", type=int, default=1, help="Chats generated at the same time")
+    parser.add_argument("--prefill-per-token", type=float, default=0.0, help="Seconds per prompt word that isn't cached")
+    parser.add_argument("--stall-every", type=int, default=0, help="Every n-th chat stalls before its first token")
+    parser.add_argument("--stall-seconds", type=float, default=0.0, help="How long a stalled chat holds its slot")
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+# Needed libraries
+from benchmarks.harness import (
+    directory_bytes, generate_history, guild_of, make_cog, make_config, max_rss_mb, percentiles, prompt
+)
+from benchmarks.stub_ollama import StubOllama
+from typing import Callable, Dict, Iterable, Optional
+import subprocess
+import argparse
+import tempfile
+import asyncio
+import random
+import json
+import time
+import sys
+
+
+async def serve_prompts(path: str, users: Iterable[int], stub: StubOllama, guilds: int = 1,
+                        context_length: Optional[int] = None, **sections) -> dict:
+    """
+    Prompts once per user in `users` (in the guild `generate_history` put them in), all at once,
+    and reports throughput, latency, what was sent to Discord and what was written to disk
+    """
+    from source.utilities.metrics import metrics
+
+    await stub.start()
+    cog = make_cog(make_config(path, stub, **sections))
+    await cog.cog_load()
+    if context_length is not None:
+        cog.ollama_client.context_handler.context_length = context_length
+
+    before = directory_bytes(path)
+    start = time.perf_counter()
+    interactions = await asyncio.gather(*(prompt(cog, user_id, guild_of(user_id, guilds)) for user_id in users))
+    elapsed = time.perf_counter() - start
+
+    # Closing flushes the write-behind queue, so everything the prompts wrote is counted
+    await cog.cog_unload()
+    await stub.stop()
+
+    return {
+        "prompts": len(interactions),
+        "seconds": round(elapsed, 3),
+        "prompts_per_second": round(len(interactions) / elapsed, 2),
+        "ack_ms": percentiles([interaction.ack_seconds for interaction in interactions]),
+        "latency_ms": percentiles([interaction.latency_seconds for interaction in interactions]),
+        "messages_sent": sum(len(interaction.sent) for interaction in interactions),
+        "bytes_sent": sum(size for interaction in interactions for _, size in interaction.sent),
+        "bytes_written": int(metrics.counters.get("database_bytes_written", 0)),
+        "database_growth_bytes": directory_bytes(path) - before,
+        "max_rss_mb": max_rss_mb(),
+    }
+
+
+async def cold_start(args: argparse.Namespace, path: str) -> dict:
+    """
+    Import, cog construction and the first answered prompt, in a fresh interpreter
+    """
+    generate_history(path, 1000, 10, guilds=10)
+    stub = StubOllama(prefill_seconds=args.prefill, tokens_per_second=args.tokens_per_second)
+    await stub.start()
+
+    start = time.perf_counter()
+    from source.cogs.prompt import PromptCommand  # noqa: F401, timed on purpose
+    imported = time.perf_counter()
+
+    cog = make_cog(make_config(path, stub))
+    await cog.cog_load()
+    constructed = time.perf_counter()
+
+    interaction = await prompt(cog, 1)
+    answered = time.perf_counter()
+
+    await cog.cog_unload()
+    await stub.stop()
+    return {
+        "import_seconds": round(imported - start, 3),
+        "construct_seconds": round(constructed - imported, 3),
+        "first_prompt_seconds": round(answered - constructed, 3),
+        "first_ack_ms": round(interaction.ack_seconds * 1000, 2),
+        "max_rss_mb": max_rss_mb(),
+    }
+
+
+async def concurrent_users(args: argparse.Namespace, path: str) -> dict:
+    """
+    `users` new users prompting at the same time
+    """
+    stub = StubOllama(prefill_seconds=args.prefill, tokens_per_second=args.tokens_per_second, parallel=args.parallel)
+    return await serve_prompts(path, range(1, args.users + 1), stub)
+
+
+async def long_histories(args: argparse.Namespace, path: str) -> dict:
+    """
+    Users with `turns` turns on disk, every prompt reads, tokenizes and trims a long history
+    """
+    users = max(1, args.users // 5)
+    generate_history(path, users, args.turns)
+    stub = StubOllama(prefill_seconds=args.prefill, tokens_per_second=args.tokens_per_second, parallel=args.parallel)
+
+    # Half the history has to be trimmed away
+    result = await serve_prompts(path, range(1, users + 1), stub, context_length=args.turns * 25)
+    return {"turns": args.turns, **result}
+
+
+async def large_responses(args: argparse.Namespace, path: str) -> dict:
+    """
+    Responses far over Discord's 2000 character limit, delivered in chunks
+    """
+    stub = StubOllama(
+        prefill_seconds=args.prefill, tokens_per_second=args.tokens_per_second * 20,
+        response_tokens=args.response_tokens, parallel=args.parallel
+    )
+    result = await serve_prompts(path, range(1, max(1, args.users // 5) + 1), stub)
+    return {"response_tokens": args.response_tokens, **result}
+
+
+async def many_users(args: argparse.Namespace, path: str) -> dict:
+    """
+    A database of `database_users` users, random ones of them prompting
+    """
+    generate_history(path, args.database_users, 5, guilds=100)
+    stub = StubOllama(prefill_seconds=args.prefill, tokens_per_second=args.tokens_per_second, parallel=args.parallel)
+
+    users = random.Random(0).sample(range(1, args.database_users + 1), min(args.users, args.database_users))
+
+    start = time.perf_counter()
+    result = await serve_prompts(path, users, stub, guilds=100)
+    return {"database_users": args.database_users, "total_seconds": round(time.perf_counter() - start, 3), **result}
+
+
+SCENARIOS: Dict[str, Callable] = {
+    "cold_start": cold_start,
+    "concurrent_users": concurrent_users,
+    "long_histories": long_histories,
+    "large_responses": large_responses,
+    "many_users": many_users,
+}
+
+
+def main() -> None:
+    """
+    Runs every scenario in its own interpreter (so RSS and caches don't leak between them) and prints JSON
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append", help="Scenarios to run, defaults to all")
+    parser.add_argument("--users", type=int, default=100, help="Users prompting at once")
+    parser.add_argument("--turns", type=int, default=1000, help="Turns per user in long_histories")
+    parser.add_argument("--database-users", type=int, default=100_000, help="Users on disk in many_users")
+    parser.add_argument("--response-tokens", type=int, default=4000, help="Tokens per answer in large_responses")
+    parser.add_argument("--prefill", type=float, default=0.05, help="Stub seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Stub generation speed")
+    parser.add_argument("--parallel", type=int, default=4, help="Stub chats generated at once")
+    parser.add_argument("--output", default=None, help="Also write the results to this file")
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process, runs a single scenario in a scratch directory
+    if args.child:
+        with tempfile.TemporaryDirectory() as path:
+            print(json.dumps(asyncio.run(SCENARIOS[args.child](args, path))))
+        return
+
+    passthrough = [
+        "--users", str(args.users), "--turns", str(args.turns), "--database-users", str(args.database_users),
+        "--response-tokens", str(args.response_tokens), "--prefill", str(args.prefill),
+        "--tokens-per-second", str(args.tokens_per_second), "--parallel", str(args.parallel),
+    ]
+
+    results = {}
+    for scenario in args.scenario or SCENARIOS:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.suite", "--child", scenario, *passthrough], capture_output=True, text=True
+        )
+        if output.returncode != 0:
+            results[scenario] = {"error": output.stderr.strip().splitlines()[-1] if output.stderr.strip() else "failed"}
+            continue
+        results[scenario] = json.loads(output.stdout.strip().splitlines()[-1])
+
+    report = json.dumps(results, indent=4)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report)
+
+
+if __name__ == "__main__":
+    main()
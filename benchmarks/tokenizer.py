@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# Needed libraries
+import subprocess
+import tempfile
+import argparse
+import json
+import sys
+
+# Each snippet runs in a fresh interpreter and prints how long its interesting part took
+LEGACY = """
+import time
+start = time.perf_counter()
+from transformers import AutoTokenizer
+imported = time.perf_counter()
+tokenizer = AutoTokenizer.from_pretrained("deepseek-ai/DeepSeek-R1")
+print(imported - start, time.perf_counter() - start)
+"""
+
+CURRENT = """
+import time
+start = time.perf_counter()
+from source.utilities.context_manager import ContextManager
+imported = time.perf_counter()
+context_manager = ContextManager(config={{"llm": {{"model": "gemma3:4b-it-q4_K_M"}}, "database": {{"path": {path!r}}}}})
+print(imported - start, time.perf_counter() - start)
+context_manager.close()
+"""
+
+READY = """
+import time
+start = time.perf_counter()
+from source.utilities.tokenizer import get_token_counter
+counter = get_token_counter({{"llm": {{"model": "gemma3:4b-it-q4_K_M", "tokenizer_cache": {cache!r}}}}})
+counter.ready.wait()
+print(counter.exact, time.perf_counter() - start)
+"""
+
+
+def run(snippet: str) -> list:
+    """
+    Runs a snippet in a fresh interpreter, None when it failed (no transformers, no network...)
+    """
+    result = subprocess.run([sys.executable, "-c", snippet], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return result.stdout.split()
+
+
+def main() -> None:
+    """
+    Reports import and startup time of the old eager tokenizer against the background one
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache", default="./models/tokenizer", help="Local tokenizer folder, filled on the first run")
+    args = parser.parse_args()
+
+    results = {}
+
+    legacy = run(LEGACY)
+    results["legacy"] = legacy and {"import_seconds": round(float(legacy[0]), 3), "startup_seconds": round(float(legacy[1]), 3)}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        current = run(CURRENT.format(path=temp_dir))
+    results["current"] = current and {"import_seconds": round(float(current[0]), 3), "startup_seconds": round(float(current[1]), 3)}
+
+    # Time until exact counts are available, from the hub on the first run and from the local folder afterwards
+    ready = run(READY.format(cache=args.cache))
+    results["tokenizer_ready"] = ready and {"exact": ready[0] == "True", "seconds": round(float(ready[1]), 3)}
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,34 @@
 # -*- coding: utf-8 -*-
 
 from source.client.bot import Bot
+from source.utilities.sharding import Shards, partition, process_config
 
 
-
+import multiprocessing
 import json
 
 
+def run(config: dict) -> None:
+    """
+    Runs a single bot process, with every shard in its config
+
+    :return:
+    """
+
+    # Create bot instance
+    bot = Bot(config)
+
+    # Run bot
+    bot.run(config['discord']['token'])
+
+
 def main() -> None:
     """
     Runs the start function for the discord bot
 
+    With settings.json['discord']['processes'] above 1 the shards are split over that many processes,
+    each one owning the contexts of its own guilds.
+
     :return:
    """
 
@@ -18,12 +36,24 @@ def main() -> None:
     with open("config/settings.json", "r") as f:
         config = json.loads(f.read())
 
-    # Create bot instance
-    bot = Bot(config)
+    shards = Shards(config)
+    if shards.processes <= 1:
+        run(config)
+        return
 
-    # Run bot
-    bot.run(config['discord']['token'])
+    if shards.count is None:
+        raise ValueError("settings.json['discord']['processes'] needs a shard_count to split")
+
+    # One process per shard range, they only share the database
+    processes = [
+        multiprocessing.Process(target=run, args=(process_config(config, index, shard_ids),), name=f"shards-{index}")
+        for index, shard_ids in enumerate(partition(shards.count, shards.processes))
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
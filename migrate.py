@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+from source.utilities.sqlite_database import SQLiteDatabase
+from source.utilities.database import Database
+
+
+
+import argparse
+import json
+
+
+def main() -> None:
+    """
+    Migrates the JSON database tree into the SQLite database
+
+    Reads every user from settings.json['database']['path'] and writes it to settings.json['database']['sqlite_path'],
+    users that are already in the SQLite database are replaced. Switch `backend` to "sqlite" afterwards.
+
+    :return:
+    """
+    parser = argparse.ArgumentParser(description="Migrate the JSON database to SQLite")
+    parser.add_argument("--config", default="config/settings.json", help="Path to the settings file")
+    args = parser.parse_args()
+
+    # Read config file
+    with open(args.config, "r") as f:
+        config = json.loads(f.read())
+
+    # Open both databases
+    source = Database(context_manager=None, config=config)
+    target = SQLiteDatabase(context_manager=None, config=config)
+
+    # Copy every user over
+    migrated = 0
+    for guild_id, user_ids in source.list_users().items():
+        for user_id in user_ids:
+            target.import_user(guild_id, user_id, source.load_user(guild_id, user_id))
+            migrated += 1
+
+    source.close()
+    target.close()
+    print(f"Migrated {migrated} users from '{source.path}' to '{target.sqlite_path}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,15 +6,19 @@ from discord.ext import commands
 import discord
 
 # Needed libraries
+from source.utilities.metrics_exporter import MetricsExporter
+from source.utilities.loop_monitor import LoopLagMonitor
+from source.utilities.sharding import Shards
+from source.client.gateway import GatewayReport, gateway_options
+from typing import Optional
+import logging.handlers
 import difflib
 import platform
 import logging
+import random
+import queue
 import os
 
-# Setup base intents
-intents = discord.Intents.all()
-intents.message_content = True
-
 LOGGING_DIR = "./logs/"
 LOG_FILE = "discord.log"
 PATH_HANDLE = os.path.join(LOGGING_DIR, LOG_FILE)
@@ -39,56 +43,144 @@ class LoggingFormatter(logging.Formatter):
         logging.CRITICAL: red + bold,
     }
 
+    def __init__(self):
+        super().__init__()
+
+        # One formatter per level, built once instead of for every record
+        self.formatters = {}
+        for level, log_color in self.COLORS.items():
+            format = "(black){asctime}(reset) (levelcolor){levelname:<8}(reset) (green){name}(reset) {message}"
+            format = format.replace("(black)", self.black + self.bold)
+            format = format.replace("(reset)", self.reset)
+            format = format.replace("(levelcolor)", log_color)
+            format = format.replace("(green)", self.green + self.bold)
+            self.formatters[level] = logging.Formatter(format, "%Y-%m-%d %H:%M:%S", style="{")
+
     def format(self, record: logging.LogRecord):
-        log_color = self.COLORS[record.levelno]
-        format = "(black){asctime}(reset) (levelcolor){levelname:<8}(reset) (green){name}(reset) {message}"
-        format = format.replace("(black)", self.black + self.bold)
-        format = format.replace("(reset)", self.reset)
-        format = format.replace("(levelcolor)", log_color)
-        format = format.replace("(green)", self.green + self.bold)
-        formatter = logging.Formatter(format, "%Y-%m-%d %H:%M:%S", style="{")
-        return formatter.format(record)
-
-def grab_file_handler():
-    # check if our log dir exists first
-    exists = os.path.exists(PATH_HANDLE)
-    if not exists:
-        os.mkdir(LOGGING_DIR)
-        open(LOGGING_DIR+LOG_FILE, 'x')
-    
+        return self.formatters.get(record.levelno, self.formatters[logging.INFO]).format(record)
+
 
 logger = logging.getLogger("discord_bot")
 logger.setLevel(logging.INFO)
 
-# Console handler
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(LoggingFormatter())
+# Background thread writing the queued records to the console and log file, started by setup_logging
+log_listener: Optional[logging.handlers.QueueListener] = None
+
+# How prompt and response bodies are logged, set from settings.json['logging'] by setup_logging
+payload_settings = {"max_chars": 500, "sample_rate": 1.0, "full": False}
+
+
+def setup_logging(config: dict) -> None:
+    """
+    Sets up a non-blocking logging pipeline, only the first call does anything
+
+    Records are put on a queue and written to the console and a size-bounded rotating log file by a background
+    thread, so logging never blocks the event loop on disk or terminal writes.
+
+    Config (settings.json['logging'], all optional):
+        - `level`: Level of the bot's logger, defaults to "INFO"
+        - `file`: Log file name inside ./logs/, defaults to "discord.log"
+        - `max_bytes`: Size the log file rotates at, defaults to 10000000
+        - `backup_count`: Rotated log files that are kept, defaults to 5
+        - `payload_max_chars`: Prompt and response bodies are cut off past this, defaults to 500
+        - `payload_sample_rate`: Share of prompt and response bodies that are logged at all, defaults to 1.0
+        - `debug_payloads`: Log every body in full, for debugging, defaults to false
+    """
+    global log_listener
+    if log_listener is not None:
+        return
+
+    settings = config.get("logging", {})
+    logger.setLevel(settings.get("level", "INFO"))
+    payload_settings.update(
+        max_chars=settings.get("payload_max_chars", 500),
+        sample_rate=settings.get("payload_sample_rate", 1.0),
+        full=settings.get("debug_payloads", False),
+    )
+
+    # Console handler
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(LoggingFormatter())
+
+    # File handler, rotates instead of growing forever
+    os.makedirs(LOGGING_DIR, exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(
+        filename=os.path.join(LOGGING_DIR, settings.get("file", LOG_FILE)),
+        encoding="utf-8",
+        maxBytes=settings.get("max_bytes", 10_000_000),
+        backupCount=settings.get("backup_count", 5),
+    )
+    file_handler_formatter = logging.Formatter(
+        "[{asctime}] [{levelname:<8}] {name}: {message}", "%Y-%m-%d %H:%M:%S", style="{"
+    )
+    file_handler.setFormatter(file_handler_formatter)
+
+    # The logger only queues records, the listener thread formats and writes them
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener = logging.handlers.QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    log_listener.start()
+
+
+def stop_logging() -> None:
+    """
+    Writes every queued record and stops the logging thread
+    """
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
+        for handler in list(logger.handlers):
+            if isinstance(handler, logging.handlers.QueueHandler):
+                logger.removeHandler(handler)
+
+
+def log_payload(label: str, text: str) -> None:
+    """
+    Logs a prompt or response body at INFO, sampled and truncated unless `debug_payloads` is on
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        return
+
+    if not payload_settings["full"]:
+        if payload_settings["sample_rate"] < 1.0 and random.random() >= payload_settings["sample_rate"]:
+            return
+
+        if len(text) > payload_settings["max_chars"]:
+            text = f"{text[:payload_settings['max_chars']]}... ({len(text) - payload_settings['max_chars']} more characters)"
 
-# File handler
-grab_file_handler()
-file_handler = logging.FileHandler(filename=PATH_HANDLE, encoding="utf-8", mode="w")
-file_handler_formatter = logging.Formatter(
-    "[{asctime}] [{levelname:<8}] {name}: {message}", "%Y-%m-%d %H:%M:%S", style="{"
-)
-file_handler.setFormatter(file_handler_formatter)
+    logger.info(f"{label} '{text}'")
 
-# Add the handlers
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
 
-class Bot(commands.Bot):
+class Bot(commands.AutoShardedBot):
     def __init__(self, config: dict[str, str]):
+        # Runs every shard in settings.json['discord']['shard_ids'], or all of them
+        self.shards_config = Shards(config)
+        # Intents and caches come from settings.json['discord']['gateway_profile']
         super().__init__(
-            intents=intents,
-            command_prefix="bro_why_is_this_required"
+            **gateway_options(config),
+            command_prefix="bro_why_is_this_required",
+            shard_count=self.shards_config.count,
+            shard_ids=sorted(self.shards_config.ids) if self.shards_config.ids is not None else None
         )
 
         # Bot's file based logger
+        setup_logging(config)
         self.logger = logger
 
         # Get config
         self.config = config
 
+        # Logs whenever something blocks the event loop
+        self.loop_monitor = LoopLagMonitor(config=self.config)
+
+        # Serves or dumps the metrics for Prometheus
+        self.metrics_exporter = MetricsExporter(config=self.config)
+
+        # Counts gateway events, and reports memory and event rates after startup
+        self.gateway_report = GatewayReport(config=self.config)
+
     async def setup_hook(self) -> None:
         """
         Prints some information about the bot when it starts, loads cogs and setups error handler.
@@ -103,6 +195,10 @@ class Bot(commands.Bot):
         )
         self.logger.info("-------------------")
 
+        # Watch the event loop and export the metrics
+        self.loop_monitor.start()
+        await self.metrics_exporter.start()
+
         # Load cogs
         await self.load_cogs()
 
@@ -112,6 +208,18 @@ class Bot(commands.Bot):
         # Sync tree commands
         await self.tree.sync()
 
+    async def close(self) -> None:
+        """
+        Stops the gateway report, event loop monitor, metrics exporter and logging thread after shutting down, closing the cogs flushes their state.
+
+        :return: None
+        """
+        await super().close()
+        self.gateway_report.stop()
+        self.loop_monitor.stop()
+        await self.metrics_exporter.stop()
+        stop_logging()
+
     async def load_cogs(self) -> None:
         """
         The code in this function is executed whenever the bot will start.
@@ -139,9 +247,31 @@ class Bot(commands.Bot):
         # Send debug message in the logger
         self.logger.info(f"'{self.user.name}' has connected to Discord!") #type: ignore
 
-        # Send debug message
-        if self.config['discord'].get('on_ready_channel') is not None:
-            await self.get_channel(self.config['discord']['on_ready_channel']).send("Bot is now online!")
+        # Report memory and event rates of the gateway profile once things settle
+        self.gateway_report.start(self)
+
+        # Send debug message, only the process whose shards have the channel's guild can see it
+        channel = self.get_channel(self.config['discord']['on_ready_channel']) if self.config['discord'].get('on_ready_channel') is not None else None
+        if channel is not None:
+            await channel.send("Bot is now online!")
+
+    async def on_shard_ready(self, shard_id: int) -> None:
+        """
+        Prints when a shard is ready.
+
+        :param shard_id: int
+        :return: None
+        """
+        self.logger.info(f"Shard {shard_id} of {self.shard_count} is ready")
+
+    async def on_socket_event_type(self, event_type: str) -> None:
+        """
+        Counts every gateway event.
+
+        :param event_type: str
+        :return: None
+        """
+        self.gateway_report.record(event_type)
 
     async def on_message(self, message: discord.Message) -> None:
         """
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# Important Discord Libraries
+import discord
+
+# Needed libraries
+from source.utilities.metrics import metrics
+from collections import Counter
+from typing import Optional
+import asyncio
+import logging
+import time
+import sys
+import os
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("discord_bot")
+
+# Gateway profiles selectable with settings.json['discord']['gateway_profile']
+PROFILES = ("full", "slash_only")
+
+
+def gateway_options(config: dict) -> dict:
+    """
+    Keyword arguments for the bot's constructor, from the configured gateway profile
+
+    - "full": Every intent, the default member cache, 1000 cached messages and every guild chunked at startup
+    - "slash_only": Just the guilds intent (interactions still resolve their guild), no members cached, no message
+      cache and no chunking, since slash commands carry everything the bot needs in the interaction itself
+
+    Config (settings.json['discord'], all optional):
+        - `gateway_profile`: "full" (default) or "slash_only"
+        - `intents`: Extra intents to turn on over the profile, like ["guild_messages"]
+        - `max_messages`: Messages kept in the cache, null disables it, defaults to the profile's
+    """
+    settings = config.get("discord", {})
+    profile = settings.get("gateway_profile", "full")
+
+    if profile == "full":
+        intents = discord.Intents.all()
+        intents.message_content = True
+        options = {"member_cache_flags": discord.MemberCacheFlags.from_intents(intents), "max_messages": 1000, "chunk_guilds_at_startup": True}
+    elif profile == "slash_only":
+        intents = discord.Intents.none()
+        intents.guilds = True
+        options = {"member_cache_flags": discord.MemberCacheFlags.none(), "max_messages": None, "chunk_guilds_at_startup": False}
+    else:
+        raise ValueError(f"Unknown gateway profile '{profile}', expected one of {', '.join(PROFILES)}")
+
+    for name in settings.get("intents", []):
+        setattr(intents, name, True)
+
+    if "max_messages" in settings:
+        options["max_messages"] = settings["max_messages"]
+
+    return {"intents": intents, **options}
+
+
+def rss_mb() -> float:
+    """
+    Current resident memory of the process, or the peak where the current one isn't available
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    if resource is None:
+        return 0.0
+
+    # Bytes on macOS, kilobytes everywhere else
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+class GatewayReport:
+    def __init__(self, config: dict):
+        """
+        Counts every gateway event by type, and logs memory and event rates once the bot has been up a while
+
+        Every event is counted as `gateway_events{type="..."}`. `report_seconds` after the bot is ready the process'
+        RSS, what's cached (guilds, members, users, messages) and the events per second are logged once and set as
+        gauges, so gateway profiles can be compared on the same guilds.
+
+        Config (settings.json['monitor'], all optional):
+            - `gateway_report_seconds`: Seconds after ready the report is logged, defaults to 60, null disables it
+        """
+        settings = config.get("monitor", {})
+        self.report_seconds: Optional[float] = settings.get("gateway_report_seconds", 60.0)
+
+        self.events: Counter = Counter()
+        self.started: float = time.perf_counter()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, event_type: str) -> None:
+        """
+        Count a gateway event
+        """
+        self.events[event_type] += 1
+        metrics.increment(f'gateway_events{{type="{event_type}"}}')
+
+    def start(self, client: discord.Client) -> None:
+        """
+        Log the report once `report_seconds` have passed, must be called with the event loop running
+        """
+        if self.report_seconds is not None and self._task is None:
+            self._task = asyncio.create_task(self._report_later(client))
+
+    def stop(self) -> None:
+        """
+        Drop a report that wasn't logged yet
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def report(self, client: discord.Client) -> dict:
+        """
+        Memory, cache sizes and event rates since the counting started
+        """
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        report = {
+            "rss_mb": round(rss_mb(), 1),
+            "guilds": len(client.guilds),
+            "members": sum(len(guild.members) for guild in client.guilds),
+            "users": len(client.users),
+            "messages": len(client.cached_messages),
+            "events": sum(self.events.values()),
+            "events_per_second": round(sum(self.events.values()) / elapsed, 2),
+            "top_events": {name: round(count / elapsed, 2) for name, count in self.events.most_common(5)},
+        }
+
+        for name in ("rss_mb", "guilds", "members", "users", "messages", "events_per_second"):
+            metrics.set_gauge(f"gateway_{name}", report[name])
+        return report
+
+    async def _report_later(self, client: discord.Client) -> None:
+        await asyncio.sleep(self.report_seconds)
+        report = self.report(client)
+        logger.info(
+            f"Gateway report: RSS {report['rss_mb']}MB, {report['guilds']} guilds, {report['members']} members, "
+            f"{report['users']} users and {report['messages']} messages cached, {report['events_per_second']} events/s "
+            f"(top: {', '.join(f'{name} {rate}/s' for name, rate in report['top_events'].items()) or 'none'})"
+        )
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+# Bot/LLM libraries
+from source.client.bot import Bot
+from discord.ext import commands
+
+# Needed libraries
+import discord
+import time
+
+
+class AdminCommand(commands.Cog):
+    def __init__(self, bot):
+        # Bot object
+        self.bot = bot
+
+        # Get config
+        self.config = self.bot.config
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        print(f"Admin command loaded")
+
+    @discord.app_commands.command(name="storage", description="Show how much the context database stores")
+    @discord.app_commands.describe(run="Run a maintenance sweep first")
+    @discord.app_commands.default_permissions(administrator=True)
+    async def storage(self, interaction: discord.Interaction, run: bool = False) -> None:
+        """
+        Reports the database's size, its users and the last maintenance sweep, optionally running one first
+
+        :param interaction: discord.Interaction
+        :param run: bool
+        :return: None
+        """
+        await interaction.response.defer(ephemeral=True)
+
+        # The database belongs to the prompt command's Ollama client
+        prompt_command = self.bot.get_cog("PromptCommand")
+        if prompt_command is None:
+            return await interaction.followup.send("The prompt command isn't loaded, there's no database to report on.")
+
+        client = prompt_command.ollama_client #type: ignore
+        handler, maintenance = client.context_handler, client.maintenance
+
+        if run:
+            await maintenance.run()
+
+        lines = [
+            f"**Storage:** {await maintenance.storage_bytes() / 1024 ** 2:.1f}MB",
+            f"**Users:** {sum(len(users) for users in handler.known_users.values())} in "
+            f"{len(handler.known_users)} guilds, {len(handler.resident_users)} in memory",
+        ]
+
+        last_run = maintenance.last_run
+        if last_run is None:
+            lines.append("**Last maintenance:** never")
+        else:
+            lines.append(
+                f"**Last maintenance:** {int(time.time() - last_run['started'])}s ago, took {last_run['seconds']}s, "
+                f"deleted {last_run['deleted']} users, trimmed {last_run['trimmed']}, "
+                f"compacted {last_run['bytes_compacted'] / 1024 ** 2:.1f}MB"
+            )
+
+        await interaction.followup.send("\n".join(lines))
+
+
+async def setup(bot: Bot):
+    await bot.add_cog(AdminCommand(bot=bot))
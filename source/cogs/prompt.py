@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 
 # Bot/LLM libraries
-from typing import Mapping
+from typing import Mapping, Optional
+from source.utilities.scheduler import PromptScheduler, SchedulerFull
+from source.utilities.deadlines import DeadlineExceeded, Deadlines
+from source.utilities.delivery import Delivery
 from source.utilities.ollama_client import OllamaClient
-from source.client.bot import Bot
+from source.utilities.streaming import StreamingMessage
+from source.utilities.tracing import span, trace
+from source.client.bot import Bot, log_payload
 from discord.ext import commands
 
 # Needed libraries
+import asyncio
 import discord
 
 
@@ -24,6 +30,27 @@ class PromptCommand(commands.Cog):
         # Persistent Ollama Client
         self.ollama_client = OllamaClient(bot=self.bot, config=self.config)
 
+        # Orders prompts per user and caps how many reach Ollama at once
+        self.scheduler = PromptScheduler(config=self.config)
+
+        # Gives up on prompts before Discord stops taking their followups
+        self.deadlines = Deadlines(config=self.config)
+
+        # Splits, paces or attaches finished answers
+        self.delivery = Delivery(config=self.config)
+
+    async def cog_load(self) -> None:
+        """
+        Starts the Ollama client's background work once the cog is loaded
+        """
+        self.ollama_client.start()
+
+    async def cog_unload(self) -> None:
+        """
+        Closes the Ollama connections and flushes pending context writes when the cog is unloaded or the bot shuts down
+        """
+        await self.ollama_client.close()
+
     @commands.Cog.listener()
     async def on_ready(self):
         print(f"Prompt command loaded")
@@ -32,15 +59,32 @@ class PromptCommand(commands.Cog):
     async def prompt(self, interaction: discord.Interaction, message: str) -> None:
         """
 
+        :param interaction: discord.Interaction
+        :param message: str
+        :return: None
+        """
+        # Time every stage of the prompt, slow ones get logged with their breakdown
+        slow_seconds = self.config.get('metrics', {}).get('slow_request_seconds')
+        with trace("prompt", slow_seconds=slow_seconds, guild=interaction.guild.id, user=interaction.user.id): #type: ignore
+            await self.answer_prompt(interaction, message)
+
+    async def answer_prompt(self, interaction: discord.Interaction, message: str) -> None:
+        """
+        Answers a prompt with the llm model's response
+
         :param interaction: discord.Interaction
         :param message: str
         :return: None
         """
         # Defer response
-        await interaction.response.defer(ephemeral=False)
+        with span("defer"):
+            await interaction.response.defer(ephemeral=False)
+
+        # The answer has to be ready while the interaction still takes followups
+        deadline = self.deadlines.for_interaction(interaction)
 
         # Print prompt
-        self.bot.logger.info(f"{interaction.user.name}/{interaction.user.id} has prompted the bot for '{message}'")
+        log_payload(f"{interaction.user.name}/{interaction.user.id} has prompted the bot for", message)
 
         # Retrieve model from config file
         model = self.config['llm']['model']
@@ -51,12 +95,45 @@ class PromptCommand(commands.Cog):
                 "An error has occurred, No model was set! Please contact the developers."
             )
 
-        # Prompt llm model for response
-        success, response = await self.ollama_client.prompt(
-            guild_id=interaction.guild.id, #type: ignore
-            user_id=interaction.user.id,
-            message=message,
-        )
+        async def on_queued(position: int) -> None:
+            # Let the user know they're waiting, a failed notice shouldn't fail the prompt
+            try:
+                await interaction.followup.send(f"I'm busy right now, you're #{position} in line!")
+            except discord.HTTPException as e:
+                self.bot.logger.error(f"Failed to send queue position: {type(e).__name__}: {e}")
+
+        # Sending starts as soon as the answer is ready, alongside persisting it and after our slot is freed
+        delivery: Optional[asyncio.Task] = None
+
+        def on_answer(content: str) -> None:
+            nonlocal delivery
+            delivery = asyncio.create_task(self.delivery.deliver(interaction, content))
+
+        try:
+            # Wait for our turn
+            async with self.scheduler.slot(interaction.guild.id, interaction.user.id, on_queued=on_queued): #type: ignore
+                # Stream the response into the followup messages while it's generated
+                if self.config['llm'].get('stream', False):
+                    return await self.stream_prompt(interaction, message, deadline)
+
+                # Prompt llm model for response
+                success, response = await self.ollama_client.prompt(
+                    guild_id=interaction.guild.id, #type: ignore
+                    user_id=interaction.user.id,
+                    message=message,
+                    queue_depth=self.scheduler.waiting,
+                    deadline=deadline,
+                    on_answer=on_answer,
+                )
+        except SchedulerFull:
+            return await interaction.followup.send(
+                "I'm too busy to take more prompts right now, please try again in a bit!"
+            )
+        except DeadlineExceeded as e:
+            self.bot.logger.warning(f"Gave up on {interaction.user.name}/{interaction.user.id}'s prompt: {e}")
+            return await interaction.followup.send(
+                "Sorry, that took me too long to answer! Please try again in a bit."
+            )
 
         # Check for failed success
         if not success:
@@ -65,21 +142,54 @@ class PromptCommand(commands.Cog):
             )
 
         # Log the model
-        self.bot.logger.info(f"{interaction.user.name}/{interaction.user.id} ollama response replied with: {response}")
+        log_payload(f"{interaction.user.name}/{interaction.user.id} ollama response replied with:", response)
+
+        # Follow up with a message to the user, wait for the answer's delivery to finish
+        with span("discord_send"):
+            if delivery is not None:
+                await delivery
+            else:
+                await self.delivery.deliver(interaction, response)
+
+    async def stream_prompt(self, interaction: discord.Interaction, message: str, deadline: Optional[float] = None) -> None:
+        """
+        Prompts the llm model in streaming mode, progressively editing the followup messages
+
+        :param interaction: discord.Interaction
+        :param message: str
+        :param deadline: Optional[float]
+        :return: None
+        """
+        stream = StreamingMessage(interaction, edit_interval=self.config['llm'].get('stream_edit_interval', 1.0))
+        stream.start()
+
+        try:
+            # Prompt llm model for response
+            success, response = await self.ollama_client.prompt(
+                guild_id=interaction.guild.id, #type: ignore
+                user_id=interaction.user.id,
+                message=message,
+                on_update=stream.update,
+                queue_depth=self.scheduler.waiting,
+                deadline=deadline,
+            )
+        except Exception:
+            stream.cancel()
+            raise
 
-        # Follow up with a message to the user
-        if len(response) <= 2000:
-            await interaction.followup.send(response)
-        else:
-            # Split into chunks of 2000 characters
-            chunks = [response[i:i + 2000] for i in range(0, len(response), 2000)]
+        # Check for failed success
+        if not success:
+            stream.cancel()
+            return await interaction.followup.send(
+                "An error has occurred, while trying to interact with our model! Please contact the developers."
+            )
 
-            # Send the first chunk
-            await interaction.followup.send(chunks[0])
+        # Log the model
+        log_payload(f"{interaction.user.name}/{interaction.user.id} ollama response replied with:", response)
 
-            # Send the rest of the chunks
-            for chunk in chunks[1:]:
-                await interaction.followup.send(chunk)
+        # Show the final response
+        with span("discord_send"):
+            await stream.finish(response)
 
 
 async def setup(bot: Bot):
@@ -0,0 +1,131 @@
+# LLM Libs
+from source.utilities.context_manager import ContextManager
+from source.utilities.messages import Message
+from source.utilities.ollama_pool import OllamaPool
+from source.utilities.metrics import metrics
+
+# Needed libs
+from typing import Dict, List, Set, Tuple
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("discord_bot")
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the following conversation between a user and an assistant as short notes. "
+    "Keep every fact about the user (names, goals, projects, preferences), every decision that was made "
+    "and every question that is still open. Don't add anything that isn't in the conversation."
+)
+
+
+class ContextCompactor:
+    def __init__(self, config: dict, context_handler: ContextManager, pool: OllamaPool):
+        """
+        Folds the oldest turns of long histories into a single summary message in the background
+
+        Once a user's history holds more than `threshold_tokens` tokens, their oldest `turns` turns (plus the previous
+        summary, if any) are summarized by the LLM off the request path and replaced with one system message carrying
+        its token count. Prompts stay bounded without silently dropping what was said.
+
+        Compaction is idempotent: a user is only compacted once at a time, and the summary is thrown away when the
+        summarized messages changed in the meantime (trimmed, cleared or already compacted).
+
+        Config (settings.json['compaction'], all optional):
+            - `enabled`: Whether to compact at all, defaults to false
+            - `threshold_tokens`: History size that triggers a compaction, defaults to 8192
+            - `turns`: Oldest turns folded into the summary per compaction, defaults to 10
+            - `model`: Model that writes the summaries, defaults to settings.json['llm']['model']
+        """
+        settings = config.get("compaction", {})
+        self.enabled: bool = settings.get("enabled", False)
+        self.threshold_tokens: int = settings.get("threshold_tokens", 8192)
+        self.turns: int = settings.get("turns", 10)
+        self.model: str = settings.get("model", config["llm"].get("model"))
+
+        self.context_handler = context_handler
+        self.pool = pool
+
+        # Users being compacted right now, and their tasks so they can be stopped on shutdown
+        self._compacting: Set[Tuple[int, int]] = set()
+        self._tasks: Dict[Tuple[int, int], asyncio.Task] = {}
+
+        # One summary at a time, compaction shouldn't compete with prompts for the GPU
+        self._lock = asyncio.Lock()
+
+    def maybe_compact(self, guild_id: int, user_id: int) -> None:
+        """
+        Start compacting a user in the background when their history got too long
+        """
+        key = (guild_id, user_id)
+        if not self.enabled or key in self._compacting:
+            return
+
+        if self.context_handler.user_tokens(guild_id, user_id) <= self.threshold_tokens:
+            return
+
+        self._compacting.add(key)
+        self._tasks[key] = asyncio.create_task(self._compact(guild_id, user_id))
+
+    def close(self) -> None:
+        """
+        Stop every running compaction, they start over once the user prompts again
+        """
+        for task in self._tasks.values():
+            task.cancel()
+
+    async def _compact(self, guild_id: int, user_id: int) -> None:
+        """
+        Summarize a user's oldest turns and swap them for the summary
+        """
+        try:
+            async with self._lock:
+                await self._summarize(guild_id, user_id)
+        except Exception as e:
+            metrics.increment("compaction_failures")
+            logger.error(f"Failed to compact context of {guild_id}/{user_id}: {type(e).__name__}: {e}")
+        finally:
+            self._compacting.discard((guild_id, user_id))
+            self._tasks.pop((guild_id, user_id), None)
+
+    async def _summarize(self, guild_id: int, user_id: int) -> None:
+        """
+        Summarize and replace, unless the history changed underneath us
+        """
+        context = self.context_handler.get_context(guild_id, user_id)
+
+        # The previous summary is folded into the new one
+        amount = self.turns * 2 + (1 if context and context[0].role == 'system' else 0)
+
+        # Always leave the latest turn alone
+        if len(context) - amount < 2:
+            return
+
+        oldest: List[Message] = context[:amount]
+        transcript = "\n".join(f"{message.role}: {message.content}" for message in oldest)
+
+        start = time.perf_counter()
+        response = await self.pool.chat(
+            model=self.model,
+            messages=[
+                {'role': 'system', 'content': SUMMARY_INSTRUCTIONS},
+                {'role': 'user', 'content': transcript},
+            ]
+        )
+
+        # Someone trimmed, cleared or compacted this user while we were summarizing
+        context = self.context_handler.get_context(guild_id, user_id)
+        if len(context) < amount or any(current is not old for current, old in zip(context, oldest)):
+            metrics.increment("compactions_discarded")
+            return
+
+        summary = Message('system', f"{SUMMARY_PREFIX}{response.message.content}")
+        before = sum(self.context_handler.message_tokens(message) for message in oldest)
+        self.context_handler.replace_oldest(guild_id, user_id, amount, [summary])
+
+        metrics.increment("compactions")
+        metrics.observe("compaction_seconds", time.perf_counter() - start)
+        metrics.increment("compaction_tokens_saved", before - self.context_handler.message_tokens(summary))
+        logger.info(f"Compacted {amount} messages of {guild_id}/{user_id} ({before} tokens) into a summary")
@@ -1,43 +1,100 @@
 # Needed libs
+from source.utilities.sqlite_database import SQLiteDatabase
+from source.utilities.storage import StorageBackend
+from source.utilities.memory_index import MemoryIndex
+from source.utilities.tokenizer import TokenCounter, count_batch, get_token_counter
+from source.utilities.workers import WorkerPool
+from source.utilities.sharding import Shards
+from source.utilities.messages import History, Message, as_message
 from source.utilities.database import Database
-from transformers import AutoTokenizer
-from typing import Dict, List
+from typing import Dict, List, Optional, Set, Tuple, Union
+from collections import OrderedDict
+import time
+
+# Storage backends selectable with settings.json['database']['backend']
+BACKENDS = {
+    "json": Database,
+    "sqlite": SQLiteDatabase,
+}
 
 
 class ContextManager:
-    def __init__(self, context_length = 131072):
+    def __init__(self, context_length = 131072, config: dict = None, memory: Optional[MemoryIndex] = None):
         """
         Initializes a context manager with a nested dictionary structure.
 
         Dictionary structure:
         {
             guild_id (int): {
-                user_id (int): {
-                    context_messages (list): [
-                        "role" (str): "user" | "assistant",  # Specifies if message is from user or AI
-                        "message" (str): "<user message or assistant response>"
-                    ]
-                }
+                user_id (int): History([
+                    Message(
+                        role (str): "user" | "assistant",  # Specifies if message is from user or AI
+                        content (str): "<user message or assistant response>",
+                        tokens (int): <cached token count of the message>
+                    )
+                ])
             }
         }
 
         - Each `guild_id` maps to a dictionary containing user contexts.
-        - Each `user_id` maps to a list of message objects (stored as dictionaries).
-        - Each message object contains:
-            - `"role"`: Defines whether the message is from the `"user"` or `"assistant"`.
-            - `"message"`: The actual text content of the message.
+        - Each `user_id` maps to a `History`, a deque of messages so trimming the oldest ones is cheap.
+        - Each message is a slotted `Message` record (dicts cost several times the memory per message):
+            - `role`: Defines whether the message is from the `"user"` or `"assistant"`, interned.
+            - `content`: The actual text content of the message.
+            - `tokens`: The message's token count, tokenized once and persisted with the message.
+
+        Messages only turn into dicts when they're sent to Ollama or written to the database.
+
+        Contexts are loaded lazily: startup only lists which users exist on disk, a user's context is read
+        the first time it's needed, and the least recently used users are evicted from memory once more than
+        `cache_max_users` users or `cache_max_tokens` tokens are resident (settings.json['database']).
+        Their history stays in the database and is read back on the next access.
+
+        The database is any `StorageBackend`, picked with settings.json['database']['backend']: "json" (default) or "sqlite".
+
+        When the bot runs as several processes each one only owns the guilds of its shards (settings.json['discord']),
+        only those are listed at startup and touching any other guild raises, so no two processes write the same history.
+
+        With a long-term memory index (`memory`), clearing a user's history also forgets what the index remembers
+        of them, so recall can't bring a cleared conversation back.
         """
-        self.context_dictionary: Dict[int, Dict[int, List]] = {}
+        self.context_dictionary: Dict[int, Dict[int, History]] = {}
+        self.config: dict = config or {}
+
+        # Long-term memory of the same users, if any
+        self.memory: Optional[MemoryIndex] = memory
 
-        # Load the tokenizer
-        self.tokenizer = AutoTokenizer.from_pretrained("deepseek-ai/DeepSeek-R1")
+        # Shared token counter of the configured model, its tokenizer loads in the background
+        self.token_counter: TokenCounter = get_token_counter(self.config)
 
         # The amount of tokens a model can handle
         self.context_length: int = context_length
 
-        # Database Handler
-        self.database = Database(context_manager=self)
-        self.database.load_db()
+        # Resident users, least recently used first, with the amount of tokens each one holds
+        settings = (config or {}).get("database", {})
+        self.cache_max_users: int = settings.get("cache_max_users", 10000)
+        self.cache_max_tokens: int = settings.get("cache_max_tokens", 20_000_000)
+        self.resident_users: OrderedDict[Tuple[int, int], int] = OrderedDict()
+        self.resident_tokens: int = 0
+
+        # When each resident user was last touched (unix time), newer than the database for users that only read
+        self.last_access: Dict[Tuple[int, int], float] = {}
+
+        # Guilds this process owns the contexts of
+        self.shards: Shards = Shards(self.config)
+
+        # Database Handler, only the keys are listed at startup
+        backend = settings.get("backend", "json")
+        self.database: StorageBackend = BACKENDS[backend](context_manager=self, config=config)
+        self.known_users: Dict[int, Set[int]] = {
+            guild_id: users for guild_id, users in self.database.list_users().items() if self.shards.owns(guild_id)
+        }
+
+    def close(self) -> None:
+        """
+        Flushes every pending context write to the database.
+        """
+        self.database.close()
 
     def add_guild(self, guild_id: int) -> None:
         """
@@ -48,61 +105,310 @@ class ContextManager:
 
     def add_user(self, guild_id: int, user_id: int) -> None:
         """
-        Ensures that a user exists in the specified guild context.
+        Ensures that a user exists in the specified guild context, loading it from the database if needed.
         """
+        self.check_owner(guild_id)
         self.add_guild(guild_id)  # Ensure the guild exists first
+        if user_id in self.context_dictionary[guild_id]:
+            self.resident_users.move_to_end((guild_id, user_id))
+            self.last_access[(guild_id, user_id)] = time.time()
+            return
+
+        # Load the user's history on first access
+        if user_id in self.known_users.get(guild_id, ()):
+            context = self.read_user(guild_id, user_id)
+        else:
+            context = []
+            self.known_users.setdefault(guild_id, set()).add(user_id)
+
+        self._make_resident(guild_id, user_id, context)
+
+    async def load_user(self, guild_id: int, user_id: int, workers: WorkerPool) -> None:
+        """
+        Loads a user's history on the worker pool, so reading and tokenizing a long history never blocks the event loop.
+        """
+        self.check_owner(guild_id)
+        if user_id in self.context_dictionary.get(guild_id, {}) or user_id not in self.known_users.get(guild_id, ()):
+            return
+
+        context = await workers.run_blocking(self.read_user, guild_id, user_id)
+        await self.count_pending(context, workers)
+
+        # Someone else loaded the user while we were reading, theirs may already have new messages
+        self.add_guild(guild_id)
         if user_id not in self.context_dictionary[guild_id]:
-            self.context_dictionary[guild_id][user_id] = []
+            self._make_resident(guild_id, user_id, context)
+
+    def check_owner(self, guild_id: int) -> None:
+        """
+        Raises if another process owns the guild's contexts.
+        """
+        if not self.shards.owns(guild_id):
+            raise ValueError(f"Guild {guild_id} belongs to a shard of another process")
 
-    def add_context(self, guild_id: int, user_id: int, messages: List[Dict]) -> None:
+    def add_context(self, guild_id: int, user_id: int, messages: List[Union[Message, Dict]]) -> None:
         """
         Adds multiple messages to the context of a specific user in a given guild.
         """
+        messages = [as_message(message) for message in messages]
+
         # Ensure the user exists first
         self.add_user(guild_id, user_id)
 
-        # Append to context
+        # Append to context, each message is tokenized once so prompt building never has to re-encode it
         self.context_dictionary[guild_id][user_id].extend(messages)
+        self._weigh(guild_id, user_id, messages)
 
-        # Write to database
-        self.database.write_db(
+        # Append the new messages to the database
+        self.database.append_context(
             guild_id=guild_id,
             user_id=user_id,
-            context=self.context_dictionary[guild_id][user_id]
+            messages=messages
         )
 
-    def get_context(self, guild_id: int, user_id: int) -> List[Dict]:
+        # Make room if the new messages pushed us over the limits
+        self.evict_users()
+
+    def count_tokens(self, text: str) -> int:
         """
-        Retrieves the message context for a user in a guild.
+        Counts the tokens of a piece of text, estimated until the tokenizer is loaded.
         """
-        return self.context_dictionary.get(guild_id, {}).get(user_id, [])
+        return self.token_counter.count(text)
+
+    def message_tokens(self, message: Message) -> int:
+        """
+        Returns the cached token count of a message, tokenizing and caching it on first use.
+
+        Messages are counted the way they appear in the prompt ("role: content"), messages
+        loaded from older database files don't have a count yet and get one here.
+        Estimates made without the tokenizer (still loading, or it failed to load) are cached as negative counts,
+        so they're counted again once the tokenizer is ready instead of on every prompt.
+        """
+        exact = self.token_counter.exact
+        if message.tokens is not None and (message.tokens >= 0 or not exact):
+            return abs(message.tokens)
+
+        tokens = self.count_tokens(f"{message.role}: {message.content}")
+        message.tokens = tokens if exact else -tokens
+        return tokens
+
+    async def count_pending(self, messages: List[Message], workers: WorkerPool) -> None:
+        """
+        Tokenizes every message without a cached count (or with an estimate the tokenizer can now replace)
+        in a single batch on the worker pool.
+        """
+        exact = self.token_counter.exact
+        pending = [message for message in messages if message.tokens is None or (exact and message.tokens < 0)]
+        if not pending:
+            return
+
+        exact, counts = await workers.run(
+            count_batch, self.config, [f"{message.role}: {message.content}" for message in pending]
+        )
+        for message, tokens in zip(pending, counts):
+            message.tokens = tokens if exact else -tokens
+
+    def get_context(self, guild_id: int, user_id: int) -> History:
+        """
+        Retrieves the message context for a user in a guild, loading it from the database if needed.
+        """
+        if user_id in self.context_dictionary.get(guild_id, {}) or user_id in self.known_users.get(guild_id, ()):
+            self.add_user(guild_id, user_id)
+            return self.context_dictionary[guild_id][user_id]
+        return History()
 
     def clear_user_context(self, guild_id: int, user_id: int) -> None:
         """
         Clears the context for a specific user in a guild.
         """
-        if guild_id in self.context_dictionary and user_id in self.context_dictionary[guild_id]:
-            del self.context_dictionary[guild_id][user_id]
+        self.evict_user(guild_id, user_id)
+
+        if user_id in self.known_users.get(guild_id, ()):
+            self.database.clear_context(guild_id, user_id)
+
+        if self.memory is not None:
+            self.memory.forget(guild_id, user_id)
 
     def clear_guild_context(self, guild_id: int) -> None:
         """
-        Clears all contexts within a guild.
+        Deletes every user of a guild, from memory, the database and long-term memory.
         """
-        if guild_id in self.context_dictionary:
-            del self.context_dictionary[guild_id]
+        users = set(self.context_dictionary.get(guild_id, ())) | self.known_users.get(guild_id, set())
+        for user_id in users:
+            self.delete_user(guild_id, user_id)
 
     def clear_all_contexts(self) -> None:
         """
-        Clears all stored contexts.
+        Deletes every user this process owns, from memory, the database and long-term memory.
+        """
+        for guild_id in set(self.context_dictionary) | set(self.known_users):
+            self.clear_guild_context(guild_id)
+
+    def delete_user(self, guild_id: int, user_id: int, forget: bool = True) -> None:
+        """
+        Removes a user altogether, unlike a clear no empty history is left behind in the database.
+
+        Their long-term memory goes too, unless `forget` is off because the caller forgets many users at once
+        with `MemoryIndex.forget_users` off the event loop.
+        """
+        self.evict_user(guild_id, user_id)
+        if forget and self.memory is not None:
+            self.memory.forget(guild_id, user_id)
+
+        users = self.known_users.get(guild_id)
+        if users is not None and user_id in users:
+            users.discard(user_id)
+            if not users:
+                del self.known_users[guild_id]
+            self.database.delete_context(guild_id, user_id)
+
+    def evict_user(self, guild_id: int, user_id: int) -> None:
+        """
+        Drops a user's history from memory, it's read back from the database on the next access.
         """
-        self.context_dictionary.clear()
+        if user_id in self.context_dictionary.get(guild_id, {}):
+            del self.context_dictionary[guild_id][user_id]
+            self.resident_tokens -= self.resident_users.pop((guild_id, user_id))
+            self.last_access.pop((guild_id, user_id), None)
 
-    def trim_user_context(self, guild_id: int, user_id: int) -> None:
+    def last_active(self, guild_id: int, user_id: int, stored: float = 0.0) -> float:
+        """
+        When a user was last used (unix time), `stored` is when the database last saw their history change.
+        """
+        return max(self.last_access.get((guild_id, user_id), 0.0), stored)
+
+    def is_resident(self, guild_id: int, user_id: int) -> bool:
+        """
+        Whether a user's history is in memory right now.
+        """
+        return user_id in self.context_dictionary.get(guild_id, {})
+
+    def resident_context(self, guild_id: int, user_id: int) -> Optional[History]:
+        """
+        A user's history if it's in memory right now, without counting as an access like `get_context` does.
+        """
+        return self.context_dictionary.get(guild_id, {}).get(user_id)
+
+    def trim_stored_context(self, guild_id: int, user_id: int, amount: int, summary: Optional[Message] = None) -> None:
+        """
+        Removes a user's oldest `amount` messages without loading them, when they're not in memory.
+
+        With the user's leading compaction `summary`, the `amount` messages after it are removed and the summary stays.
+        A trim doesn't count as an access, so it never keeps an idle user from expiring.
+        """
+        if amount <= 0:
+            return
+
+        context = self.resident_context(guild_id, user_id)
+        if summary is not None:
+            if context is not None:
+                self._replace_oldest(guild_id, user_id, context, amount + 1, [summary])
+            elif user_id in self.known_users.get(guild_id, ()):
+                self.database.replace_context(guild_id, user_id, amount + 1, [summary])
+        elif context is not None:
+            self._trim(guild_id, user_id, context, amount)
+        elif user_id in self.known_users.get(guild_id, ()):
+            self.database.trim_context(guild_id, user_id, amount)
+
+    def trim_user_context(self, guild_id: int, user_id: int, amount: int = 2) -> None:
         """
         Trim a user's context window, this may be a bad approach currently since we don't summarize
         the LLMs responses yet. Say we trim some key context, the LLM won't know and try its best to respond.
+
+        Removes the oldest `amount` messages (a user prompt and llm response by default) in one go.
+        """
+        self._trim(guild_id, user_id, self.get_context(guild_id, user_id), amount)
+
+    def _trim(self, guild_id: int, user_id: int, context: History, amount: int) -> None:
+        """
+        Removes the oldest `amount` messages of a loaded history, in memory and in the database.
+        """
+        if context and amount > 0:
+            context.trim(amount)
+            self._reweigh(guild_id, user_id)
+
+            self.database.trim_context(guild_id, user_id, amount)
+
+    def replace_oldest(self, guild_id: int, user_id: int, amount: int, messages: List[Union[Message, Dict]]) -> None:
+        """
+        Replaces the oldest `amount` messages of a user with (fewer) new messages, used to fold old turns into a summary.
+        """
+        self._replace_oldest(guild_id, user_id, self.get_context(guild_id, user_id), amount, messages)
+
+    def _replace_oldest(self, guild_id: int, user_id: int, context: History, amount: int,
+                        messages: List[Union[Message, Dict]]) -> None:
+        """
+        Replaces the oldest `amount` messages of a loaded history, in memory and in the database.
+        """
+        messages = [as_message(message) for message in messages]
+        if context and 0 < len(messages) <= amount:
+            context.replace_oldest(amount, messages)
+            self._reweigh(guild_id, user_id)
+
+            self.database.replace_context(guild_id, user_id, amount, messages)
+
+    def user_tokens(self, guild_id: int, user_id: int) -> int:
+        """
+        The amount of tokens in a user's context, loading it from the database if needed.
+        """
+        if not self.get_context(guild_id, user_id):
+            return 0
+        return self.resident_users[(guild_id, user_id)]
+
+    def evict_users(self) -> None:
+        """
+        Evicts the least recently used users from memory until we're back under the cache limits.
+
+        Users with writes that haven't reached the disk yet are skipped, reloading them now would lose those writes.
+        The most recently used user is never evicted.
+        """
+        if len(self.resident_users) <= self.cache_max_users and self.resident_tokens <= self.cache_max_tokens:
+            return
+
+        for guild_id, user_id in list(self.resident_users)[:-1]:
+            if len(self.resident_users) <= self.cache_max_users and self.resident_tokens <= self.cache_max_tokens:
+                break
+
+            if self.database.has_unflushed(guild_id, user_id):
+                continue
+
+            self.evict_user(guild_id, user_id)
+
+    def read_user(self, guild_id: int, user_id: int) -> List[Message]:
+        """
+        Reads a user's history from the database, safe to call from a worker thread.
+
+        A change queued while the user wasn't resident (a clear or a trim) is flushed first, or we'd read back stale history.
+        """
+        if self.database.has_unflushed(guild_id, user_id):
+            self.database.flush()
+        return self.database.load_user(guild_id, user_id)
+
+    def _make_resident(self, guild_id: int, user_id: int, context: List[Message]) -> None:
+        """
+        Keeps a loaded history in memory and makes room for it.
+        """
+        self.context_dictionary[guild_id][user_id] = History(context)
+        self.resident_users[(guild_id, user_id)] = 0
+        self.last_access[(guild_id, user_id)] = time.time()
+        self._weigh(guild_id, user_id, context)
+        self.evict_users()
+
+    def _weigh(self, guild_id: int, user_id: int, messages: List[Message]) -> None:
+        """
+        Adds the tokens of newly resident messages to the cache totals.
+        """
+        tokens = sum(self.message_tokens(message) for message in messages)
+        self.resident_users[(guild_id, user_id)] += tokens
+        self.resident_tokens += tokens
+
+    def _reweigh(self, guild_id: int, user_id: int) -> None:
+        """
+        Recounts a resident user's weight from the current counts of its messages, replacing what was added before.
+
+        Counts change after they're weighed (estimates replaced once the tokenizer is loaded), subtracting the removed
+        messages' new counts from the old weight would let the cache totals drift.
         """
-        context = self.get_context(guild_id, user_id)
-        if len(context) >= 2:
-            self.context_dictionary[guild_id][user_id].pop(0) # Trim user prompt
-            self.context_dictionary[guild_id][user_id].pop(1) # Trim llm response
+        tokens = sum(self.message_tokens(message) for message in self.context_dictionary[guild_id][user_id])
+        self.resident_tokens += tokens - self.resident_users[(guild_id, user_id)]
+        self.resident_users[(guild_id, user_id)] = tokens
@@ -1,50 +1,290 @@
-from typing import Dict, List
+from source.utilities.storage import StorageBackend
+from source.utilities.messages import Message
+from source.utilities.metrics import metrics
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
+import logging
 import json
+import time
 import os
 
+logger = logging.getLogger("discord_bot")
 
-class Database:
-    def __init__(self, context_manager):
+
+class Database(StorageBackend):
+    def __init__(self, context_manager, config: dict = None):
         """
-        JSON Based Database System
+        JSON Based Database System, stores one folder per guild and files per user
+
+        Users are loaded one at a time with `load_user` when they're first needed, `list_users` only lists them.
+
+        Every user has a snapshot (`<user>.json`) and an append-only journal (`<user>.jsonl`). Each change
+        to a context (append, trim, replace, clear or delete) is one journal record, so the bytes written per prompt only
+        depend on the new messages and never on the length of the history. Once a journal gets long it's
+        compacted: the snapshot and the journal are folded into a new snapshot and the journal starts over.
+
+        Snapshot structure:
+        {
+            "seq" (int): <sequence number of the last record folded into this snapshot>,
+            "context" (list): [<message>, ...]
+        }
+
+        The journal holds one storage record (see `StorageBackend`) per line. Deleting a user removes both files.
+
+        Records are numbered again by the writer, after the last sequence number on disk, so a record queued for a
+        user that wasn't loaded since startup (a clear, a trim from maintenance) is never mistaken for one that's
+        already folded into the snapshot.
+
+        Config (settings.json['database'], all optional):
+            - `path`: Root folder of the database, defaults to "./database"
+            - `compact_after`: Journal records a user can have before it gets compacted, defaults to 100
         """
-        # Context Manager
-        self.context_manager = context_manager
+        # Database settings
+        settings = (config or {}).get("database", {})
+        self.path: str = settings.get("path", "./database")
+        self.compact_after: int = settings.get("compact_after", 100)
+
+        # Amount of journal records on disk, per user
+        self._journal_records: Dict[Tuple[int, int], Optional[int]] = {}
 
+        # Last sequence number on disk, per user
+        self._stored_sequences: Dict[Tuple[int, int], int] = {}
 
-    def load_db(self):
+        # Starts the background writer
+        super().__init__(context_manager=context_manager, config=config)
+
+    def list_users(self) -> Dict[int, Set[int]]:
         """
-        Loop through all servers and users in the database
+        List every user that has a context in the database without reading any of them
         """
-        for guild_id in os.listdir("./database"):
+        users: Dict[int, Set[int]] = {}
+        for guild_entry in os.scandir(self.path):
             # Don't load this file, it's not valided
-            if "DO_NOT_TOUCH" in guild_id:
+            if not guild_entry.is_dir():
+                continue
+
+            # Users can have a snapshot, a journal or both
+            users[int(guild_entry.name)] = {
+                int(user_entry.name.split(".")[0])
+                for user_entry in os.scandir(guild_entry.path)
+                if user_entry.name.endswith((".json", ".jsonl"))
+            }
+        return users
+
+    def usage(self) -> Dict[Tuple[int, int], Tuple[float, int]]:
+        """
+        When every user's files last changed and their size, from the file system alone
+        """
+        usage: Dict[Tuple[int, int], Tuple[float, int]] = {}
+        for guild_entry in os.scandir(self.path):
+            if not guild_entry.is_dir():
                 continue
 
-            # Load database
-            for user_id in os.listdir(f"./database/{guild_id}"):
-                with open(f"./database/{guild_id}/{user_id}", "r") as file:
-                    # Clean User_ID so it doesn't have .json
-                    guild_id = int(guild_id)
-                    user_id = int(user_id.replace(".json", ""))
-                    # print(f"Loading user {user_id}")
+            for user_entry in os.scandir(guild_entry.path):
+                if not user_entry.name.endswith((".json", ".jsonl")):
+                    continue
 
-                    # Add database context to user
-                    self.context_manager.add_user(guild_id, user_id)
-                    self.context_manager.context_dictionary[guild_id][user_id] = json.load(file)
-                    # print(f"Loaded Context: {self.context_manager.context_dictionary[guild_id][user_id]}")
+                try:
+                    stat = user_entry.stat()
+                except FileNotFoundError:
+                    # Deleted or compacted since it was listed
+                    continue
 
-    def write_db(self, guild_id: int, user_id: int, context: List[Dict]) -> None:
+                key = (int(guild_entry.name), int(user_entry.name.split(".")[0]))
+                modified, size = usage.get(key, (0.0, 0))
+                usage[key] = (max(modified, stat.st_mtime), size + stat.st_size)
+        return usage
+
+    def storage_bytes(self) -> int:
         """
-        Write or update user messages to JSON Database
+        Total size of the database folder, long-term memory files included
         """
-        guild_path = f"./database/{guild_id}"
-        user_path = f"{guild_path}/{user_id}.json"
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(self.path)
+            for name in names
+        )
+
+    def compact_all(self, throttle: Callable[[int], None], owns: Callable[[int], bool]) -> int:
+        """
+        Fold every non-empty journal into its snapshot, one user at a time so the writer is only held up briefly
+        """
+        written = 0
+        for guild_entry in os.scandir(self.path):
+            if not guild_entry.is_dir() or not owns(int(guild_entry.name)):
+                continue
+
+            for user_entry in os.scandir(guild_entry.path):
+                if not user_entry.name.endswith(".jsonl") or user_entry.stat().st_size == 0:
+                    continue
+
+                guild_id, user_id = int(guild_entry.name), int(user_entry.name.split(".")[0])
+                with self._flush_lock:
+                    # Deleted while we were getting to it
+                    if not os.path.exists(user_entry.path):
+                        continue
+                    self._compact_user(guild_id, user_id)
+                    size = os.path.getsize(self._user_paths(guild_id, user_id)[0])
+
+                written += size
+                throttle(size)
+        return written
+
+    def load_user(self, guild_id: int, user_id: int) -> List[Message]:
+        """
+        Read a user's context from disk, replaying its journal on top of its snapshot
+        """
+        # Under the writer's lock, a compaction replaces the snapshot before it truncates the journal
+        with self._flush_lock:
+            _, context = self._read_user(guild_id, user_id)
+
+            # Rewrite a journal with a torn record right away, otherwise the next append would land on the same line
+            if self._journal_records.get((guild_id, user_id)) is None:
+                self._compact_user(guild_id, user_id)
+        return [Message.from_dict(message) for message in context]
+
+    def _write_user(self, guild_id: int, user_id: int, records: List[Dict]) -> None:
+        """
+        Append records to a user's journal, then compact it if it got too long
+        """
+        # A delete removes the user's files, only what was queued after it is written again
+        deleted = max((index for index, record in enumerate(records) if record["op"] == "delete"), default=None)
+        if deleted is not None:
+            self._delete_user(guild_id, user_id)
+            records = records[deleted + 1:]
+            if not records:
+                return
+
+        # Continue after the last record on disk, read it when the user wasn't loaded since startup
+        key = (guild_id, user_id)
+        if key not in self._stored_sequences:
+            self._read_user(guild_id, user_id)
+        for index, record in enumerate(records, start=self._stored_sequences[key] + 1):
+            record["seq"] = index
+
+        self._append_journal(guild_id, user_id, records)
+
+        if (self._journal_records.get((guild_id, user_id)) or 0) >= self.compact_after:
+            try:
+                self._compact_user(guild_id, user_id)
+            except OSError as e:
+                # The journal is still intact, compaction is retried after the next append
+                logger.error(f"Failed to compact context of {guild_id}/{user_id}: {type(e).__name__}: {e}")
+
+    def _user_paths(self, guild_id: int, user_id: int) -> Tuple[str, str]:
+        """
+        Returns the snapshot and journal paths of a user
+        """
+        return f"{self.path}/{guild_id}/{user_id}.json", f"{self.path}/{guild_id}/{user_id}.jsonl"
+
+    def _delete_user(self, guild_id: int, user_id: int) -> None:
+        """
+        Remove a user's snapshot and journal, and the guild's folder once it's empty
+        """
+        for path in self._user_paths(guild_id, user_id):
+            if os.path.exists(path):
+                os.remove(path)
+        self._journal_records.pop((guild_id, user_id), None)
+        self._stored_sequences[(guild_id, user_id)] = 0
+
+        try:
+            os.rmdir(f"{self.path}/{guild_id}")
+        except OSError:
+            # Other users (or long-term memory) still live there
+            pass
+
+    def _append_journal(self, guild_id: int, user_id: int, records: List[Dict]) -> None:
+        """
+        Append records to a user's journal in a single write
+        """
+        _, journal_path = self._user_paths(guild_id, user_id)
 
         # Make sure guild folder exists
-        os.makedirs(guild_path, exist_ok=True)
+        os.makedirs(f"{self.path}/{guild_id}", exist_ok=True)
+
+        data = "".join(json.dumps(record, default=Message.to_dict) + "\n" for record in records)
+        with open(journal_path, "a") as file:
+            file.write(data)
+
+        key = (guild_id, user_id)
+        self._journal_records[key] = (self._journal_records.get(key) or 0) + len(records)
+        self._stored_sequences[key] = max(self._stored_sequences.get(key, 0), records[-1]["seq"])
+        metrics.increment("database_bytes_written", len(data))
+
+    def _compact_user(self, guild_id: int, user_id: int) -> None:
+        """
+        Fold a user's journal into a new snapshot and start an empty journal
+
+        The snapshot is replaced atomically before the journal is truncated, if we crash in between the
+        loader skips the journal records that are already part of the snapshot by their sequence number.
+        """
+        snapshot_path, journal_path = self._user_paths(guild_id, user_id)
+        sequence, context = self._read_user(guild_id, user_id)
+
+        start = time.perf_counter()
+        temp_path = f"{snapshot_path}.tmp"
+        data = json.dumps({"seq": sequence, "context": context})
+        with open(temp_path, "w") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, snapshot_path)
+
+        # Start over with an empty journal
+        open(journal_path, "w").close()
+        self._journal_records[(guild_id, user_id)] = 0
+
+        metrics.observe("database_compaction_seconds", time.perf_counter() - start)
+        metrics.increment("database_bytes_written", len(data))
+
+    def _read_user(self, guild_id: int, user_id: int) -> Tuple[int, List[Dict]]:
+        """
+        Replay a user's journal on top of its snapshot, returns the last sequence number and the context
+        """
+        snapshot_path, journal_path = self._user_paths(guild_id, user_id)
+        sequence, context = 0, []
+
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, "r") as file:
+                snapshot = json.load(file)
+
+            # Older databases stored the bare list of messages
+            if isinstance(snapshot, list):
+                context = snapshot
+            else:
+                sequence, context = snapshot["seq"], snapshot["context"]
+
+        records, corrupt = 0, False
+        if os.path.exists(journal_path):
+            with open(journal_path, "r") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn last line from a crash mid append, everything before it is intact
+                        logger.warning(f"Skipping a corrupt journal record of {guild_id}/{user_id}")
+                        corrupt = True
+                        continue
+
+                    records += 1
+
+                    # Already folded into the snapshot
+                    if record["seq"] <= sequence:
+                        continue
+
+                    sequence = record["seq"]
+                    if record["op"] == "append":
+                        context.extend(record["messages"])
+                    elif record["op"] == "trim":
+                        del context[:record["amount"]]
+                    elif record["op"] == "replace":
+                        context[:record["amount"]] = record["messages"]
+                    elif record["op"] == "clear":
+                        context.clear()
+
+        # A corrupt journal has no usable record count, it has to be compacted before it's appended to
+        self._journal_records[(guild_id, user_id)] = None if corrupt else records
 
-        # Write entire context to database (too lazy to append :p)
-        with open(user_path, "w+") as file:
-            file.write(json.dumps(context, indent=4))
+        # Never go back, a loader racing the writer may have read the files before its latest append
+        self._stored_sequences[(guild_id, user_id)] = max(self._stored_sequences.get((guild_id, user_id), 0), sequence)
+        return sequence, context
@@ -0,0 +1,96 @@
+# Needed libs
+from source.utilities.metrics import metrics
+from datetime import datetime, timezone
+from collections import deque
+from typing import Deque, Dict, Optional
+import discord
+import time
+
+# How long Discord accepts followup messages to an interaction
+FOLLOWUP_WINDOW = 15 * 60
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a prompt can't be answered before its deadline
+    """
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """
+    Seconds left until a `time.monotonic()` deadline, None when there's no deadline
+    """
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class Deadlines:
+    def __init__(self, config: dict):
+        """
+        Derives a prompt's deadline from the interaction's remaining lifetime
+
+        Followups can only be sent for 15 minutes after the interaction was created, an answer that's ready later
+        is thrown away. Prompts get until `margin_seconds` before that, so there's still time to tell the user it
+        took too long, or `max_seconds` after they were sent when that's sooner.
+
+        Config (settings.json['deadlines'], all optional):
+            - `margin_seconds`: Seconds kept before the followup window closes, defaults to 30
+            - `max_seconds`: Longest a prompt may take, defaults to the followup window
+        """
+        settings = config.get("deadlines", {})
+        self.margin_seconds: float = settings.get("margin_seconds", 30.0)
+        self.max_seconds: Optional[float] = settings.get("max_seconds")
+
+    def for_interaction(self, interaction: discord.Interaction) -> float:
+        """
+        The `time.monotonic()` deadline of an interaction's answer
+        """
+        age = (datetime.now(timezone.utc) - interaction.created_at).total_seconds()
+        seconds = FOLLOWUP_WINDOW - self.margin_seconds - max(age, 0.0)
+        if self.max_seconds is not None:
+            seconds = min(seconds, self.max_seconds)
+        return time.monotonic() + seconds
+
+
+class LatencyTracker:
+    def __init__(self, config: dict):
+        """
+        Recent generation latencies per model, and when a request has taken long enough to hedge
+
+        A non-streamed request still running after the `percentile` latency of its model's last `window` requests
+        gets a second copy sent to another node (or a smaller model), the first answer wins and the other is
+        cancelled. Only `percentile` of requests ever get hedged, so the extra load stays small.
+
+        Config (settings.json['hedging'], all optional):
+            - `enabled`: Whether to hedge at all, defaults to false
+            - `percentile`: Latency percentile that triggers the hedge, defaults to 0.95
+            - `window`: Latest requests per model the percentile is taken over, defaults to 200
+            - `min_samples`: Requests a model needs before it's hedged, defaults to 20
+            - `min_seconds`: Never hedge sooner than this, defaults to 1
+        """
+        settings = config.get("hedging", {})
+        self.enabled: bool = settings.get("enabled", False)
+        self.percentile: float = settings.get("percentile", 0.95)
+        self.window: int = settings.get("window", 200)
+        self.min_samples: int = settings.get("min_samples", 20)
+        self.min_seconds: float = settings.get("min_seconds", 1.0)
+
+        self._latencies: Dict[str, Deque[float]] = {}
+
+    def observe(self, model: str, seconds: float) -> None:
+        """
+        Record how long a model took to answer
+        """
+        self._latencies.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def hedge_after(self, model: str) -> Optional[float]:
+        """
+        Seconds after which a request to `model` should be hedged, None when it shouldn't be
+        """
+        latencies = self._latencies.get(model)
+        if not self.enabled or latencies is None or len(latencies) < self.min_samples:
+            return None
+
+        ordered = sorted(latencies)
+        threshold = max(self.min_seconds, ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))])
+        metrics.set_gauge(f'hedge_threshold_seconds{{model="{model}"}}', threshold)
+        return threshold
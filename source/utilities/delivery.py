@@ -0,0 +1,161 @@
+# Discord Libs
+from source.utilities.metrics import metrics, SIZE_BUCKETS
+import discord
+
+# Needed libs
+from typing import Deque, List, Optional, Tuple
+from collections import deque
+import asyncio
+import time
+import io
+
+# Discord's message length limit
+MESSAGE_LIMIT = 2000
+
+# Markdown code fence, the line opening a block carries its language
+FENCE = "```"
+
+
+def _cut(text: str, budget: int) -> Tuple[int, int]:
+    """
+    Where a chunk of at most `budget` characters ends and where the next one starts
+
+    Prefers a paragraph break near the end, then a line break or a space as long as the chunk stays at least half
+    full, so answers don't spread over more messages than they need.
+    """
+    for separator, fill in (("\n\n", 0.75), ("\n", 0.5), (" ", 0.5)):
+        index = text.rfind(separator, int(budget * fill), budget + len(separator))
+        if index > 0:
+            return index, index + len(separator)
+    return budget, budget
+
+
+def _fence_after(fence: Optional[str], text: str) -> Optional[str]:
+    """
+    The opening line of the code block still open at the end of `text`, given the one open at its start
+    """
+    for line in text.split("\n"):
+        stripped = line.strip()
+        if not stripped.startswith(FENCE):
+            continue
+
+        if fence is not None:
+            fence = None
+        elif stripped.count(FENCE) == 1:
+            # "```py" opens a block, "```code```" opens and closes it on the same line. Only the language is
+            # reopened with, anything after it on the line was already sent
+            fence = FENCE + next(iter(stripped[len(FENCE):].split()), "")
+    return fence
+
+
+def split_markdown(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Splits text into messages of at most `limit` characters, between paragraphs, lines or words where possible
+
+    A code block that's cut in two is closed at the end of one message and reopened, with its language, at the
+    start of the next one, so both halves still render as code.
+    """
+    chunks: List[str] = []
+    fence: Optional[str] = None
+    while text:
+        opening = f"{fence}\n" if fence is not None else ""
+        if len(opening) + len(text) <= limit:
+            chunks.append(opening + text)
+            break
+
+        # Leave room to close a code block that's still open at the cut
+        budget = limit - len(opening) - len(FENCE) - 1
+        plain = budget < limit // 2
+        if plain:
+            # A language too long to reopen the block with, the rest is cut as plain text
+            opening, budget = "", limit
+
+        end, start = _cut(text, budget)
+        piece = text[:end]
+        fence_after = None if plain else _fence_after(fence, piece)
+        chunk = opening + piece + (f"\n{FENCE}" if fence_after is not None else "")
+        if chunk.strip():
+            chunks.append(chunk)
+
+        text = text[start:]
+        fence = fence_after
+    return chunks
+
+
+class WebhookPacer:
+    def __init__(self, requests: int, seconds: float):
+        """
+        Spaces out requests to a webhook so no more than `requests` go out in any `seconds` long window
+
+        Interaction followups share the interaction's webhook bucket, waiting for room in it is cheaper than running
+        into a 429 and retrying (and too many 429s get the bot temporarily banned). Discord.py still honours the
+        actual rate limit headers when Discord's bucket is tighter.
+        """
+        self.requests = requests
+        self.seconds = seconds
+        self._sent: Deque[float] = deque()
+
+    async def __aenter__(self) -> None:
+        """
+        Wait until the bucket has room for another request
+        """
+        now = time.monotonic()
+        while self._sent and now - self._sent[0] >= self.seconds:
+            self._sent.popleft()
+
+        if len(self._sent) >= self.requests:
+            delay = self._sent.popleft() + self.seconds - now
+            metrics.observe("discord_delivery_paced_seconds", delay)
+            await asyncio.sleep(delay)
+
+    async def __aexit__(self, *exc_info) -> None:
+        """
+        Count the request once it's answered, by then Discord has surely counted it too
+        """
+        self._sent.append(time.monotonic())
+
+
+class Delivery:
+    def __init__(self, config: dict):
+        """
+        Sends finished answers to an interaction as followup messages, or as a file once they're too long for chat
+
+        - Answers are split between paragraphs, lines or words, code blocks cut in two are reopened in the next message
+        - Sends are paced to stay inside the followup webhook's rate limit bucket
+        - Answers longer than `attach_above` characters are sent as a single markdown file with a short preview
+
+        Config (settings.json['delivery'], all optional):
+            - `attach_above`: Characters past which the answer is attached as a file, defaults to 8000, null never attaches
+            - `preview_chars`: Characters of an attached answer shown in the message, defaults to 300
+            - `bucket_requests`: Requests the followup webhook bucket allows per window, defaults to 5
+            - `bucket_seconds`: Length of the bucket's window, defaults to 2
+        """
+        settings = config.get("delivery", {})
+        self.attach_above: Optional[int] = settings.get("attach_above", 8000)
+        self.preview_chars: int = settings.get("preview_chars", 300)
+        self.bucket_requests: int = settings.get("bucket_requests", 5)
+        self.bucket_seconds: float = settings.get("bucket_seconds", 2.0)
+
+    async def deliver(self, interaction: discord.Interaction, text: str) -> None:
+        """
+        Send an answer to the interaction's followup webhook
+        """
+        start = time.perf_counter()
+        if self.attach_above is not None and len(text) > self.attach_above:
+            preview = split_markdown(text, self.preview_chars)[0]
+            await interaction.followup.send(
+                f"{preview}\n…\n*The full answer is attached.*",
+                file=discord.File(io.BytesIO(text.encode()), filename="answer.md")
+            )
+            messages = 1
+            metrics.increment("discord_delivery_attachments")
+        else:
+            pacer = WebhookPacer(self.bucket_requests, self.bucket_seconds)
+            chunks = split_markdown(text) or [text]
+            for chunk in chunks:
+                async with pacer:
+                    await interaction.followup.send(chunk)
+            messages = len(chunks)
+
+        metrics.observe("discord_delivery_seconds", time.perf_counter() - start)
+        metrics.observe("discord_delivery_messages", messages, buckets=SIZE_BUCKETS)
@@ -0,0 +1,57 @@
+# Needed libs
+from source.utilities.metrics import metrics
+from typing import Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("discord_bot")
+
+
+class LoopLagMonitor:
+    def __init__(self, config: dict):
+        """
+        Watches how long the event loop gets blocked
+
+        A background task sleeps `lag_interval` seconds at a time, any time it oversleeps is time the loop spent
+        running something else without yielding. Every lag is recorded as `event_loop_lag_seconds`, and a lag over
+        `lag_threshold` seconds is logged since it delays gateway heartbeats and interaction acknowledgments.
+
+        Config (settings.json['monitor'], all optional):
+            - `lag_interval`: Seconds between checks, defaults to 0.5
+            - `lag_threshold`: Lag that gets logged, defaults to 0.25
+        """
+        settings = config.get("monitor", {})
+        self.lag_interval: float = settings.get("lag_interval", 0.5)
+        self.lag_threshold: float = settings.get("lag_threshold", 0.25)
+
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """
+        Start watching, must be called with the event loop running
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    def stop(self) -> None:
+        """
+        Stop watching
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _watch(self) -> None:
+        """
+        Measure how late every wakeup is
+        """
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.perf_counter() - start - self.lag_interval)
+
+            metrics.observe("event_loop_lag_seconds", lag)
+            if lag > self.lag_threshold:
+                metrics.increment("event_loop_stalls")
+                logger.warning(f"Event loop was blocked for {lag:.3f}s (threshold {self.lag_threshold:.3f}s)")
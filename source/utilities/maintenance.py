@@ -0,0 +1,310 @@
+# Needed libs
+from source.utilities.context_manager import ContextManager
+from source.utilities.memory_index import MemoryIndex
+from source.utilities.messages import Message
+from source.utilities.metrics import metrics
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import threading
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("discord_bot")
+
+# Users handled between two yields to the event loop
+YIELD_EVERY = 1000
+
+
+class MaintenanceStopped(Exception):
+    """
+    Raised on the maintenance thread when the bot shuts down mid sweep
+    """
+
+
+class Throttle:
+    def __init__(self, bytes_per_second: Optional[float]):
+        """
+        Paces the maintenance thread's I/O, called with the bytes of every step it just wrote
+
+        Sleeps on the calling (worker) thread long enough to stay under `bytes_per_second`, so a sweep never
+        saturates the disk the database writer and history loads share. None doesn't pace at all.
+        """
+        self.bytes_per_second = bytes_per_second
+        self._stopped = threading.Event()
+
+    def __call__(self, size: int) -> None:
+        if self._stopped.is_set():
+            raise MaintenanceStopped()
+
+        if self.bytes_per_second and size > 0:
+            # Waking up early on shutdown
+            if self._stopped.wait(size / self.bytes_per_second):
+                raise MaintenanceStopped()
+
+    def stop(self) -> None:
+        """
+        Make the next step of the running sweep give up
+        """
+        self._stopped.set()
+
+
+def leading_summary(context: Sequence[Message]) -> Optional[Message]:
+    """
+    The compaction summary a history starts with, if any
+    """
+    return context[0] if context and context[0].role == 'system' else None
+
+
+def trim_amount(context: Sequence[Message], max_bytes: int) -> int:
+    """
+    How many of the oldest turns' messages have to go for a history to fit in `max_bytes` bytes of content
+
+    A leading compaction summary counts against the cap but always stays, the amount counts the messages after it.
+    Whole turns are kept from the newest one back, the latest turn always stays even when it's larger on its own.
+    """
+    summary = leading_summary(context)
+    history = context[1:] if summary is not None else context
+    size = len(summary.content.encode()) if summary is not None else 0
+
+    kept = 0
+    for message in reversed(history):
+        size += len(message.content.encode())
+        if size > max_bytes:
+            break
+        kept += 1
+
+    # Keep whole turns, and at least the latest one
+    kept = max(kept - kept % 2, min(2, len(history)))
+    return len(history) - kept
+
+
+class Maintenance:
+    def __init__(self, config: dict, context_handler: ContextManager, memory: MemoryIndex):
+        """
+        Keeps the context database from growing forever, with a sweep every `interval_seconds`
+
+        A sweep:
+        - Deletes users that haven't been active for `ttl_days` days, history and long-term memory
+        - Deletes the least recently active users of guilds storing more than `max_guild_bytes` bytes
+        - Trims the oldest turns of users storing more than `max_user_bytes` bytes of messages, keeping their summary
+        - Compacts the storage (folds JSON journals into their snapshots, gives free SQLite pages back)
+
+        Sizes come from the storage without reading histories, only users over `max_user_bytes` are read to see
+        how much has to go. Every step that touches the disk runs on a thread of its own, compaction is paced
+        to `io_bytes_per_second`, and the event loop only does the bookkeeping, yielding every few users.
+        Deletes and trims are queued like any other change, so the background writer persists them.
+
+        Sweeps only cover the guilds this process owns. Sweeps can also be started with the admin `/storage` command,
+        whether or not they're scheduled.
+
+        Config (settings.json['maintenance'], all optional):
+            - `enabled`: Whether to sweep on a schedule, defaults to false
+            - `interval_seconds`: Seconds between sweeps, defaults to 3600
+            - `ttl_days`: Days of inactivity after which a user is deleted, defaults to null (never)
+            - `max_user_bytes`: Message bytes a user can store, defaults to null (no cap)
+            - `max_guild_bytes`: Bytes a guild can store, defaults to null (no cap)
+            - `compact`: Whether to compact the storage after a sweep, defaults to true
+            - `io_bytes_per_second`: Compaction I/O budget, defaults to 5000000, null doesn't pace
+        """
+        settings = config.get("maintenance", {})
+        self.enabled: bool = settings.get("enabled", False)
+        self.interval_seconds: float = settings.get("interval_seconds", 3600)
+        self.ttl_days: Optional[float] = settings.get("ttl_days")
+        self.max_user_bytes: Optional[int] = settings.get("max_user_bytes")
+        self.max_guild_bytes: Optional[int] = settings.get("max_guild_bytes")
+        self.compact: bool = settings.get("compact", True)
+        self.throttle = Throttle(settings.get("io_bytes_per_second", 5_000_000))
+
+        self.context_handler = context_handler
+        self.memory = memory
+
+        # A thread of its own, a long compaction shouldn't hold up history loads on the worker pool
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="maintenance")
+        self._task: Optional[asyncio.Task] = None
+
+        # One sweep at a time, a manual one waits for the scheduled one
+        self._lock = asyncio.Lock()
+
+        # What the last sweep did
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def start(self) -> None:
+        """
+        Start sweeping on a schedule if enabled, must be called with the event loop running
+        """
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._schedule())
+
+    def stop(self) -> None:
+        """
+        Stop sweeping, a sweep that's compacting gives up after its current step
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.throttle.stop()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    async def storage_bytes(self) -> int:
+        """
+        Bytes the database takes on disk
+        """
+        return await self._blocking(self.context_handler.database.storage_bytes)
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Sweep the database once, returns what was done (also kept as `last_run`)
+        """
+        async with self._lock:
+            started, start = time.time(), time.perf_counter()
+            handler = self.context_handler
+
+            usage = {
+                key: value for key, value in (await self._blocking(handler.database.usage)).items()
+                if handler.shards.owns(key[0])
+            }
+            deleted = await self._expire(usage, started) + await self._cap_guilds(usage)
+            trimmed = await self._cap_users(usage)
+
+            if deleted:
+                await self.memory.forget_users(deleted)
+
+            compacted = await self._blocking(self._compact) if self.compact else 0
+            storage_bytes = await self.storage_bytes()
+
+            self.last_run = {
+                "started": started,
+                "seconds": round(time.perf_counter() - start, 3),
+                "users": len(usage),
+                "guilds": len({guild_id for guild_id, _ in usage}),
+                "deleted": len(deleted),
+                "trimmed": trimmed,
+                "bytes_compacted": compacted,
+                "storage_bytes": storage_bytes,
+            }
+
+            metrics.observe("maintenance_seconds", self.last_run["seconds"])
+            metrics.increment("maintenance_deleted_users", len(deleted))
+            metrics.increment("maintenance_trimmed_users", trimmed)
+            metrics.increment("maintenance_compacted_bytes", compacted)
+            metrics.set_gauge("database_storage_bytes", storage_bytes)
+            logger.info(f"Database maintenance took {self.last_run['seconds']}s: {self.last_run}")
+            return self.last_run
+
+    async def _schedule(self) -> None:
+        """
+        Sweep every `interval_seconds`, a failed sweep is retried on the next one
+        """
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.run()
+            except MaintenanceStopped:
+                return
+            except Exception as e:
+                metrics.increment("maintenance_failures")
+                logger.error(f"Database maintenance failed: {type(e).__name__}: {e}")
+
+    async def _expire(self, usage: Dict[Tuple[int, int], Tuple[float, int]], now: float) -> List[Tuple[int, int]]:
+        """
+        Delete users idle for longer than the TTL, they're dropped from `usage` too
+        """
+        if self.ttl_days is None:
+            return []
+
+        cutoff = now - self.ttl_days * 86400
+        expired = [
+            key for key, (modified, _) in usage.items()
+            if self.context_handler.last_active(*key, stored=modified) < cutoff
+        ]
+        for index, key in enumerate(expired):
+            self.context_handler.delete_user(*key, forget=False)
+            del usage[key]
+
+            if index % YIELD_EVERY == YIELD_EVERY - 1:
+                await asyncio.sleep(0)
+        return expired
+
+    async def _cap_guilds(self, usage: Dict[Tuple[int, int], Tuple[float, int]]) -> List[Tuple[int, int]]:
+        """
+        Delete the least recently active users of guilds over their cap, they're dropped from `usage` too
+        """
+        if self.max_guild_bytes is None:
+            return []
+
+        guilds: Dict[int, List[Tuple[int, int]]] = {}
+        for key in usage:
+            guilds.setdefault(key[0], []).append(key)
+
+        deleted = []
+        for keys in guilds.values():
+            size = sum(usage[key][1] for key in keys)
+            if size <= self.max_guild_bytes:
+                continue
+
+            for key in sorted(keys, key=lambda key: self.context_handler.last_active(*key, stored=usage[key][0])):
+                if size <= self.max_guild_bytes:
+                    break
+                size -= usage.pop(key)[1]
+                self.context_handler.delete_user(*key, forget=False)
+                deleted.append(key)
+
+                if len(deleted) % YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+        return deleted
+
+    async def _cap_users(self, usage: Dict[Tuple[int, int], Tuple[float, int]]) -> int:
+        """
+        Trim the oldest turns of users over their cap, returns how many were trimmed
+        """
+        if self.max_user_bytes is None:
+            return 0
+
+        handler = self.context_handler
+        over = [key for key, (_, size) in usage.items() if size > self.max_user_bytes]
+
+        # Only histories that aren't in memory are read, on the maintenance thread
+        stored = [key for key in over if not handler.is_resident(*key)]
+        amounts = dict(zip(stored, await self._blocking(self._trim_amounts, stored)))
+
+        trimmed = 0
+        for index, key in enumerate(over):
+            # Looking at a history isn't using it, the user's access time stays put
+            context = handler.resident_context(*key)
+            if context is not None:
+                amount, summary = trim_amount(context, self.max_user_bytes), leading_summary(context)
+            else:
+                amount, summary = amounts.get(key, (0, None))
+
+            if amount > 0:
+                handler.trim_stored_context(*key, amount, summary=summary)
+                trimmed += 1
+
+            if index % YIELD_EVERY == YIELD_EVERY - 1:
+                await asyncio.sleep(0)
+        return trimmed
+
+    def _trim_amounts(self, users: List[Tuple[int, int]]) -> List[Tuple[int, Optional[Message]]]:
+        """
+        How much of every stored history has to go and the summary it keeps, runs on the maintenance thread
+        """
+        amounts = []
+        for key in users:
+            context = self.context_handler.read_user(*key)
+            amounts.append((trim_amount(context, self.max_user_bytes), leading_summary(context)))
+        return amounts
+
+    def _compact(self) -> int:
+        """
+        Persist the sweep's deletes and trims, then compact the storage, runs on the maintenance thread
+        """
+        database = self.context_handler.database
+        database.flush()
+        return database.compact_all(self.throttle, self.context_handler.shards.owns)
+
+    async def _blocking(self, func: Callable, *args: Any) -> Any:
+        """
+        Run blocking I/O on the maintenance thread
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
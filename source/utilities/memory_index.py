@@ -0,0 +1,343 @@
+# LLM Libs
+from source.utilities.ollama_pool import OllamaPool
+from source.utilities.workers import WorkerPool
+from source.utilities.messages import Message
+from source.utilities.metrics import metrics
+
+# Needed libs
+from typing import Awaitable, Dict, List, Sequence, Set, Tuple
+from collections import OrderedDict
+import numpy as np
+import asyncio
+import logging
+import json
+import os
+
+logger = logging.getLogger("discord_bot")
+
+RECALL_PREFIX = "Relevant parts of the earlier conversation:\n"
+
+
+class UserMemory:
+    def __init__(self, vectors: np.ndarray, turns: List[Dict]):
+        """
+        One user's remembered turns and their normalized embeddings, row i of `vectors` belongs to `turns[i]`
+        """
+        self.vectors = vectors
+        self.turns = turns
+
+
+class MemoryIndex:
+    def __init__(self, config: dict, pool: OllamaPool, workers: WorkerPool):
+        """
+        Long-term memory: every finished turn is embedded and kept in a per user index for retrieval
+
+        Prompts then only carry the latest `recent_turns` turns, plus the `top_k` older turns most similar (cosine)
+        to the new message, so their size stays about the same however long someone has chatted.
+
+        Turns are embedded in the background after they're answered and appended to two files per user next to
+        the database files, `<path>/<guild>/memory/<user>.f32` (raw float32 rows) and `<user>.jsonl` (the turns),
+        so an update never rewrites what's already stored. Indexes are loaded on first use and the least recently
+        used ones are dropped from memory past `cache_max_users`.
+
+        The latest turns window only moves ahead in steps of settings.json['llm']['trim_block_turns'] turns,
+        so it starts on the same turn for a while and Ollama can keep reusing its cached prefix.
+
+        Config (settings.json['memory'], all optional):
+            - `enabled`: Whether to use long-term memory at all, defaults to false
+            - `model`: Ollama embedding model, defaults to "nomic-embed-text"
+            - `recent_turns`: Latest turns always sent in full, defaults to 4
+            - `top_k`: Older turns recalled per prompt, defaults to 4
+            - `min_score`: Cosine similarity an older turn needs to be recalled, defaults to 0.3
+            - `cache_max_users`: Indexes kept in memory, defaults to 1000
+        """
+        settings = config.get("memory", {})
+        self.enabled: bool = settings.get("enabled", False)
+        self.model: str = settings.get("model", "nomic-embed-text")
+        self.recent_turns: int = settings.get("recent_turns", 4)
+        self.top_k: int = settings.get("top_k", 4)
+        self.min_score: float = settings.get("min_score", 0.3)
+        self.cache_max_users: int = settings.get("cache_max_users", 1000)
+        self.path: str = config.get("database", {}).get("path", "./database")
+        self.block_turns: int = max(1, config.get("llm", {}).get("trim_block_turns", 1))
+
+        self.pool = pool
+        self.workers = workers
+
+        # Loaded indexes, least recently used first
+        self._users: OrderedDict[Tuple[int, int], UserMemory] = OrderedDict()
+
+        # Turns of a user are indexed one at a time and in order, with the amount of turns (and forgets) holding or waiting
+        # on each lock and how many times the user was forgotten since, so a turn that was being embedded during a clear
+        # isn't stored. Forgets hold the lock while they remove the files, so the next turn is only written after.
+        self._locks: Dict[Tuple[int, int], List] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+        # Users whose files are being removed, with how many forgets are removing them
+        self._forgetting: Dict[Tuple[int, int], int] = {}
+
+    async def recall(self, guild_id: int, user_id: int, message: str, context: Sequence[Message]) -> Tuple[List[Message], List[Message]]:
+        """
+        Split a history into the part that's sent in full and the older turns recalled for `message`
+
+        Returns the latest turns (with a leading compaction summary, if any) and zero or one system message
+        holding the recalled turns in the order they happened. The latest turns are at least `recent_turns`
+        and start on a block boundary, so up to `trim_block_turns - 1` more turns are sent.
+        """
+        summary = context[:1] if context and context[0].role == 'system' else []
+        history = context[len(summary):]
+        if self.recent_turns:
+            start = max(0, len(history) - self.recent_turns * 2)
+            recent = history[start - start % (self.block_turns * 2):]
+        else:
+            recent = []
+        window = summary + recent
+
+        try:
+            memory = await self._load(guild_id, user_id)
+            if not len(memory.turns) or not self.top_k:
+                return window, []
+
+            query = await self._embed([message])
+        except Exception as e:
+            # Answer from the latest turns alone rather than not at all
+            metrics.increment("memory_recall_failures")
+            logger.error(f"Failed to recall memory of {guild_id}/{user_id}: {type(e).__name__}: {e}")
+            return window, []
+
+        # The index belongs to another embedding model, it can't be searched with this one
+        if query.shape[1] != memory.vectors.shape[1]:
+            return window, []
+
+        scores = memory.vectors @ query[0]
+
+        # Turns that are sent in full anyway aren't recalled
+        sent = {message.content for message in recent if message.role == 'user'}
+        candidates = [index for index in np.argsort(-scores)[:self.top_k + len(sent)] if scores[index] >= self.min_score]
+        chosen = sorted(index for index in candidates if memory.turns[index]['user'] not in sent)[-self.top_k:]
+
+        metrics.observe("memory_recalled_turns", len(chosen))
+        if not chosen:
+            return window, []
+
+        transcript = "\n".join(
+            f"user: {memory.turns[index]['user']}\nassistant: {memory.turns[index]['assistant']}" for index in chosen
+        )
+        return window, [Message('system', f"{RECALL_PREFIX}{transcript}")]
+
+    def remember(self, guild_id: int, user_id: int, user_message: str, response: str) -> None:
+        """
+        Index a finished turn in the background
+        """
+        if not self.enabled:
+            return
+
+        task = asyncio.create_task(self._index(guild_id, user_id, {'user': user_message, 'assistant': response}))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def forget(self, guild_id: int, user_id: int) -> None:
+        """
+        Drop everything remembered about a user, turns that are still being indexed included
+
+        Nothing is recalled for them from now on, their files are removed in the background on a worker thread.
+        """
+        task = asyncio.create_task(self._forget([(guild_id, user_id)]))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def forget_users(self, users: List[Tuple[int, int]]) -> None:
+        """
+        Drop everything remembered about many users, their files are removed on a worker thread
+        """
+        await self._forget(users)
+
+    async def close(self) -> None:
+        """
+        Give turns that are still being indexed a moment to finish
+        """
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=5)
+            for task in pending:
+                task.cancel()
+
+    def _forget(self, users: List[Tuple[int, int]]) -> Awaitable[None]:
+        """
+        Drop some users' indexes right away, returns the coroutine that removes their files
+        """
+        entries = []
+        for key in sorted(users):
+            self._users.pop(key, None)
+            self._forgetting[key] = self._forgetting.get(key, 0) + 1
+
+            entry = self._locks.setdefault(key, [asyncio.Lock(), 0, 0])
+            entry[1] += 1
+            entry[2] += 1
+            entries.append((key, entry))
+        return self._remove(entries)
+
+    async def _remove(self, entries: List[Tuple[Tuple[int, int], List]]) -> None:
+        """
+        Remove the files of forgotten users once the turns they were indexing let go of their locks
+
+        The locks are taken in the order of the users, so two forgets sharing users can't wait on each other.
+        """
+        held = []
+        try:
+            for _, entry in entries:
+                await entry[0].acquire()
+                held.append(entry)
+            await self.workers.run_blocking(self._delete, [key for key, _ in entries])
+        finally:
+            for entry in held:
+                entry[0].release()
+
+            for key, entry in entries:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+                self._forgetting[key] -= 1
+                if not self._forgetting[key]:
+                    del self._forgetting[key]
+
+    async def _index(self, guild_id: int, user_id: int, turn: Dict) -> None:
+        """
+        Embed a turn and append it to the user's index and files
+        """
+        key = (guild_id, user_id)
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0, 0])
+        entry[1] += 1
+        generation = entry[2]
+        try:
+            async with entry[0]:
+                vector = await self._embed([f"user: {turn['user']}\nassistant: {turn['assistant']}"])
+                memory = await self._load(guild_id, user_id)
+
+                # The user's history was cleared after this turn
+                if entry[2] != generation:
+                    return
+
+                # Switching embedding models starts the index over
+                if len(memory.turns) and memory.vectors.shape[1] != vector.shape[1]:
+                    logger.warning(f"Embedding size of {guild_id}/{user_id}'s memory changed, starting it over")
+                    await self.workers.run_blocking(self._delete, [key])
+                    memory = self._users[key] = UserMemory(np.empty((0, vector.shape[1]), dtype=np.float32), [])
+
+                # A clear from now on waits for the lock, and removes the turn with the rest
+                await self.workers.run_blocking(self._append, guild_id, user_id, vector, turn)
+                if entry[2] != generation:
+                    return
+                memory.vectors = np.vstack([memory.vectors.reshape(-1, vector.shape[1]), vector])
+                memory.turns.append(turn)
+                metrics.increment("memory_indexed_turns")
+        except Exception as e:
+            metrics.increment("memory_index_failures")
+            logger.error(f"Failed to index a turn of {guild_id}/{user_id}: {type(e).__name__}: {e}")
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def _embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Normalized embeddings of some texts, one row per text
+        """
+        response = await self.pool.embed(model=self.model, input=texts)
+        vectors = np.asarray(response.embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    async def _load(self, guild_id: int, user_id: int) -> UserMemory:
+        """
+        A user's index, read from disk on first use
+        """
+        key = (guild_id, user_id)
+
+        # Files that are about to be removed aren't read back
+        if key in self._forgetting:
+            return UserMemory(np.empty((0, 0), dtype=np.float32), [])
+
+        if key not in self._users:
+            memory = await self.workers.run_blocking(self._read, guild_id, user_id)
+
+            # Forgotten while we were reading
+            if key in self._forgetting:
+                return UserMemory(np.empty((0, 0), dtype=np.float32), [])
+
+            # Someone else loaded it while we were reading
+            if key not in self._users:
+                self._users[key] = memory
+                while len(self._users) > self.cache_max_users:
+                    self._users.popitem(last=False)
+
+        self._users.move_to_end(key)
+        return self._users[key]
+
+    def _paths(self, guild_id: int, user_id: int) -> Tuple[str, str]:
+        """
+        Returns the vector and turn file paths of a user
+        """
+        folder = f"{self.path}/{guild_id}/memory"
+        return f"{folder}/{user_id}.f32", f"{folder}/{user_id}.jsonl"
+
+    def _delete(self, users: List[Tuple[int, int]]) -> None:
+        """
+        Remove the files of some users, and their memory folders once they're empty
+        """
+        for guild_id, user_id in users:
+            for path in self._paths(guild_id, user_id):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        for guild_id in {guild_id for guild_id, _ in users}:
+            try:
+                os.rmdir(f"{self.path}/{guild_id}/memory")
+            except OSError:
+                # Other users are still remembered, or nobody ever was
+                pass
+
+    def _read(self, guild_id: int, user_id: int) -> UserMemory:
+        """
+        Read a user's index from disk, cutting off a torn trailing row or line left by a crash mid append
+        """
+        vector_path, turn_path = self._paths(guild_id, user_id)
+        if not os.path.exists(turn_path):
+            return UserMemory(np.empty((0, 0), dtype=np.float32), [])
+
+        turns, offsets = [], [0]
+        with open(turn_path, "rb") as file:
+            for line in file:
+                try:
+                    turns.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+                offsets.append(offsets[-1] + len(line))
+
+        if not turns:
+            return UserMemory(np.empty((0, 0), dtype=np.float32), [])
+
+        dimensions = turns[0]['dim']
+        raw = np.fromfile(vector_path, dtype=np.float32) if os.path.exists(vector_path) else np.empty(0, dtype=np.float32)
+        rows = min(len(turns), raw.size // dimensions)
+
+        # Both files have to end on the same turn, or the next append would pair a turn with the wrong vector
+        if raw.size != rows * dimensions or offsets[-1] != offsets[rows] or offsets[-1] != os.path.getsize(turn_path):
+            os.truncate(turn_path, offsets[rows])
+            if os.path.exists(vector_path):
+                os.truncate(vector_path, rows * dimensions * 4)
+
+        return UserMemory(raw[:rows * dimensions].reshape(rows, dimensions), turns[:rows])
+
+    def _append(self, guild_id: int, user_id: int, vector: np.ndarray, turn: Dict) -> None:
+        """
+        Append a turn and its embedding to the user's files
+        """
+        vector_path, turn_path = self._paths(guild_id, user_id)
+        os.makedirs(os.path.dirname(vector_path), exist_ok=True)
+
+        # The vector goes first, a turn without its vector would shift every row after it
+        with open(vector_path, "ab") as file:
+            file.write(vector.astype(np.float32).tobytes())
+        with open(turn_path, "a", encoding="utf-8") as file:
+            file.write(json.dumps({**turn, 'dim': vector.shape[1]}) + "\n")
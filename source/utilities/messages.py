@@ -0,0 +1,105 @@
+# Needed libs
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+from collections import deque
+from itertools import islice
+import sys
+
+
+class Message:
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str, tokens: Optional[int] = None):
+        """
+        A single context message, kept as a slotted record instead of a dict
+
+        Roles are interned so every message of a role shares one string, and `tokens` caches the message's
+        token count once it's known. A negative count is an estimate made without the tokenizer, it's used as is
+        until the tokenizer is loaded and then counted again. Messages only become Ollama's dicts when a prompt is sent (`to_prompt`)
+        and the database's dicts when they're written (`to_dict`).
+        """
+        self.role = sys.intern(role)
+        self.content = content
+        self.tokens = tokens
+
+    @classmethod
+    def from_dict(cls, message: Dict) -> "Message":
+        return cls(message['role'], message['content'], message.get('tokens'))
+
+    def to_dict(self) -> Dict:
+        """
+        The stored form of the message, with its token count when it has one
+        """
+        if self.tokens is None:
+            return {'role': self.role, 'content': self.content}
+        return {'role': self.role, 'content': self.content, 'tokens': self.tokens}
+
+    def to_prompt(self) -> Dict:
+        """
+        The message the way Ollama takes it
+        """
+        return {'role': self.role, 'content': self.content}
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, content={self.content!r}, tokens={self.tokens!r})"
+
+
+def as_message(message: Union[Message, Dict]) -> Message:
+    """
+    Returns a message as a record, converting the dicts older callers pass
+    """
+    return message if isinstance(message, Message) else Message.from_dict(message)
+
+
+class History:
+    __slots__ = ("_messages",)
+
+    def __init__(self, messages: Iterable[Message] = ()):
+        """
+        A user's messages, oldest first
+
+        Backed by a deque, so trimming the oldest messages costs the amount trimmed instead of the whole history.
+        Slicing returns a plain list of the records, reading the latest messages only walks from the nearer end.
+        """
+        self._messages: deque = deque(messages)
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self._messages)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Message, List[Message]]:
+        if not isinstance(index, slice):
+            return self._messages[index]
+
+        start, stop, step = index.indices(len(self._messages))
+        if step != 1:
+            # Rare, islice can't walk backwards so these go through a list
+            return list(self._messages)[index]
+        if stop <= start:
+            return []
+
+        # Tail slices are read backwards from the end
+        if start > len(self._messages) - stop:
+            tail = list(islice(reversed(self._messages), len(self._messages) - stop, len(self._messages) - start))
+            tail.reverse()
+            return tail
+        return list(islice(self._messages, start, stop))
+
+    def extend(self, messages: Iterable[Message]) -> None:
+        self._messages.extend(messages)
+
+    def trim(self, amount: int) -> List[Message]:
+        """
+        Removes and returns the oldest `amount` messages
+        """
+        popleft = self._messages.popleft
+        return [popleft() for _ in range(min(amount, len(self._messages)))]
+
+    def replace_oldest(self, amount: int, messages: List[Message]) -> List[Message]:
+        """
+        Swaps the oldest `amount` messages for `messages`, returns the removed ones
+        """
+        removed = self.trim(amount)
+        self._messages.extendleft(reversed(messages))
+        return removed
@@ -0,0 +1,116 @@
+# Needed libs
+from typing import Dict, List, Sequence, Tuple
+from bisect import bisect_left
+
+import threading
+import re
+
+# Histogram bucket upper bounds, latencies in seconds, sizes in tokens/items and ratios from 0 to 1
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99, 1.0)
+
+# Splits `name{label="value"}` into its name and labels
+LABELED_NAME = re.compile(r"^([^{]+)(?:\{(.*)\})?$")
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Thread safe, in-process metrics registry
+
+        - Counters only ever go up (flushes, bytes written, ...)
+        - Gauges hold the latest value (queue depth, ...)
+        - Timings keep a count, sum and max of every observed value (latencies in seconds, ...), plus a histogram
+          over fixed buckets so percentiles can be derived from the export
+
+        Names can carry Prometheus style labels, `ollama_requests{host="..."}`.
+        """
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self.histograms: Dict[str, Tuple[Sequence[float], List[int]]] = {}
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """
+        Increments a counter
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        """
+        Sets a gauge to its latest value
+        """
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        """
+        Records a single observation of a timing, `buckets` only matters on the first observation of a name
+        """
+        with self._lock:
+            timing = self.timings.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+            timing["count"] += 1
+            timing["sum"] += value
+            timing["max"] = max(timing["max"], value)
+
+            # One slot per bucket plus +Inf
+            bounds, counts = self.histograms.setdefault(name, (buckets, [0] * (len(buckets) + 1)))
+            counts[bisect_left(bounds, value)] += 1
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """
+        Returns a copy of every metric
+        """
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "timings": {name: dict(timing) for name, timing in self.timings.items()},
+                "histograms": {
+                    name: {"bounds": list(bounds), "counts": list(counts)}
+                    for name, (bounds, counts) in self.histograms.items()
+                },
+            }
+
+    def render_prometheus(self, prefix: str = "concierge_") -> str:
+        """
+        Every metric in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines: List[str] = []
+        typed = set()
+
+        def declare(name: str, kind: str) -> None:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for kind, values in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+            for full_name, value in sorted(values.items()):
+                name, labels = LABELED_NAME.match(full_name).groups()
+                declare(prefix + name, kind)
+                lines.append(f"{prefix}{name}{{{labels}}} {value}" if labels else f"{prefix}{name} {value}")
+
+        for full_name, histogram in sorted(snapshot["histograms"].items()):
+            name, labels = LABELED_NAME.match(full_name).groups()
+            labels = f"{labels}," if labels else ""
+            declare(prefix + name, "histogram")
+
+            cumulative = 0
+            for bound, count in zip([*histogram["bounds"], "+Inf"], histogram["counts"]):
+                cumulative += count
+                lines.append(f'{prefix}{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+
+            timing = snapshot["timings"][full_name]
+            suffix = f"{{{labels[:-1]}}}" if labels else ""
+            lines.append(f"{prefix}{name}_sum{suffix} {timing['sum']}")
+            lines.append(f"{prefix}{name}_count{suffix} {timing['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Shared registry for the whole process
+metrics = Metrics()
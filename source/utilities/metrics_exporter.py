@@ -0,0 +1,105 @@
+# Needed libs
+from source.utilities.metrics import metrics
+from typing import List, Optional
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger("discord_bot")
+
+
+class MetricsExporter:
+    def __init__(self, config: dict):
+        """
+        Exposes the metrics registry in the Prometheus text format
+
+        With `port` set, a tiny HTTP server answers `GET /metrics` for Prometheus to scrape. With `dump_path` set,
+        the same text is written to that file every `dump_interval` seconds (temp file + rename), for node_exporter's
+        textfile collector or for reading by hand. Both only render on demand, recording metrics stays a dict update.
+
+        Config (settings.json['metrics'], all optional):
+            - `host`: Address the HTTP server listens on, defaults to "127.0.0.1"
+            - `port`: Port of the HTTP server, defaults to none (no server)
+            - `dump_path`: File the metrics are dumped to, defaults to none (no dumps)
+            - `dump_interval`: Seconds between dumps, defaults to 60
+            - `slow_request_seconds`: Prompts slower than this get their stage breakdown logged, defaults to none
+        """
+        settings = config.get("metrics", {})
+        self.host: str = settings.get("host", "127.0.0.1")
+        self.port: Optional[int] = settings.get("port")
+        self.dump_path: Optional[str] = settings.get("dump_path")
+        self.dump_interval: float = settings.get("dump_interval", 60)
+
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """
+        Start the HTTP server and the dumps that are configured
+        """
+        if self.port is not None:
+            self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+            logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+        if self.dump_path is not None:
+            self._tasks.append(asyncio.create_task(self._dump_loop()))
+
+    async def stop(self) -> None:
+        """
+        Stop serving, with a last dump so the file reflects the whole run
+        """
+        for task in self._tasks:
+            task.cancel()
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+        if self.dump_path is not None:
+            self.dump()
+
+    def dump(self) -> None:
+        """
+        Write the metrics to `dump_path`
+        """
+        temp_path = f"{self.dump_path}.tmp"
+        os.makedirs(os.path.dirname(self.dump_path) or ".", exist_ok=True)
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(metrics.render_prometheus())
+        os.replace(temp_path, self.dump_path)
+
+    async def _dump_loop(self) -> None:
+        """
+        Dump every interval
+        """
+        while True:
+            await asyncio.sleep(self.dump_interval)
+            try:
+                self.dump()
+            except OSError as e:
+                logger.error(f"Failed to dump metrics to {self.dump_path}: {type(e).__name__}: {e}")
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Answer a single request, then close the connection
+        """
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", metrics.render_prometheus().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,126 @@
+# Needed libs
+from source.utilities.metrics import metrics
+from typing import List, Optional
+import re
+
+# Prompts that deserve the large model whatever their size: code, tracebacks and requests for reasoning
+COMPLEX_PATTERN = re.compile(
+    r"```|Traceback \(most recent call last\)|File \".+\", line \d+|\b\w+(?:Error|Exception)\b"
+    r"|\b(?:explain|why|how (?:does|do|can|would)|step by step|analy[sz]e|debug|refactor|implement|compare|prove)\b",
+    re.IGNORECASE
+)
+
+
+class Route:
+    def __init__(self, model: str, max_prompt_tokens: Optional[int] = None, num_predict: Optional[int] = None,
+                 simple_only: bool = False):
+        """
+        A model prompts can be routed to
+
+        - `max_prompt_tokens`: Largest prompt the route takes, unlimited by default
+        - `num_predict`: Most tokens the route may generate per answer, Ollama's default when unset
+        - `simple_only`: Only take prompts that don't look complex
+        """
+        self.model = model
+        self.max_prompt_tokens = max_prompt_tokens
+        self.num_predict = num_predict
+        self.simple_only = simple_only
+
+    @property
+    def options(self) -> Optional[dict]:
+        """
+        Ollama request options enforcing the route's budget
+        """
+        return {"num_predict": self.num_predict} if self.num_predict is not None else None
+
+    def fits(self, prompt_tokens: int) -> bool:
+        """
+        Whether a prompt is within the route's budget
+        """
+        return self.max_prompt_tokens is None or prompt_tokens <= self.max_prompt_tokens
+
+
+class ModelRouter:
+    def __init__(self, config: dict):
+        """
+        Picks the model that answers each prompt, smallest first
+
+        Routes are listed from the smallest to the largest model. A prompt goes to the first route whose
+        `max_prompt_tokens` budget fits it, skipping `simple_only` routes when the message looks complex (code,
+        tracebacks, "explain ...", many lines). While more than `shed_queue_depth` prompts wait for a slot,
+        complex prompts are allowed on the small routes too, so the queue drains faster.
+
+        The routes after the chosen one are its escalation path: when a model fails or answers with nothing,
+        the prompt is retried on the next larger one.
+
+        Config (settings.json['routing'], all optional):
+            - `enabled`: Whether to route at all, defaults to false (everything goes to settings.json['llm']['model'])
+            - `routes`: Routes from smallest to largest, `[{"model", "max_prompt_tokens", "num_predict", "simple_only"}]`,
+              the last one is settings.json['llm']['model'] (its `model` can be left out)
+            - `complex_lines`: Lines that make a message complex, defaults to 8
+            - `complex_chars`: Characters that make a message complex, defaults to 600
+            - `shed_queue_depth`: Waiting prompts that let complex prompts use small routes, defaults to none
+        """
+        settings = config.get("routing", {})
+        self.enabled: bool = settings.get("enabled", False)
+        self.complex_lines: int = settings.get("complex_lines", 8)
+        self.complex_chars: int = settings.get("complex_chars", 600)
+        self.shed_queue_depth: Optional[int] = settings.get("shed_queue_depth")
+
+        default = Route(config["llm"].get("model"))
+        self.routes: List[Route] = [default]
+        if self.enabled and settings.get("routes"):
+            *smaller, largest = settings["routes"]
+
+            # Unrouted prompts and escalations end on the configured model, so it has to be the largest route
+            if largest.get("model", default.model) != default.model:
+                raise ValueError(f"settings.json['routing']['routes'] has to end on settings.json['llm']['model'] "
+                                 f"('{default.model}'), not '{largest['model']}'")
+            if any("model" not in route for route in smaller):
+                raise ValueError("Every route of settings.json['routing']['routes'] but the last one needs a model")
+
+            self.routes = [Route(**route) for route in smaller] + [Route(**{**largest, "model": default.model})]
+
+    @property
+    def models(self) -> List[str]:
+        """
+        Every model prompts can be routed to
+        """
+        return [route.model for route in self.routes]
+
+    def looks_complex(self, message: str) -> bool:
+        """
+        Cheap guess of whether a message needs the large model
+        """
+        return (
+            len(message) > self.complex_chars
+            or message.count("\n") >= self.complex_lines
+            or COMPLEX_PATTERN.search(message) is not None
+        )
+
+    def plan(self, prompt_tokens: int, message: str, queue_depth: int = 0) -> List[Route]:
+        """
+        The route to try first followed by its escalations, never empty
+        """
+        if len(self.routes) == 1:
+            return self.routes
+
+        simple = not self.looks_complex(message)
+        shedding = self.shed_queue_depth is not None and queue_depth >= self.shed_queue_depth
+
+        eligible = [route for route in self.routes if route.fits(prompt_tokens)]
+        chosen = next(
+            (route for route in eligible if simple or shedding or not route.simple_only),
+            self.routes[-1]
+        )
+
+        metrics.increment("routing_complex_prompts" if not simple else "routing_simple_prompts")
+        if shedding and not simple and chosen.simple_only:
+            metrics.increment("routing_shed_prompts")
+
+        # Escalate through the larger routes that can take the prompt, ending on the largest no matter what
+        index = self.routes.index(chosen)
+        plan = [chosen] + [route for route in self.routes[index + 1:-1] if route.fits(prompt_tokens)]
+        if chosen is not self.routes[-1]:
+            plan.append(self.routes[-1])
+        return plan
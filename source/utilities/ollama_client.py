@@ -1,12 +1,25 @@
 
 # Discord/LLM Libs
 from source.utilities.context_manager import ContextManager
-from source.client.bot import Bot
-from ollama import AsyncClient, ChatResponse
+from source.utilities.response_cache import ResponseCache
+from source.utilities.compactor import ContextCompactor
+from source.utilities.deadlines import DeadlineExceeded, LatencyTracker, remaining
+from source.utilities.maintenance import Maintenance
+from source.utilities.model_router import ModelRouter, Route
+from source.utilities.memory_index import MemoryIndex
+from source.utilities.messages import Message
+from source.utilities.ollama_pool import OllamaPool
+from source.utilities.workers import WorkerPool
+from source.utilities.metrics import RATIO_BUCKETS, metrics
+from source.utilities.tracing import annotate, span
+from source.client.bot import Bot, log_payload
+from ollama import ChatResponse
 
 # Needed libs
-from typing import Mapping, Tuple, List
-import json
+from typing import Callable, Dict, Hashable, Mapping, Optional, Tuple, List
+from contextlib import aclosing
+import asyncio
+import time
 
 
 class OllamaClient:
@@ -20,15 +33,95 @@ class OllamaClient:
         # Get LLM Model
         self.model = self.config["llm"].get("model", None)
 
-        # Ollama Wrapper Client
-        self.client = AsyncClient()
+        # Histories are trimmed this many turns at a time, so the prompt prefix Ollama has cached stays put in between
+        self.trim_block_turns: int = max(1, self.config["llm"].get("trim_block_turns", 1))
 
-        # Context handler
-        self.context_handler = ContextManager()
+        # Load the model and prefill the system prompt on every node at startup
+        self.warm_up: bool = self.config["llm"].get("warm_up", True)
+        self._warm_up_task: Optional[asyncio.Task] = None
 
-    async def prompt(self, guild_id: int, user_id: int, message: str) -> Tuple[bool, str]:
+        # Ollama Wrapper Client, routes over every configured Ollama node
+        self.pool = OllamaPool(config=self.config)
+
+        # Tokenizes and reads histories off the event loop
+        self.workers = WorkerPool(config=self.config)
+
+        # Opt-in long-term memory, recalls the older turns relevant to each prompt
+        self.memory = MemoryIndex(config=self.config, pool=self.pool, workers=self.workers)
+
+        # Context handler, clearing a history forgets its long-term memory too
+        self.context_handler = ContextManager(config=self.config, memory=self.memory)
+
+        # Summarizes the oldest turns of long histories in the background
+        self.compactor = ContextCompactor(config=self.config, context_handler=self.context_handler, pool=self.pool)
+
+        # Expires, caps and compacts the stored histories in the background
+        self.maintenance = Maintenance(config=self.config, context_handler=self.context_handler, memory=self.memory)
+
+        # Opt-in cache of answers to repeated questions
+        self.cache = ResponseCache(config=self.config)
+
+        # Opt-in routing of small prompts to smaller models
+        self.router = ModelRouter(config=self.config)
+
+        # Recent latency of every model, slow requests get hedged past its p95 when hedging is enabled
+        self.latencies = LatencyTracker(config=self.config)
+
+        # System prompt, tokenized once per config load (once the tokenizer is ready)
+        self.system_prompt = ' '.join(self.config['llm']['pre_prompt'])
+        self._system_message = Message('system', self.system_prompt)
+
+    @property
+    def system_tokens(self) -> int:
+        """
+        Token count of the system prompt, plus its separator
+        """
+        return self.context_handler.message_tokens(self._system_message) + 1
+
+    def start(self) -> None:
+        """
+        Start the background work, must be called with the event loop running
+        """
+        self.pool.start()
+        self.maintenance.start()
+        if self.warm_up and self.model is not None:
+            self._warm_up_task = asyncio.create_task(self._warm_up_models())
+
+    async def close(self) -> None:
+        """
+        Close the Ollama connections and persist everything the context handler still has pending
+        """
+        if self._warm_up_task is not None:
+            self._warm_up_task.cancel()
+        self.compactor.close()
+        self.maintenance.stop()
+        await self.memory.close()
+        await self.pool.close()
+        self.workers.close()
+        self.context_handler.close()
+
+    async def _warm_up_models(self) -> None:
+        """
+        Warm up every model prompts can be routed to, one after the other
+        """
+        for model in dict.fromkeys(self.router.models):
+            await self.pool.warm_up(model, [self._system_message.to_prompt()])
+
+    async def prompt(self, guild_id: int, user_id: int, message: str, on_update: Optional[Callable[[str], None]] = None,
+                     queue_depth: int = 0, deadline: Optional[float] = None,
+                     on_answer: Optional[Callable[[str], None]] = None) -> Tuple[bool, str]:
         """
         Prompt the LLM model
+
+        When `on_update` is given the response is streamed, and `on_update` is called with the visible
+        response so far (without the "Summary: " tail) every time a new part arrives.
+
+        `queue_depth` is the amount of prompts waiting behind this one, routing may pick a smaller model when it's high.
+
+        Raises `DeadlineExceeded` when the answer isn't ready by the `time.monotonic()` `deadline`, the request is
+        cancelled so Ollama stops generating it.
+
+        `on_answer` is called with the answer as soon as it's ready, so it can start sending it while the turn is persisted.
         """
         # Verify we have a model set in the config file
         if self.model is None:
@@ -37,92 +130,287 @@ class OllamaClient:
         # Retrieve built prompt
         messages = await self.build_prompt(guild_id, user_id, message)
 
-        # Get a response from llm model
-        response: ChatResponse = await self.client.chat(
-            model=self.model,
-            messages=messages
-        )
+        # Keep each user on the node that already has their prompt prefix cached
+        affinity = (guild_id, user_id)
 
-        self.bot.logger.info(f"LLM Response: {response}")
+        # Pick the model by the prompt's size, what it asks for and how busy we are
+        routes = self.router.plan(self.prompt_tokens(messages), message, queue_depth)
 
-        # Get bot content
-        if "Summary: " in response.message.content:
-            content = response.message.content.split("Summary: ")[0]
+        # Answer repeated questions from the cache when it's enabled, keyed on the model the prompt was routed to
+        # so a small model's answer is never served for a prompt that needs the large one (or the other way around)
+        if self.cache.enabled:
+            async def generate() -> Tuple[str, bool]:
+                # An answer that escalated or was hedged to another model isn't the routed model's to cache
+                content, model = await self._generate(messages, on_update, affinity, routes, deadline)
+                return content, model == routes[0].model
+
+            key = self.cache.key(routes[0].model, self.system_prompt, message, messages[1:-1])
+            content, generated = await self.cache.get_or_generate(key, generate)
+            annotate("cache_hit", int(not generated), histogram=False)
+
+            # Cached answers show up all at once
+            if not generated and on_update is not None:
+                on_update(content)
         else:
-            content = response.message.content # type: ignore
-
-        # Add context to manger
-        self.context_handler.add_context(
-            guild_id=guild_id,
-            user_id=user_id,
-            messages=[
-                {
-                    'role': 'user',
-                    'content': f"{message}",
-                },
-                {
-                    'role': 'assistant',
-                    'content': f"{content}",
-                }
-            ]
-        )
+            content = await self.generate(messages, on_update, affinity, routes, deadline)
+
+        if on_answer is not None:
+            on_answer(content)
+
+        # Add context to manger, a long answer is tokenized on the worker pool instead of the event loop
+        with span("persist"):
+            answer = Message('assistant', content)
+            await self.context_handler.count_pending([answer], self.workers)
+            self.context_handler.add_context(
+                guild_id=guild_id,
+                user_id=user_id,
+                messages=[
+                    messages[-1],
+                    answer
+                ]
+            )
+
+        # Remember the turn for later recall, and fold the oldest turns into a summary if the history got too long
+        self.memory.remember(guild_id, user_id, message, content)
+        self.compactor.maybe_compact(guild_id, user_id)
 
         # Return response
         return True, content
 
-    async def build_prompt(self, guild_id: int, user_id: int, message: str) -> List:
+    def prompt_tokens(self, messages: List[Message]) -> int:
         """
-        Build the LLM prompt while attempting to stay below the LLM models' context length
+        Token count of a built prompt, from the messages' cached counts
         """
-        # Ngl this while true loop can fucking blow up, but honestly since everything is kinda O(1)
-        # I can't really see it failing, tokenizer is relatively fast too
-        while True:
-            # Implement context window
-            context = self.context_handler.get_context(guild_id=guild_id, user_id=user_id)
-
-            # Base message dict
-            messages = [
-                {
-                    'role': 'system',
-                    'content': ' '.join(self.config['llm']['pre_prompt'])
-                }
-            ]
-
-            # Ensure context is correctly inserted (we're returned a list, so we must unpack it into dicts)
-            if isinstance(context, list):  # Ensure it is a list
-                messages.extend(context)  # Unpack list of context dictionaries
-
-            # Add the user message
-            message = {
-                'role': 'user',
-                'content': message
-            }
-            messages.append(message)
+        return sum(self.context_handler.message_tokens(msg) + 1 for msg in messages)
 
-            # Calculate if prompt exceeds token length
-            prompt = "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
-            prompt_tokens = len(self.context_handler.tokenizer.encode(prompt))
-            model_context_length = self.context_handler.context_length
-            self.bot.logger.info(f"Prompt Tokens: {prompt_tokens}, Model Context Length: {model_context_length}, Generated Prompt: {prompt}")
-
-            # Check if we have to trim or not
-            if prompt_tokens <= self.context_handler.context_length:
-                break
+    async def generate(self, messages: List[Message], on_update: Optional[Callable[[str], None]] = None,
+                       affinity: Optional[Hashable] = None, routes: Optional[List[Route]] = None,
+                       deadline: Optional[float] = None) -> str:
+        """
+        Get a response to a built prompt from the llm model, without the "Summary: " tail
 
-            # Honestly, it would be impossible for the context window to reach over 120k+?? Discord wouldn't even allow it, nor the discord bot unless
-            # The prompt was outrageously large.
+        The first of `routes` answers, when its model fails or answers with nothing before anything was
+        streamed the prompt escalates to the next one. Defaults to the configured model alone.
 
-            # Trims the first message in the list until the context length is less than the models' context length
-            self.context_handler.trim_user_context(guild_id=guild_id, user_id=user_id)
+        Every attempt only gets the time left until `deadline`, past it the request is cancelled mid generation
+        and `DeadlineExceeded` is raised.
+        """
+        content, _ = await self._generate(messages, on_update, affinity, routes, deadline)
+        return content
 
+    async def _generate(self, messages: List[Message], on_update: Optional[Callable[[str], None]],
+                        affinity: Optional[Hashable], routes: Optional[List[Route]],
+                        deadline: Optional[float]) -> Tuple[str, str]:
+        """
+        `generate`, also returning the model that answered
+        """
+        # Messages only become dicts here, the cached token counts stay out of the request
+        request_messages = [msg.to_prompt() for msg in messages]
+        prompt_tokens = self.prompt_tokens(messages)
+        routes = routes or self.router.routes[-1:]
+        streamed = False
+
+        def on_part(content: str) -> None:
+            nonlocal streamed
+            streamed = True
+            on_update(content)
+
+        metrics.increment(f'route_requests{{model="{routes[0].model}"}}')
+        for attempt, route in enumerate(routes):
+            last = attempt == len(routes) - 1
+            timeout = remaining(deadline)
+            if timeout is not None and timeout <= 0:
+                metrics.increment("llm_deadline_exceeded")
+                raise DeadlineExceeded(f"No time left to prompt '{route.model}'")
+
+            start = time.perf_counter()
+            try:
+                with span("llm"):
+                    response, response_content = await asyncio.wait_for(
+                        self._chat(route, request_messages, on_part if on_update is not None else None, affinity, prompt_tokens),
+                        timeout
+                    )
+            except asyncio.TimeoutError:
+                # Cancelling the request closed its connection, so Ollama already stopped generating
+                metrics.increment("llm_deadline_exceeded")
+                raise DeadlineExceeded(f"'{route.model}' didn't answer within {timeout:.1f}s") from None
+            except Exception as e:
+                metrics.increment(f'route_failures{{model="{route.model}"}}')
+                if last or streamed:
+                    raise
+                self.bot.logger.warning(f"Model '{route.model}' failed, escalating to '{routes[attempt + 1].model}': {type(e).__name__}: {e}")
+                metrics.increment(f'route_escalations{{model="{route.model}"}}')
+                continue
+
+            metrics.observe(f'route_seconds{{model="{route.model}"}}', time.perf_counter() - start)
+            if on_update is None:
+                self.latencies.observe(route.model, time.perf_counter() - start)
+
+            # A model that had nothing to say hands the prompt to the next one
+            if not response_content.strip() and not last and not streamed:
+                metrics.increment(f'route_escalations{{model="{route.model}"}}')
+                continue
+
+            metrics.increment(f'route_answers{{model="{route.model}"}}')
+            break
+
+        log_payload("LLM Response:", response_content)
+        if response is not None:
+            self.record_stats(response, prompt_tokens)
+
+        # Get bot content, and the model it came from (a hedge may have sent it to a smaller one)
+        model = response.model if response is not None and response.model else route.model
+        return response_content.partition("Summary: ")[0], model
+
+    async def _chat(self, route: Route, request_messages: List[Mapping], on_update: Optional[Callable[[str], None]],
+                    affinity: Optional[Hashable], prompt_tokens: int) -> Tuple[Optional[ChatResponse], str]:
+        """
+        Send a prompt to a route's model, streaming it into `on_update` when given
 
-        # Return built prompt
-        return messages
+        Non-streamed prompts are hedged once they run past the model's usual latency, streamed ones can't be
+        since their parts are already shown.
+        """
+        if on_update is None:
+            # Get a response from llm model
+            response: ChatResponse = await self.pool.chat(
+                model=route.model,
+                messages=request_messages,
+                options=route.options,
+                affinity=affinity,
+                hedge_after=self.latencies.hedge_after(route.model),
+                hedge=self._hedge(route, prompt_tokens)
+            )
+            return response, response.message.content or ""
+
+        # Stream the response from llm model, the final part carries the stats
+        start = time.perf_counter()
+        response, response_content = None, ""
+        stream = self.pool.stream_chat(model=route.model, messages=request_messages, options=route.options, affinity=affinity)
+        async with aclosing(stream):
+            async for response in stream:
+                if not response.message.content:
+                    continue
+
+                if not response_content:
+                    metrics.observe("llm_time_to_first_token_seconds", time.perf_counter() - start)
+
+                response_content += response.message.content
+                on_update(response_content.partition("Summary: ")[0])
+        return response, response_content
+
+    def _hedge(self, route: Route, prompt_tokens: int) -> Optional[Dict]:
+        """
+        What the hedged copy of a request to `route` changes, None sends the same request to another node
 
+        With a single healthy node the copy goes to the smallest model instead, when it can take the prompt.
+        """
+        if sum(endpoint.healthy for endpoint in self.pool.endpoints) > 1:
+            return None
 
+        smallest = self.router.routes[0]
+        if smallest is route or not smallest.fits(prompt_tokens):
+            return None
+        return {"model": smallest.model, "options": smallest.options}
 
+    @staticmethod
+    def record_stats(response: ChatResponse, prompt_tokens: int = 0) -> None:
+        """
+        Record where Ollama spent its time, from the stats on the (final) response
 
+        Ollama only counts the prompt tokens it had to prefill in `prompt_eval_count`, the rest came from its
+        KV cache, so comparing it to the prompt's size shows how much of each prompt was reused.
+        """
+        # Ollama reports durations in nanoseconds, and leaves them out when it didn't get to that stage
+        for field, name in (
+            ("load_duration", "llm_load_seconds"),
+            ("prompt_eval_duration", "llm_prefill_seconds"),
+            ("eval_duration", "llm_eval_seconds"),
+        ):
+            duration = getattr(response, field, None)
+            if duration:
+                metrics.observe(name, duration / 1e9)
+
+        for field, name in (("prompt_eval_count", "llm_prompt_eval_tokens"), ("eval_count", "llm_eval_tokens")):
+            count = getattr(response, field, None)
+            if count:
+                annotate(name, count)
+
+        if response.prompt_eval_count is not None and prompt_tokens:
+            reused = max(0.0, 1 - response.prompt_eval_count / prompt_tokens)
+            metrics.observe("llm_prefill_reused_ratio", reused, buckets=RATIO_BUCKETS)
+
+        if response.eval_count and response.eval_duration:
+            metrics.set_gauge("llm_eval_tokens_per_second", response.eval_count / (response.eval_duration / 1e9))
+
+    async def build_prompt(self, guild_id: int, user_id: int, message: str) -> List[Message]:
+        """
+        Build the LLM prompt while attempting to stay below the LLM models' context length
 
+        Every message carries a cached token count, so instead of re-tokenizing the whole prompt
+        until it fits we keep a running sum and drop the oldest turns in a single pass.
 
+        With long-term memory enabled only the latest turns are sent, plus the older turns relevant to the message.
+        The stored history is left alone then, turns that don't fit are only left out of this prompt.
 
+        Ollama reuses its KV cache for the longest unchanged prefix of a prompt, so the prompt is laid out to keep
+        that prefix stable: system prompt, then the history, and only then whatever changes every turn (recalled
+        turns, the new message). Histories are trimmed `trim_block_turns` turns at a time, so a trim invalidates
+        the cache once per block instead of on every turn.
+        """
+        # Implement context window, a history that isn't in memory yet is read on the worker pool
+        with span("load_history"):
+            await self.context_handler.load_user(guild_id, user_id, self.workers)
+        context = self.context_handler.get_context(guild_id=guild_id, user_id=user_id)
+
+        # Swap the full history for the latest turns and the recalled ones
+        recalled: List[Message] = []
+        if self.memory.enabled:
+            with span("recall"):
+                context, recalled = await self.memory.recall(guild_id, user_id, message, context)
+
+        # Tokenize everything that has no cached count yet in one batch, off the event loop
+        user_message = Message('user', message)
+        with span("tokenize"):
+            await self.context_handler.count_pending([self._system_message, *recalled, *context, user_message], self.workers)
+
+        # Each message is joined with a newline in the prompt, count one token per separator
+        message_tokens = self.context_handler.message_tokens(user_message) + 1
+        context_tokens = sum(self.context_handler.message_tokens(msg) + 1 for msg in [*recalled, *context])
+        prompt_tokens = self.system_tokens + context_tokens + message_tokens
+        model_context_length = self.context_handler.context_length
+
+        # Find how many of the oldest messages have to go, trimming whole turns (user prompt + llm response)
+        # A compaction summary is a single system message and goes on its own, once trimming starts it goes on
+        # until a whole block is gone, which leaves room for the next turns without trimming again
+        trim_amount, trim_iterations = 0, 0
+        while (prompt_tokens > model_context_length or trim_iterations % self.trim_block_turns) and trim_amount < len(context):
+            step = 1 if context[trim_amount].role == 'system' else 2
+            for msg in context[trim_amount:trim_amount + step]:
+                prompt_tokens -= self.context_handler.message_tokens(msg) + 1
+            trim_amount += step
+            trim_iterations += 1
+
+        # Honestly, it would be impossible for the context window to reach over 120k+?? Discord wouldn't even allow it, nor the discord bot unless
+        # The prompt was outrageously large.
+        if trim_amount and self.memory.enabled:
+            context = context[trim_amount:]
+        elif trim_amount:
+            self.context_handler.trim_user_context(guild_id=guild_id, user_id=user_id, amount=trim_amount)
+
+        self.bot.logger.info(f"Prompt Tokens: {prompt_tokens}, Model Context Length: {model_context_length}, Trimmed Messages: {trim_amount}")
+        annotate("prompt_tokens", prompt_tokens)
+        annotate("prompt_trim_iterations", trim_iterations)
+
+        # Base message, shared by every prompt
+        messages = [self._system_message]
+
+        # Ensure context is correctly inserted (we're returned a history, so we must unpack it into the list)
+        # Recalled turns change with every message, they go after the history to keep it in the cached prefix
+        messages.extend(context)
+        messages.extend(recalled)
+
+        # Add the user message, it keeps its token count so add_context doesn't tokenize it again
+        messages.append(user_message)
 
+        # Return built prompt
+        return messages
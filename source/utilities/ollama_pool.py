@@ -0,0 +1,279 @@
+# LLM Libs
+from source.utilities.metrics import metrics
+from ollama import AsyncClient, ChatResponse, EmbedResponse, ResponseError
+import httpx
+
+# Needed libs
+from typing import AsyncIterator, Dict, Hashable, List, Optional, Set, Union
+import asyncio
+import logging
+import zlib
+import time
+
+logger = logging.getLogger("discord_bot")
+
+# Errors that mean the node itself is unusable, so the request can be retried on another one
+NODE_ERRORS = (ConnectionError, httpx.TransportError)
+
+
+class OllamaEndpoint:
+    def __init__(self, host: Optional[str], max_connections: int):
+        """
+        A single Ollama node with its own pool of keep-alive HTTP connections
+        """
+        self.host = host or "default"
+        self.client = AsyncClient(
+            host=host,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+
+        # Requests currently sent to this node, and whether the last probe or request reached it
+        self.outstanding: int = 0
+        self.healthy: bool = True
+
+    def mark(self, healthy: bool) -> None:
+        """
+        Record whether the node is reachable
+        """
+        if healthy != self.healthy:
+            logger.warning(f"Ollama node '{self.host}' is {'back up' if healthy else 'down'}")
+        self.healthy = healthy
+        metrics.set_gauge(f'ollama_node_healthy{{host="{self.host}"}}', int(healthy))
+
+
+class OllamaPool:
+    def __init__(self, config: dict):
+        """
+        Routes Ollama requests over every configured node
+
+        - Each request goes to the healthy node with the least outstanding requests
+        - Requests with an `affinity` key (a user) stick to the same node as long as it isn't `affinity_slack` requests
+          busier than the least loaded one, so that node's KV cache still holds their prompt prefix
+        - A request that fails because its node is unreachable is retried once on every other node
+        - Chats can be hedged, a request that hasn't answered after `hedge_after` seconds is sent again and the
+          first answer wins, the other request is cancelled which closes its connection so Ollama stops generating
+        - A background task probes every node, so nodes that went down are skipped and come back once they're up
+
+        Config (settings.json['llm'], all optional):
+            - `hosts`: Ollama URLs, defaults to a single node at OLLAMA_HOST or http://localhost:11434
+            - `max_connections`: Keep-alive HTTP connections per node, defaults to 16
+            - `health_interval`: Seconds between health probes, defaults to 10
+            - `affinity_slack`: Extra outstanding requests a user's node may have before they're moved, defaults to 2
+            - `keep_alive`: How long Ollama keeps the model loaded after a request ("30m", seconds, -1 for forever),
+              defaults to Ollama's own default of 5 minutes
+        """
+        settings = config["llm"]
+        self.health_interval: float = settings.get("health_interval", 10.0)
+        self.affinity_slack: int = settings.get("affinity_slack", 2)
+        self.keep_alive: Optional[Union[str, float]] = settings.get("keep_alive")
+        self.endpoints: List[OllamaEndpoint] = [
+            OllamaEndpoint(host, settings.get("max_connections", 16)) for host in settings.get("hosts") or [None]
+        ]
+
+        self._health_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """
+        Start probing the nodes in the background
+        """
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self) -> None:
+        """
+        Stop probing and close every node's connections
+        """
+        if self._health_task is not None:
+            self._health_task.cancel()
+
+        for endpoint in self.endpoints:
+            # The ollama client doesn't expose a close, its httpx client holds the connections
+            await endpoint.client._client.aclose()
+
+    def pick(self, exclude: Set[OllamaEndpoint], affinity: Optional[Hashable] = None) -> Optional[OllamaEndpoint]:
+        """
+        The least loaded healthy node that wasn't tried yet, or any untried node when none look healthy
+
+        With an `affinity` key the node it hashes to wins, unless it's too much busier than the least loaded one.
+        """
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+        healthy = [endpoint for endpoint in candidates if endpoint.healthy] or candidates
+        least = min(healthy, key=lambda endpoint: endpoint.outstanding, default=None)
+        if affinity is None or least is None:
+            return least
+
+        # Rendezvous hashing, a user only moves when their node goes away and stays put across restarts
+        preferred = max(healthy, key=lambda endpoint: zlib.crc32(f"{affinity}@{endpoint.host}".encode()))
+        if preferred.outstanding <= least.outstanding + self.affinity_slack:
+            return preferred
+
+        metrics.increment("ollama_affinity_misses")
+        return least
+
+    async def chat(self, affinity: Optional[Hashable] = None, hedge_after: Optional[float] = None,
+                   hedge: Optional[Dict] = None, **kwargs) -> ChatResponse:
+        """
+        Send a chat request, failing over to the other nodes when a node is unreachable
+
+        With `hedge_after`, a request that hasn't answered by then is sent a second time. The copy goes to another
+        healthy node, or with `hedge` it's the request updated with `hedge` (like a smaller model) on any node.
+        """
+        if hedge_after is None:
+            return await self._request("chat", affinity, **kwargs)
+        return await self._hedged(hedge_after, hedge, affinity, **kwargs)
+
+    async def embed(self, affinity: Optional[Hashable] = None, **kwargs) -> EmbedResponse:
+        """
+        Send an embedding request, failing over to the other nodes when a node is unreachable
+        """
+        return await self._request("embed", affinity, **kwargs)
+
+    async def stream_chat(self, affinity: Optional[Hashable] = None, **kwargs) -> AsyncIterator[ChatResponse]:
+        """
+        Stream a chat request, failing over to the other nodes when a node is unreachable before the first part
+        """
+        if self.keep_alive is not None:
+            kwargs.setdefault("keep_alive", self.keep_alive)
+
+        tried: Set[OllamaEndpoint] = set()
+        while True:
+            endpoint = self._next(tried, affinity)
+            endpoint.outstanding += 1
+            streamed = False
+            try:
+                async for part in await endpoint.client.chat(stream=True, **kwargs):
+                    streamed = True
+                    yield part
+            except NODE_ERRORS + (ResponseError,) as e:
+                # Parts were already shown to the user, we can't start over on another node
+                if streamed or not self._failed(endpoint, e, tried):
+                    raise
+                continue
+            finally:
+                endpoint.outstanding -= 1
+
+            metrics.increment(f'ollama_requests{{host="{endpoint.host}"}}')
+            return
+
+    async def warm_up(self, model: str, messages: List[Dict]) -> None:
+        """
+        Load the model on every node and prefill `messages` (the system prompt) into their KV caches
+
+        Generates a single token, so the first real prompt neither waits for the model to load nor re-prefills
+        the shared prefix.
+        """
+        async def warm(endpoint: OllamaEndpoint) -> None:
+            start = time.perf_counter()
+            try:
+                kwargs = {"keep_alive": self.keep_alive} if self.keep_alive is not None else {}
+                await endpoint.client.chat(model=model, messages=messages, options={"num_predict": 1}, **kwargs)
+            except NODE_ERRORS + (ResponseError,) as e:
+                logger.warning(f"Failed to warm up Ollama node '{endpoint.host}': {type(e).__name__}: {e}")
+                return
+
+            metrics.observe(f'ollama_warmup_seconds{{host="{endpoint.host}"}}', time.perf_counter() - start)
+            logger.info(f"Warmed up '{model}' on Ollama node '{endpoint.host}' in {time.perf_counter() - start:.2f}s")
+
+        await asyncio.gather(*(warm(endpoint) for endpoint in self.endpoints))
+
+    async def _request(self, method: str, affinity: Optional[Hashable] = None, tried: Optional[Set[OllamaEndpoint]] = None, **kwargs):
+        """
+        Send a non-streaming request, trying every node until one answers, `tried` collects the nodes it went to
+        """
+        if self.keep_alive is not None:
+            kwargs.setdefault("keep_alive", self.keep_alive)
+
+        tried = set() if tried is None else tried
+        while True:
+            endpoint = self._next(tried, affinity)
+            endpoint.outstanding += 1
+            try:
+                response = await getattr(endpoint.client, method)(**kwargs)
+            except NODE_ERRORS + (ResponseError,) as e:
+                if not self._failed(endpoint, e, tried):
+                    raise
+                continue
+            finally:
+                endpoint.outstanding -= 1
+
+            metrics.increment(f'ollama_requests{{host="{endpoint.host}"}}')
+            return response
+
+    async def _hedged(self, hedge_after: float, hedge: Optional[Dict], affinity: Optional[Hashable], **kwargs) -> ChatResponse:
+        """
+        Send a chat request, and a second one when the first hasn't answered after `hedge_after` seconds
+        """
+        tried: Set[OllamaEndpoint] = set()
+        first = asyncio.ensure_future(self._request("chat", affinity, tried, **kwargs))
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if done:
+                return first.result()
+
+            # Another node gets the same request, or any node the cheaper one
+            if hedge is not None:
+                second = self._request("chat", affinity, None, **{**kwargs, **hedge})
+            elif any(endpoint.healthy and endpoint not in tried for endpoint in self.endpoints):
+                second = self._request("chat", None, set(tried), **kwargs)
+            else:
+                return await first
+
+            metrics.increment("ollama_hedged_requests")
+            tasks.append(asyncio.ensure_future(second))
+
+            # The first answer wins, an error only counts once both requests failed
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            metrics.increment("ollama_hedge_wins")
+                        return task.result()
+                if not pending:
+                    return done.pop().result()
+        finally:
+            # The losing request is dropped mid generation, closing its connection frees Ollama's slot
+            for task in tasks:
+                task.cancel()
+
+    def _next(self, tried: Set[OllamaEndpoint], affinity: Optional[Hashable] = None) -> OllamaEndpoint:
+        """
+        The node to try next, raises once every node was tried
+        """
+        endpoint = self.pick(tried, affinity)
+        if endpoint is None:
+            raise ConnectionError("Every Ollama node failed")
+        tried.add(endpoint)
+        return endpoint
+
+    def _failed(self, endpoint: OllamaEndpoint, error: Exception, tried: Set[OllamaEndpoint]) -> bool:
+        """
+        Handle a failed request, returns whether it should be retried on another node
+        """
+        # Bad requests (unknown model, ...) would fail on every node
+        if isinstance(error, ResponseError) and error.status_code < 500:
+            return False
+
+        logger.warning(f"Ollama node '{endpoint.host}' failed: {type(error).__name__}: {error}")
+        metrics.increment(f'ollama_failovers{{host="{endpoint.host}"}}')
+        endpoint.mark(False)
+        return len(tried) < len(self.endpoints)
+
+    async def _health_loop(self) -> None:
+        """
+        Probe every node forever
+        """
+        while True:
+            await asyncio.gather(*(self._probe(endpoint) for endpoint in self.endpoints))
+            await asyncio.sleep(self.health_interval)
+
+    async def _probe(self, endpoint: OllamaEndpoint) -> None:
+        """
+        A node is healthy when it answers a cheap request in time
+        """
+        try:
+            await asyncio.wait_for(endpoint.client.list(), timeout=self.health_interval)
+            endpoint.mark(True)
+        except (asyncio.TimeoutError, ResponseError) + NODE_ERRORS:
+            endpoint.mark(False)
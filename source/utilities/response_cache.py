@@ -0,0 +1,145 @@
+# Needed libs
+from source.utilities.messages import Message
+from source.utilities.metrics import metrics
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import asyncio
+import json
+import time
+import re
+
+
+class ResponseCache:
+    def __init__(self, config: dict):
+        """
+        Opt-in cache of LLM responses for questions that get asked over and over
+
+        Responses are keyed on the model, the system prompt, the normalized message (case, whitespace and trailing
+        punctuation don't matter) and optionally a fingerprint of the user's latest turns. Entries expire after
+        `ttl` seconds and the least recently used ones are evicted past `max_entries` entries or `max_bytes` bytes.
+        Identical prompts that arrive while the first one is still generating wait for it instead of generating again.
+
+        Without `fingerprint_context` answers are shared across users, only enable the cache for servers where the
+        repeated questions don't depend on who's asking.
+
+        Config (settings.json['cache'], all optional):
+            - `enabled`: Whether to cache at all, defaults to false
+            - `ttl`: Seconds an answer stays cached, defaults to 3600
+            - `max_entries`: Cached answers, defaults to 1000
+            - `max_bytes`: Total size of the cached answers, defaults to 5000000
+            - `fingerprint_context`: Include the user's latest turns in the key, defaults to false
+            - `fingerprint_turns`: Latest turns included in the fingerprint, defaults to 2
+        """
+        settings = config.get("cache", {})
+        self.enabled: bool = settings.get("enabled", False)
+        self.ttl: float = settings.get("ttl", 3600)
+        self.max_entries: int = settings.get("max_entries", 1000)
+        self.max_bytes: int = settings.get("max_bytes", 5_000_000)
+        self.fingerprint_context: bool = settings.get("fingerprint_context", False)
+        self.fingerprint_turns: int = settings.get("fingerprint_turns", 2)
+
+        # Cached answers, least recently used first, with the time they expire
+        self._entries: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+        self.size_bytes: int = 0
+
+        # Answers being generated right now
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        """
+        Lowercase, collapse whitespace and drop trailing punctuation
+        """
+        return re.sub(r"\s+", " ", message).strip().lower().rstrip("?!. ")
+
+    def key(self, model: str, system_prompt: str, message: str, context: List[Message]) -> str:
+        """
+        The cache key of a prompt
+        """
+        parts = [model, system_prompt, self.normalize(message)]
+        if self.fingerprint_context:
+            parts.extend(f"{msg.role}: {msg.content}" for msg in context[-self.fingerprint_turns * 2:])
+        return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        A cached answer, or None when there's none or it expired
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires, response = entry
+        if expires < time.monotonic():
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return response
+
+    def put(self, key: str, response: str) -> None:
+        """
+        Cache an answer, evicting the least recently used ones past the limits
+        """
+        if key in self._entries:
+            self._remove(key)
+
+        size = len(response.encode())
+        if size > self.max_bytes:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, response)
+        self.size_bytes += size
+
+        while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            metrics.increment("cache_evictions")
+
+        metrics.set_gauge("cache_entries", len(self._entries))
+        metrics.set_gauge("cache_bytes", self.size_bytes)
+
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[Tuple[str, bool]]]) -> Tuple[str, bool]:
+        """
+        The cached answer, the answer of an identical prompt that's still generating, or a freshly generated one
+
+        `generate` returns the answer and whether it belongs under `key`, one that doesn't is still handed to the
+        prompts waiting for it but isn't cached. Returns the answer and whether `generate` was called for it.
+        """
+        response = self.get(key)
+        if response is not None:
+            metrics.increment("cache_hits")
+            return response, False
+
+        # Someone asked the same thing a moment ago, wait for their answer
+        if key in self._inflight:
+            metrics.increment("cache_coalesced")
+            return await asyncio.shield(self._inflight[key]), False
+
+        metrics.increment("cache_misses")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response, cacheable = await generate()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else might be waiting, don't log it as never retrieved
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+        future.set_result(response)
+        if cacheable:
+            self.put(key, response)
+        return response, True
+
+    def _remove(self, key: str) -> None:
+        """
+        Drop a cached answer
+        """
+        _, response = self._entries.pop(key)
+        self.size_bytes -= len(response.encode())
@@ -0,0 +1,161 @@
+# Needed libs
+from source.utilities.metrics import metrics
+from source.utilities import tracing
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import asyncio
+import time
+
+
+class SchedulerFull(Exception):
+    """
+    Raised when the prompt queue is full
+    """
+
+
+class PromptScheduler:
+    def __init__(self, config: dict):
+        """
+        Schedules prompts between the prompt command and the Ollama client
+
+        - Prompts of the same user run one at a time, in order, so their history never interleaves
+        - At most `max_inflight` prompts run at once, match it with Ollama's OLLAMA_NUM_PARALLEL
+        - At most `max_queue` prompts wait for a slot, anything past that is turned away right away
+        - Free slots go round robin across guilds, so one busy guild can't starve the others
+
+        Config (settings.json['scheduler'], all optional):
+            - `max_inflight`: Prompts sent to Ollama at the same time, defaults to 1
+            - `max_queue`: Prompts that can wait for a slot, defaults to 50
+        """
+        settings = config.get("scheduler", {})
+        self.max_inflight: int = settings.get("max_inflight", 1)
+        self.max_queue: int = settings.get("max_queue", 50)
+
+        # Running prompts and prompts waiting for a slot (including the ones waiting behind their own user)
+        self.inflight: int = 0
+        self.waiting: int = 0
+
+        # Waiting prompts per guild, guilds are served in this order and move to the back once served
+        self._queues: OrderedDict[int, Deque[asyncio.Future]] = OrderedDict()
+
+        # Per user ordering locks, with the amount of prompts holding or waiting on each
+        self._user_locks: Dict[Tuple[int, int], List] = {}
+
+    @asynccontextmanager
+    async def slot(self, guild_id: int, user_id: int, on_queued: Optional[Callable[[int], Awaitable]] = None) -> AsyncIterator[None]:
+        """
+        Wait for the user's turn and a free slot, then hold the slot for the duration of the block
+
+        `on_queued` is awaited with the prompt's position in line when it can't run right away.
+        Raises `SchedulerFull` when too many prompts are already waiting.
+        """
+        if self.waiting >= self.max_queue:
+            metrics.increment("scheduler_rejected")
+            raise SchedulerFull()
+
+        start = time.perf_counter()
+        self.waiting += 1
+        self._update_gauges()
+
+        # Only tell the user about their position once
+        notified = False
+
+        async def notify(position: int) -> None:
+            nonlocal notified
+            if on_queued is not None and not notified:
+                notified = True
+                await on_queued(position)
+
+        # Wait for the user's previous prompts first
+        key = (guild_id, user_id)
+        entry = self._user_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        acquired = False
+
+        try:
+            if entry[0].locked():
+                await notify(self.waiting)
+
+            async with entry[0]:
+                await self._acquire(guild_id, notify)
+                acquired = True
+
+                self.waiting -= 1
+                metrics.observe("scheduler_wait_seconds", time.perf_counter() - start)
+                tracing.record("queue_wait", time.perf_counter() - start)
+                self._update_gauges()
+
+                try:
+                    yield
+                finally:
+                    self._release()
+        finally:
+            # Cancelled or failed before it got a slot
+            if not acquired:
+                self.waiting -= 1
+                self._update_gauges()
+
+            entry[1] -= 1
+            if not entry[1]:
+                del self._user_locks[key]
+
+    async def _acquire(self, guild_id: int, on_queued: Callable[[int], Awaitable]) -> None:
+        """
+        Take a free slot, or wait in the guild's queue until one is handed to us
+        """
+        if self.inflight < self.max_inflight and not self._queues:
+            self.inflight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(guild_id, deque()).append(future)
+
+        try:
+            await on_queued(sum(len(queue) for queue in self._queues.values()))
+            await future
+        except BaseException:
+            # The slot was handed to us right as we got cancelled, pass it on
+            if future.done() and not future.cancelled():
+                self._release()
+            else:
+                # Leave the line so we never hold up the guilds behind us
+                future.cancel()
+                queue = self._queues.get(guild_id)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self._queues[guild_id]
+            raise
+
+    def _release(self) -> None:
+        """
+        Free a slot and hand the free slots to the next guilds in line
+        """
+        self.inflight -= 1
+
+        while self.inflight < self.max_inflight and self._queues:
+            guild_id, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+
+            # Next guild's turn
+            if queue:
+                self._queues.move_to_end(guild_id)
+            else:
+                del self._queues[guild_id]
+
+            # Cancelled while waiting
+            if future.done():
+                continue
+
+            future.set_result(None)
+            self.inflight += 1
+
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        """
+        Report the queue depth and running prompts
+        """
+        metrics.set_gauge("scheduler_queue_depth", self.waiting)
+        metrics.set_gauge("scheduler_inflight", self.inflight)
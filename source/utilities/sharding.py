@@ -0,0 +1,75 @@
+# Needed libs
+from typing import List, Optional, Set
+import copy
+
+
+def shard_of(guild_id: int, shard_count: int) -> int:
+    """
+    The shard Discord delivers a guild's events to
+    """
+    return (guild_id >> 22) % shard_count
+
+
+def partition(shard_count: int, processes: int) -> List[List[int]]:
+    """
+    Splits the shards into `processes` contiguous ranges of (nearly) the same size
+    """
+    if not 0 < processes <= shard_count:
+        raise ValueError(f"Can't split {shard_count} shards over {processes} processes")
+
+    size, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for index in range(processes):
+        end = start + size + (index < extra)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def process_config(config: dict, index: int, shard_ids: List[int]) -> dict:
+    """
+    The config of the `index`th process of a multi-process deployment, owning `shard_ids`
+
+    Everything a process writes on its own (log file, metrics port and dump file) is suffixed with its index,
+    so processes never share a file or a port.
+    """
+    config = copy.deepcopy(config)
+    config["discord"]["shard_ids"] = shard_ids
+
+    logging_settings = config.setdefault("logging", {})
+    logging_settings["file"] = f"{logging_settings.get('file', 'discord.log').removesuffix('.log')}.{index}.log"
+
+    metrics_settings = config.setdefault("metrics", {})
+    if metrics_settings.get("port") is not None:
+        metrics_settings["port"] += index
+    if metrics_settings.get("dump_path") is not None:
+        metrics_settings["dump_path"] = f"{metrics_settings['dump_path']}.{index}"
+    return config
+
+
+class Shards:
+    def __init__(self, config: dict):
+        """
+        The shards this process runs, and so the guilds whose contexts it owns
+
+        Discord delivers every event of a guild to a single shard, so as long as each shard runs in one process
+        no two processes ever write the same user's history.
+
+        Config (settings.json['discord'], all optional):
+            - `shard_count`: Total amount of shards, defaults to the amount Discord recommends
+            - `shard_ids`: Shards run by this process, defaults to all of them
+            - `processes`: Processes `main.py` splits the shards over, defaults to 1 (needs `shard_count`)
+        """
+        settings = config.get("discord", {})
+        self.count: Optional[int] = settings.get("shard_count")
+        self.ids: Optional[Set[int]] = set(settings["shard_ids"]) if settings.get("shard_ids") is not None else None
+        self.processes: int = settings.get("processes", 1)
+
+        if self.ids is not None and self.count is None:
+            raise ValueError("settings.json['discord']['shard_ids'] needs a shard_count")
+
+    def owns(self, guild_id: int) -> bool:
+        """
+        Whether this process receives the guild's events
+        """
+        return self.ids is None or shard_of(guild_id, self.count) in self.ids
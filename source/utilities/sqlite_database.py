@@ -0,0 +1,268 @@
+from source.utilities.storage import StorageBackend
+from source.utilities.messages import Message, as_message
+from source.utilities.metrics import metrics
+from typing import Callable, Dict, List, Set, Tuple
+
+import sqlite3
+import time
+import os
+
+# Free pages handed back to the file system per incremental vacuum step
+VACUUM_STEP_PAGES = 256
+
+
+class SQLiteDatabase(StorageBackend):
+    def __init__(self, context_manager, config: dict = None):
+        """
+        SQLite Based Database System, a single database file in WAL mode
+
+        Every message is a row keyed by (guild_id, user_id, seq) with its cached token count, so appends, trims
+        and clears are small transactions instead of file rewrites, and users can be queried across guilds.
+
+        Tables:
+            - `users`: (guild_id, user_id, updated), every stored user and when its history last changed
+            - `messages`: (guild_id, user_id, seq, role, content, tokens), seq increases per user
+
+        The event loop reads through its own connection while the background writer writes through another,
+        WAL mode lets the two run at the same time.
+
+        New database files use incremental auto vacuum, so maintenance can give the pages of deleted messages back
+        to the file system a few at a time instead of locking the whole file for a full VACUUM.
+
+        Config (settings.json['database'], all optional):
+            - `sqlite_path`: Database file, defaults to "./database/concierge.sqlite3"
+        """
+        # Database settings
+        settings = (config or {}).get("database", {})
+        self.sqlite_path: str = settings.get("sqlite_path", "./database/concierge.sqlite3")
+
+        # Make sure the database folder exists
+        os.makedirs(os.path.dirname(self.sqlite_path) or ".", exist_ok=True)
+
+        # Writer connection first, it sets up WAL mode and the schema
+        self._write_connection = self._connect()
+
+        # Only takes effect on a file without tables yet
+        self._write_connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        with self._write_connection:
+            self._write_connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS users (
+                    guild_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    updated REAL,
+                    PRIMARY KEY (guild_id, user_id)
+                ) WITHOUT ROWID;
+
+                CREATE TABLE IF NOT EXISTS messages (
+                    guild_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    tokens INTEGER,
+                    PRIMARY KEY (guild_id, user_id, seq)
+                ) WITHOUT ROWID;
+                """
+            )
+
+            # Older databases don't know when their users last changed, their age starts now
+            columns = [column[1] for column in self._write_connection.execute("PRAGMA table_info(users)")]
+            if "updated" not in columns:
+                self._write_connection.execute("ALTER TABLE users ADD COLUMN updated REAL")
+                self._write_connection.execute("UPDATE users SET updated = ?", (time.time(),))
+        self._read_connection = self._connect()
+
+        # Starts the background writer
+        super().__init__(context_manager=context_manager, config=config)
+
+    def list_users(self) -> Dict[int, Set[int]]:
+        """
+        List every user that has a context in the database without reading any of them
+        """
+        users: Dict[int, Set[int]] = {}
+        for guild_id, user_id in self._read_connection.execute("SELECT guild_id, user_id FROM users"):
+            users.setdefault(guild_id, set()).add(user_id)
+        return users
+
+    def load_user(self, guild_id: int, user_id: int) -> List[Message]:
+        """
+        Read a user's messages in order
+        """
+        rows = self._read_connection.execute(
+            "SELECT role, content, tokens FROM messages WHERE guild_id = ? AND user_id = ? ORDER BY seq",
+            (guild_id, user_id)
+        )
+
+        return [Message(role, content, tokens) for role, content, tokens in rows]
+
+    def usage(self) -> Dict[Tuple[int, int], Tuple[float, int]]:
+        """
+        When every user last changed and the bytes of its messages, read through a connection of its own
+        since it runs on a worker thread
+        """
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                """
+                SELECT users.guild_id, users.user_id, users.updated, COALESCE(SUM(LENGTH(CAST(messages.content AS BLOB))), 0)
+                FROM users LEFT JOIN messages USING (guild_id, user_id)
+                GROUP BY users.guild_id, users.user_id
+                """
+            )
+            return {(guild_id, user_id): (updated or 0.0, size) for guild_id, user_id, updated, size in rows}
+        finally:
+            connection.close()
+
+    def storage_bytes(self) -> int:
+        """
+        Size of the database file and its WAL
+        """
+        return sum(
+            os.path.getsize(path)
+            for path in (self.sqlite_path, f"{self.sqlite_path}-wal", f"{self.sqlite_path}-shm")
+            if os.path.exists(path)
+        )
+
+    def compact_all(self, throttle: Callable[[int], None], owns: Callable[[int], bool]) -> int:
+        """
+        Checkpoint the WAL and give free pages back to the file system, returns the bytes reclaimed
+
+        The file is shared by every guild, so `owns` doesn't narrow anything down here. Each step only frees
+        `VACUUM_STEP_PAGES` pages, the writer gets the file back between steps. A database created before
+        incremental auto vacuum gets one full VACUUM to switch it over.
+        """
+        connection = self._connect()
+        try:
+            connection.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+            page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+
+            if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                before = self.storage_bytes()
+                connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                connection.execute("VACUUM")
+                throttle(before)
+                return max(before - self.storage_bytes(), 0)
+
+            reclaimed = 0
+            while True:
+                free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0]
+                if not free_pages:
+                    break
+
+                pages = min(free_pages, VACUUM_STEP_PAGES)
+                connection.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+                reclaimed += pages * page_size
+                throttle(pages * page_size)
+
+            # The vacuum went through the WAL, fold it back into the file
+            connection.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+            return reclaimed
+        finally:
+            connection.close()
+
+    def import_user(self, guild_id: int, user_id: int, context: List[Dict]) -> None:
+        """
+        Replace a user's messages right away, used to migrate other databases
+        """
+        with self._flush_lock, self._write_connection:
+            self._write_connection.execute(
+                "DELETE FROM messages WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)
+            )
+            self._apply(guild_id, user_id, [{"op": "append", "messages": [as_message(message) for message in context]}])
+
+    def close(self) -> None:
+        """
+        Flush whatever is still pending and close both connections
+        """
+        super().close()
+        self._read_connection.close()
+        self._write_connection.close()
+
+    def _write_user(self, guild_id: int, user_id: int, records: List[Dict]) -> None:
+        """
+        Apply a user's records in a single transaction
+        """
+        with self._write_connection:
+            self._apply(guild_id, user_id, records)
+
+    def _apply(self, guild_id: int, user_id: int, records: List[Dict]) -> None:
+        """
+        Apply records to a user's rows, has to run inside a transaction of the writer connection
+        """
+        connection = self._write_connection
+
+        # Continue after the user's newest message
+        next_seq = connection.execute(
+            "SELECT COALESCE(MAX(seq), 0) + 1 FROM messages WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)
+        ).fetchone()[0]
+
+        rows = 0
+        for record in records:
+            if record["op"] == "append":
+                connection.executemany(
+                    "INSERT INTO messages (guild_id, user_id, seq, role, content, tokens) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (guild_id, user_id, next_seq + index, message.role, message.content, message.tokens)
+                        for index, message in enumerate(record["messages"])
+                    ]
+                )
+                next_seq += len(record["messages"])
+                rows += len(record["messages"])
+            elif record["op"] == "trim":
+                connection.execute(
+                    """
+                    DELETE FROM messages WHERE guild_id = ? AND user_id = ? AND seq IN (
+                        SELECT seq FROM messages WHERE guild_id = ? AND user_id = ? ORDER BY seq LIMIT ?
+                    )
+                    """,
+                    (guild_id, user_id, guild_id, user_id, record["amount"])
+                )
+            elif record["op"] == "replace":
+                seqs = [
+                    seq for seq, in connection.execute(
+                        "SELECT seq FROM messages WHERE guild_id = ? AND user_id = ? ORDER BY seq LIMIT ?",
+                        (guild_id, user_id, record["amount"])
+                    )
+                ]
+                connection.executemany(
+                    "DELETE FROM messages WHERE guild_id = ? AND user_id = ? AND seq = ?",
+                    [(guild_id, user_id, seq) for seq in seqs]
+                )
+
+                # The new messages take over the newest freed sequence numbers, so they stay in front of the rest
+                connection.executemany(
+                    "INSERT INTO messages (guild_id, user_id, seq, role, content, tokens) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (guild_id, user_id, seq, message.role, message.content, message.tokens)
+                        for seq, message in zip(seqs[len(seqs) - len(record["messages"]):], record["messages"])
+                    ]
+                )
+                rows += len(record["messages"])
+            elif record["op"] == "clear":
+                connection.execute("DELETE FROM messages WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+            elif record["op"] == "delete":
+                connection.execute("DELETE FROM messages WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+                connection.execute("DELETE FROM users WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+
+        # Remember when the user last changed, unless it's gone
+        if records and records[-1]["op"] != "delete":
+            connection.execute(
+                """
+                INSERT INTO users (guild_id, user_id, updated) VALUES (?, ?, ?)
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET updated = excluded.updated
+                """,
+                (guild_id, user_id, time.time())
+            )
+
+        metrics.increment("database_rows_written", rows)
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a connection that can be handed between the event loop and the writer thread
+        """
+        connection = sqlite3.connect(self.sqlite_path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute("PRAGMA busy_timeout = 5000")
+        return connection
@@ -0,0 +1,201 @@
+from source.utilities.messages import Message, as_message
+from source.utilities.metrics import metrics
+from typing import Callable, Dict, List, Set, Tuple, Union
+
+import threading
+import logging
+import time
+
+logger = logging.getLogger("discord_bot")
+
+
+class StorageBackend:
+    def __init__(self, context_manager, config: dict = None):
+        """
+        Base class of every context storage backend, the Context Manager only talks to this interface
+
+        Writes are write-behind: every change to a context (append, trim, replace, clear or delete) is queued as a
+        record per (guild, user) key, and a background thread hands the queued records of each user to `_write_user`
+        in batches, so the event loop never serializes or touches the disk.
+
+        Record structure:
+        {
+            "seq" (int): <per user sequence number>,
+            "op" (str): "append" | "trim" | "clear" | "replace" | "delete",
+            "messages" (list): [<Message>, ...],  # append and replace only, turned into dicts by the writer
+            "amount" (int): <messages removed from the front>  # trim and replace only
+        }
+
+        A replace record swaps the oldest `amount` messages for its (fewer) messages, used to fold old turns into a summary.
+        A delete record removes the user from the storage altogether, unlike a clear it doesn't leave an empty history behind.
+
+        Backends implement `list_users`, `load_user`, `_write_user` and the maintenance methods (`usage`,
+        `storage_bytes` and `compact_all`), and have to set up everything
+        `_write_user` needs before calling this constructor since it starts the writer thread.
+
+        Config (settings.json['database'], all optional):
+            - `flush_interval`: Seconds between background flushes, defaults to 1.0
+            - `flush_batch_size`: Amount of dirty users that triggers an early flush, defaults to 64
+        """
+        # Context Manager
+        self.context_manager = context_manager
+
+        # Write-behind settings
+        settings = (config or {}).get("database", {})
+        self.flush_interval: float = settings.get("flush_interval", 1.0)
+        self.flush_batch_size: int = settings.get("flush_batch_size", 64)
+
+        # Records waiting to be written, keyed by (guild_id, user_id)
+        self._pending: Dict[Tuple[int, int], List[Dict]] = {}
+        self._flushing: Dict[Tuple[int, int], List[Dict]] = {}
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        # Last sequence number handed out, per user
+        self._sequences: Dict[Tuple[int, int], int] = {}
+
+        # Background writer
+        self._writer = threading.Thread(target=self._flush_loop, name="database-writer", daemon=True)
+        self._writer.start()
+
+    def list_users(self) -> Dict[int, Set[int]]:
+        """
+        List every user that has a context in the storage without reading any of them
+        """
+        raise NotImplementedError
+
+    def load_user(self, guild_id: int, user_id: int) -> List[Message]:
+        """
+        Read a user's context from the storage
+        """
+        raise NotImplementedError
+
+    def usage(self) -> Dict[Tuple[int, int], Tuple[float, int]]:
+        """
+        When every stored user's history last changed (unix time) and about how many bytes it takes, without reading any of them
+        """
+        raise NotImplementedError
+
+    def storage_bytes(self) -> int:
+        """
+        Bytes the storage takes on disk
+        """
+        raise NotImplementedError
+
+    def compact_all(self, throttle: Callable[[int], None], owns: Callable[[int], bool]) -> int:
+        """
+        Rewrite the histories of the guilds `owns` accepts to reclaim space, returns the bytes rewritten
+
+        Runs on a worker thread, `throttle` is called with the bytes of every step and sleeps to pace the I/O.
+        """
+        raise NotImplementedError
+
+    def append_context(self, guild_id: int, user_id: int, messages: List[Union[Message, Dict]]) -> None:
+        """
+        Queue new messages to be appended to a user's context
+        """
+        self._queue(guild_id, user_id, {"op": "append", "messages": [as_message(message) for message in messages]})
+
+    def trim_context(self, guild_id: int, user_id: int, amount: int) -> None:
+        """
+        Queue the removal of a user's oldest messages
+        """
+        self._queue(guild_id, user_id, {"op": "trim", "amount": amount})
+
+    def replace_context(self, guild_id: int, user_id: int, amount: int, messages: List[Union[Message, Dict]]) -> None:
+        """
+        Queue replacing a user's oldest messages with new ones
+        """
+        self._queue(guild_id, user_id, {"op": "replace", "amount": amount, "messages": [as_message(message) for message in messages]})
+
+    def clear_context(self, guild_id: int, user_id: int) -> None:
+        """
+        Queue the removal of a user's entire context
+        """
+        self._queue(guild_id, user_id, {"op": "clear"})
+
+    def delete_context(self, guild_id: int, user_id: int) -> None:
+        """
+        Queue the removal of a user from the storage
+        """
+        self._queue(guild_id, user_id, {"op": "delete"})
+
+    def has_unflushed(self, guild_id: int, user_id: int) -> bool:
+        """
+        Whether a user has records that aren't stored yet, either queued or part of the batch being flushed
+        """
+        with self._pending_lock:
+            return (guild_id, user_id) in self._pending or (guild_id, user_id) in self._flushing
+
+    def flush(self) -> None:
+        """
+        Write every queued record
+        """
+        with self._flush_lock:
+            # Take the current batch, new records queue up behind it
+            with self._pending_lock:
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+
+            metrics.set_gauge("database_queue_depth", 0)
+            if not batch:
+                return
+
+            start = time.perf_counter()
+            for (guild_id, user_id), records in batch.items():
+                try:
+                    self._write_user(guild_id, user_id, records)
+                except Exception as e:
+                    logger.error(f"Failed to write context of {guild_id}/{user_id}: {type(e).__name__}: {e}")
+
+                    # Retry on the next flush, ahead of anything queued meanwhile
+                    with self._pending_lock:
+                        self._pending[(guild_id, user_id)] = records + self._pending.get((guild_id, user_id), [])
+
+            with self._pending_lock:
+                self._flushing = {}
+
+            metrics.observe("database_flush_seconds", time.perf_counter() - start)
+            metrics.increment("database_flushed_users", len(batch))
+
+    def close(self) -> None:
+        """
+        Stop the background writer and flush whatever is still pending
+        """
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join()
+        self.flush()
+
+    def _write_user(self, guild_id: int, user_id: int, records: List[Dict]) -> None:
+        """
+        Store a batch of records of a single user, in order
+        """
+        raise NotImplementedError
+
+    def _queue(self, guild_id: int, user_id: int, record: Dict) -> None:
+        """
+        Number a record and queue it for the background writer
+        """
+        key = (guild_id, user_id)
+        with self._pending_lock:
+            record["seq"] = self._sequences[key] = self._sequences.get(key, 0) + 1
+            self._pending.setdefault(key, []).append(record)
+            queue_depth = len(self._pending)
+
+        metrics.set_gauge("database_queue_depth", queue_depth)
+
+        # Don't wait for the interval when a large batch is ready
+        if queue_depth >= self.flush_batch_size:
+            self._wakeup.set()
+
+    def _flush_loop(self) -> None:
+        """
+        Background writer, flushes every interval or as soon as a batch is full
+        """
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
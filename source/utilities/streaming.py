@@ -0,0 +1,116 @@
+# Discord Libs
+from source.utilities.delivery import split_markdown
+from source.utilities.metrics import metrics, SIZE_BUCKETS
+import discord
+
+# Needed libs
+from typing import List, Optional
+import asyncio
+import logging
+
+logger = logging.getLogger("discord_bot")
+
+
+class StreamingMessage:
+    def __init__(self, interaction: discord.Interaction, edit_interval: float = 1.0):
+        """
+        Shows a streamed response in a deferred interaction by progressively editing followup messages
+
+        `update` only records the latest text, a single background task pushes it to Discord at most once
+        every `edit_interval` seconds, so edits are debounced and never overlap no matter how fast tokens
+        arrive. Discord.py waits out any rate limit it still hits. Text past the 2000 character limit rolls
+        over into new followup messages, split the same way finished answers are.
+        """
+        self.interaction = interaction
+        self.edit_interval = edit_interval
+
+        # Latest text and what each followup message currently shows
+        self.text = ""
+        self.messages: List[discord.WebhookMessage] = []
+        self.shown: List[str] = []
+
+        # Amount of sends and edits, reported once the response is finished
+        self.requests = 0
+
+        self._changed = asyncio.Event()
+        self._done = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """
+        Start the background editor
+        """
+        self._task = asyncio.create_task(self._run())
+
+    def update(self, text: str) -> None:
+        """
+        Record the latest text, it's shown on the next edit
+        """
+        self.text = text
+        self._changed.set()
+
+    async def finish(self, text: str) -> None:
+        """
+        Show the final text and wait for the editor to push it
+        """
+        self.text = text
+        self._done = True
+        self._changed.set()
+        await self._task
+
+        metrics.observe("discord_stream_requests", self.requests, buckets=SIZE_BUCKETS)
+
+    def cancel(self) -> None:
+        """
+        Stop the editor without showing anything else, used when the prompt failed
+        """
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self) -> None:
+        """
+        Push the latest text at most once every interval until the response is finished
+        """
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+
+            try:
+                await self._sync()
+            except discord.HTTPException as e:
+                logger.error(f"Failed to update streamed response: {type(e).__name__}: {e}")
+
+            # A final update that landed while we were editing is handled on the next pass
+            if self._done and not self._changed.is_set():
+                return
+
+            if not self._done:
+                await asyncio.sleep(self.edit_interval)
+
+    async def _sync(self) -> None:
+        """
+        Make the followup messages match the latest text, editing changed chunks and sending new ones
+        """
+        text = self.text
+        chunks = split_markdown(text)
+
+        for index, chunk in enumerate(chunks):
+            # Discord doesn't allow empty messages, wait for more text
+            if not chunk.strip():
+                break
+
+            if index < len(self.messages):
+                if self.shown[index] != chunk:
+                    await self.messages[index].edit(content=chunk)
+                    self.shown[index] = chunk
+                    self.requests += 1
+            else:
+                self.messages.append(await self.interaction.followup.send(chunk, wait=True))
+                self.shown.append(chunk)
+                self.requests += 1
+
+        # The "Summary: " tail can shrink the text after it already rolled over, drop the leftovers
+        while len(self.messages) > max(len(chunks), 1):
+            await self.messages.pop().delete()
+            self.shown.pop()
+            self.requests += 1
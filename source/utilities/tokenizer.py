@@ -0,0 +1,154 @@
+# Needed libs
+from source.utilities.metrics import metrics
+from typing import Dict, List, Optional, Tuple
+import threading
+import logging
+import time
+import os
+
+logger = logging.getLogger("discord_bot")
+
+# Tokenizer used for each Ollama model family when settings.json['llm']['tokenizer'] isn't set, the official Gemma
+# and Llama repos are gated behind a Hugging Face token so their ungated copies (same tokenizer files) are used
+MODEL_TOKENIZERS = {
+    "gemma3": "unsloth/gemma-3-4b-it",
+    "gemma2": "unsloth/gemma-2-2b-it",
+    "llama3": "unsloth/Meta-Llama-3.1-8B-Instruct",
+    "qwen2.5": "Qwen/Qwen2.5-7B-Instruct",
+    "deepseek-r1": "deepseek-ai/DeepSeek-R1",
+}
+
+# Rough characters per token of English text, used until the real tokenizer is loaded
+CHARACTERS_PER_TOKEN = 4
+
+# One counter per tokenizer, shared by the whole process
+_counters: Dict[str, "TokenCounter"] = {}
+_counters_lock = threading.Lock()
+
+
+class TokenCounter:
+    def __init__(self, tokenizer: str, cache_path: Optional[str] = None, offline: bool = False):
+        """
+        Counts tokens with a Hugging Face tokenizer that's loaded in the background
+
+        Until the tokenizer is ready (or when it can't be loaded at all) tokens are estimated from the text length,
+        `exact` tells which one is used. `transformers` is only imported by the loader thread, so importing this
+        module and starting the bot stay fast.
+
+        - `tokenizer`: Hub name or local folder of the tokenizer
+        - `cache_path`: Local folder the tokenizer is saved to after its first load and loaded from afterwards
+        - `offline`: Never reach out to the hub, only use local files
+        """
+        self.tokenizer_name = tokenizer
+        self.cache_path = cache_path
+        self.offline = offline
+
+        self.tokenizer = None
+        self.ready = threading.Event()
+        self._loader: Optional[threading.Thread] = None
+
+    @property
+    def exact(self) -> bool:
+        """
+        Whether counts come from the real tokenizer
+        """
+        return self.tokenizer is not None
+
+    def start(self) -> None:
+        """
+        Start loading the tokenizer in the background, only the first call does anything
+        """
+        with _counters_lock:
+            if self._loader is None:
+                self._loader = threading.Thread(target=self._load, name="tokenizer-loader", daemon=True)
+                self._loader.start()
+
+    def count(self, text: str) -> int:
+        """
+        The amount of tokens in a text, estimated while the tokenizer is loading
+        """
+        if self.tokenizer is None:
+            return len(text) // CHARACTERS_PER_TOKEN + 1
+        return len(self.tokenizer.encode(text))
+
+    def count_many(self, texts: List[str]) -> List[int]:
+        """
+        The amount of tokens in each text, encoded as one batch
+        """
+        if self.tokenizer is None:
+            return [self.count(text) for text in texts]
+        return [len(ids) for ids in self.tokenizer(texts)["input_ids"]]
+
+    def _load(self) -> None:
+        """
+        Load the tokenizer, from the local cache when it's there
+        """
+        start = time.perf_counter()
+        try:
+            from transformers import AutoTokenizer
+
+            if self.cache_path and os.path.isdir(self.cache_path):
+                tokenizer = AutoTokenizer.from_pretrained(self.cache_path, local_files_only=True)
+            else:
+                tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name, local_files_only=self.offline)
+
+                # Next startups load it from disk, even without a network
+                if self.cache_path:
+                    tokenizer.save_pretrained(self.cache_path)
+        except Exception as e:
+            logger.warning(f"Failed to load tokenizer '{self.tokenizer_name}', estimating token counts instead: {type(e).__name__}: {e}")
+            return
+        finally:
+            self.ready.set()
+
+        self.tokenizer = tokenizer
+        metrics.observe("tokenizer_load_seconds", time.perf_counter() - start)
+        logger.info(f"Loaded tokenizer '{self.tokenizer_name}' in {time.perf_counter() - start:.2f}s")
+
+
+def tokenizer_for(config: dict) -> str:
+    """
+    The tokenizer of the configured model, settings.json['llm']['tokenizer'] wins over the model family lookup
+    """
+    settings = config.get("llm", {})
+    if settings.get("tokenizer"):
+        return settings["tokenizer"]
+
+    family = (settings.get("model") or "").split(":")[0]
+    return MODEL_TOKENIZERS.get(family, MODEL_TOKENIZERS["gemma3"])
+
+
+def get_token_counter(config: dict) -> TokenCounter:
+    """
+    The shared counter of the configured model's tokenizer, it starts loading on first use
+
+    Config (settings.json['llm'], all optional):
+        - `tokenizer`: Hub name or local folder of the tokenizer, defaults to the one matching `model`
+        - `tokenizer_cache`: Local folder the tokenizer is saved to and loaded from, defaults to none
+        - `tokenizer_offline`: Only use local files, defaults to false
+    """
+    settings = config.get("llm", {})
+    name = tokenizer_for(config)
+
+    with _counters_lock:
+        counter = _counters.get(name)
+        if counter is None:
+            counter = _counters[name] = TokenCounter(
+                tokenizer=name,
+                cache_path=settings.get("tokenizer_cache"),
+                offline=settings.get("tokenizer_offline", False),
+            )
+
+    counter.start()
+    return counter
+
+
+def count_batch(config: dict, texts: List[str]) -> Tuple[bool, List[int]]:
+    """
+    Count a batch of texts with the shared counter of this process, and whether the counts are exact
+
+    Module level so worker processes can run it, each one loads its own tokenizer.
+    """
+    counter = get_token_counter(config)
+    exact = counter.exact
+    return exact, counter.count_many(texts)
@@ -0,0 +1,95 @@
+# Needed libs
+from source.utilities.metrics import metrics, SIZE_BUCKETS
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Union
+import logging
+import time
+
+logger = logging.getLogger("discord_bot")
+
+
+class Trace:
+    def __init__(self, name: str, **attributes: Union[int, float, str]):
+        """
+        Stage breakdown of a single request
+
+        Every stage (tokenize, llm, discord_send, ...) adds up how long it took, attributes hold the sizes that explain
+        it (prompt tokens, trim iterations, ...). The trace of the running request is found through `current_trace`,
+        so code deep in the pipeline can add to it without it being passed around.
+        """
+        self.name = name
+        self.attributes: Dict[str, Union[int, float, str]] = dict(attributes)
+        self.stages: Dict[str, float] = {}
+        self.start = time.perf_counter()
+
+    def record(self, stage: str, seconds: float) -> None:
+        """
+        Adds the time spent in a stage, stages that run more than once add up
+        """
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def describe(self, total: float) -> str:
+        """
+        One line summary of the request
+        """
+        stages = " ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in self.stages.items())
+        attributes = " ".join(f"{key}={value}" for key, value in self.attributes.items())
+        return f"{self.name} took {total * 1000:.1f}ms: {stages} {attributes}".rstrip()
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def trace(name: str, slow_seconds: Optional[float] = None, **attributes: Union[int, float, str]) -> Iterator[Trace]:
+    """
+    Traces a request for the duration of the block, recording its total as `<name>_seconds`
+
+    Requests slower than `slow_seconds` get their stage breakdown logged.
+    """
+    request = Trace(name, **attributes)
+    token = current_trace.set(request)
+    try:
+        yield request
+    finally:
+        current_trace.reset(token)
+        total = time.perf_counter() - request.start
+        metrics.observe(f"{name}_seconds", total)
+
+        if slow_seconds is not None and total > slow_seconds:
+            metrics.increment(f"{name}_slow")
+            logger.warning(f"Slow request, {request.describe(total)}")
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Times a stage of the current request as `stage_seconds{stage="..."}`, works without a trace too
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def record(stage: str, seconds: float) -> None:
+    """
+    Adds an already measured stage to the current request
+    """
+    metrics.observe(f'stage_seconds{{stage="{stage}"}}', seconds)
+    request = current_trace.get()
+    if request is not None:
+        request.record(stage, seconds)
+
+
+def annotate(key: str, value: Union[int, float], histogram: bool = True) -> None:
+    """
+    Attaches a size to the current request and, unless told otherwise, records it as a histogram
+    """
+    if histogram:
+        metrics.observe(key, value, buckets=SIZE_BUCKETS)
+    request = current_trace.get()
+    if request is not None:
+        request.attributes[key] = value
@@ -0,0 +1,64 @@
+# Needed libs
+from source.utilities.metrics import metrics
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+import asyncio
+import time
+import os
+
+
+class WorkerPool:
+    def __init__(self, config: dict):
+        """
+        Runs CPU-bound and blocking steps of the prompt pipeline off the event loop
+
+        CPU-bound work (tokenizing) goes to a thread or process pool picked with `kind`. Hugging Face's fast
+        tokenizers release the GIL while encoding so threads are usually enough, processes also sidestep the GIL
+        but every worker loads its own tokenizer. Blocking I/O (reading a user's history from disk) always goes
+        to the threads, it has to reach objects that can't be sent to another process.
+
+        Config (settings.json['workers'], all optional):
+            - `kind`: "thread" or "process", defaults to "thread"
+            - `max_workers`: Workers per pool, defaults to min(4, cpu count)
+        """
+        settings = config.get("workers", {})
+        self.kind: str = settings.get("kind", "thread")
+        self.max_workers: int = settings.get("max_workers", min(4, os.cpu_count() or 1))
+
+        if self.kind not in ("thread", "process"):
+            raise ValueError(f"Unknown worker kind '{self.kind}', expected 'thread' or 'process'")
+
+        self._threads = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="worker")
+        self._processes: Optional[Executor] = (
+            ProcessPoolExecutor(max_workers=self.max_workers) if self.kind == "process" else None
+        )
+
+    async def run(self, func: Callable, *args: Any) -> Any:
+        """
+        Run CPU-bound work on the configured pool, `func` and its arguments must be picklable in process mode
+        """
+        return await self._submit(self._processes or self._threads, func, *args)
+
+    async def run_blocking(self, func: Callable, *args: Any) -> Any:
+        """
+        Run blocking I/O on the thread pool
+        """
+        return await self._submit(self._threads, func, *args)
+
+    def close(self) -> None:
+        """
+        Stop the workers once the work they were given is done
+        """
+        self._threads.shutdown(wait=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=True)
+
+    async def _submit(self, executor: Executor, func: Callable, *args: Any) -> Any:
+        """
+        Hand work to an executor, tracking how long it waited for a worker and ran
+        """
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        finally:
+            metrics.observe("worker_task_seconds", time.perf_counter() - start)